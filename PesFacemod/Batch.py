@@ -0,0 +1,264 @@
+""" Command line batch processing of face.fpk files, without Blender.
+
+Finds every <base>/<player_id>/#Win/face.fpk below the given folders and runs each one through unpack, validate,
+the requested transforms and repack, one face.fpk per worker process. From the folder holding the PesFacemod
+package:
+
+    python -m PesFacemod.Batch C:/faces --scale 1.02 --reencode-textures --workers 8
+    python -m PesFacemod.Batch C:/faces/real --renumber 12345:23456 --renumber 12346:23457
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field, replace
+from typing import Dict
+
+import numpy as np
+
+from . import Dxt, Fmdl, Fpk, Ftex, Renumber
+from .FmdlVertexBuffer import DEFAULT_MEMORY_BUDGET, face_problems, model_vertex_chunks
+from .PesFacemodGlobalData import texture_names
+from .TextureCache import TextureCache
+
+
+@dataclass
+class BatchOptions:
+    renumber: Dict[str, str] = field(default_factory=dict)
+    scale: float = 1.0
+    reencode_textures: bool = False
+    texture_quality: int = Dxt.QUALITY_NORMAL
+    texture_cache_path: str = None
+    validate_only: bool = False
+    # bytes of vertices validation decodes at a time
+    memory_budget: int = DEFAULT_MEMORY_BUDGET
+
+
+@dataclass
+class BatchResult:
+    face_fpk: str
+    output: str = None
+    error: str = None
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def seconds(self):
+        return sum(self.timings.values())
+
+
+@dataclass
+class FaceFiles:
+    """ Paths of a <base>/<player_id>/#Win/face.fpk and the files that go with it """
+    face_fpk: str
+
+    @property
+    def player_id(self):
+        return os.path.basename(self.player_path)
+
+    @property
+    def player_path(self):
+        return os.path.dirname(os.path.dirname(self.face_fpk))
+
+    @property
+    def fpk_folder(self):
+        return os.path.join(os.path.dirname(self.face_fpk), 'face_fpk')
+
+    def textures(self):
+        return [os.path.join(self.player_path, 'sourceimages', '#windx11', name) for name in texture_names]
+
+
+def is_face_fpk(path):
+    parts = os.path.normpath(os.path.abspath(path)).split(os.sep)
+    return len(parts) >= 3 and parts[-1].lower() == 'face.fpk' and parts[-2].lower() == '#win' and \
+        parts[-3].isdigit()
+
+
+def find_face_fpks(roots):
+    paths = []
+    for root in roots:
+        if os.path.isfile(root):
+            paths.append(root)
+            continue
+        for folder, folders, files in os.walk(root):
+            folders.sort()
+            paths.extend(os.path.join(folder, name) for name in sorted(files)
+                         if is_face_fpk(os.path.join(folder, name)))
+    return paths
+
+
+def scale_model(model, factor):
+    """ Scales the meshes, bounding boxes and bone positions of model """
+    mesh_buffers = []
+    for mesh_buffer in model.mesh_buffers:
+        positions = mesh_buffer.positions.copy()
+        positions['position'] *= factor
+        mesh_buffers.append(replace(mesh_buffer, positions=positions))
+    bounding_boxes = Fmdl.entry_table(Fmdl.BLOCK_BOUNDING_BOXES, model.bounding_boxes).copy()
+    for name in ('max_x', 'max_y', 'max_z', 'min_x', 'min_y', 'min_z'):
+        bounding_boxes[name] *= factor
+    bones = Fmdl.entry_table(Fmdl.BLOCK_BONES, model.bones).copy()
+    for name in ('local_x', 'local_y', 'local_z', 'world_x', 'world_y', 'world_z'):
+        bones[name] *= factor
+    return replace(model, mesh_buffers=mesh_buffers, bounding_boxes=bounding_boxes, bones=bones)
+
+
+def validate_model(model, name, memory_budget=DEFAULT_MEMORY_BUDGET):
+    problems = []
+    for index, mesh_buffer in enumerate(model.mesh_buffers):
+        vertex_count = len(mesh_buffer.positions)
+        if len(mesh_buffer.vertex_data) != vertex_count:
+            problems.append(f"{name} mesh {index}: {vertex_count} positions, {len(mesh_buffer.vertex_data)} "
+                            f"vertex data records")
+        out_of_range, degenerate = face_problems(mesh_buffer.faces, vertex_count)
+        if out_of_range.any():
+            problems.append(f"{name} mesh {index}: {np.count_nonzero(out_of_range)} triangles index past "
+                            f"{vertex_count} vertices, the first is triangle {np.flatnonzero(out_of_range)[0]}")
+    if problems:
+        return problems
+
+    # vertices are decoded memory_budget at a time, the first bad vertex of each mesh is reported
+    reported = set()
+    for index, start, vertices in model_vertex_chunks(model, memory_budget):
+        bad = np.flatnonzero(~np.isfinite(vertices.positions).all(axis=1))
+        if len(bad) and (index, 'position') not in reported:
+            reported.add((index, 'position'))
+            problems.append(f"{name} mesh {index}: vertex {start + bad[0]} position isn't a finite number")
+        if not len(vertices.bone_ids) or model.meshes[index].bone_group >= len(model.bone_groups):
+            continue
+        bone_count = len(model.bone_groups[model.meshes[index].bone_group].bones)
+        bad = np.flatnonzero(((vertices.bone_ids >= bone_count) & (vertices.bone_weights > 0)).any(axis=1))
+        if len(bad) and (index, 'bone') not in reported:
+            reported.add((index, 'bone'))
+            problems.append(f"{name} mesh {index}: vertex {start + bad[0]} weighted to a bone past the "
+                            f"{bone_count} of its bone group")
+    return problems
+
+
+def reencode_texture(texture, quality, cache=None):
+    """ Compresses texture.PNG, or the decoded texture.ftex when there is no PNG, to texture.ftex """
+    if os.path.exists(texture + '.PNG'):
+        return Ftex.png_to_ftex(texture + '.PNG', quality=quality, cache=cache)
+    ftex = Ftex.read(texture + '.ftex')
+    Ftex.write(Ftex.from_rgba(Ftex.to_rgba(ftex), quality, ftex), texture + '.ftex')
+    return texture + '.ftex'
+
+
+class Stages:
+    """ Times the stages of one face.fpk """
+
+    def __init__(self, result):
+        self.result = result
+
+    def __call__(self, name, function, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.result.timings[name] = self.result.timings.get(name, 0) + time.perf_counter() - start
+
+
+def process_face_fpk(face_fpk, options):
+    """ Unpacks, validates, transforms and repacks one face.fpk; never raises, failures go in the result """
+    result = BatchResult(face_fpk)
+    stage = Stages(result)
+    try:
+        files = FaceFiles(face_fpk)
+        if files.player_id in options.renumber:
+            files = FaceFiles(stage('renumber', Renumber.renumber_player, files.player_path,
+                                    options.renumber[files.player_id]))
+        with Fpk.FpkFile.open(files.face_fpk) as fpk:
+            names, references = fpk.names(), list(fpk.references)
+            stage('unpack', fpk.extract, files.fpk_folder)
+
+        models = {}
+        for name in names:
+            if name.lower().endswith('.fmdl'):
+                models[name] = stage('read', Fmdl.read, Fpk.entry_path(files.fpk_folder, name))
+        problems = [problem for name, model in models.items() for problem in
+                    validate_model(model, name, options.memory_budget)]
+        if problems:
+            raise Exception("; ".join(problems))
+        if options.validate_only:
+            return result
+
+        for name, model in models.items():
+            if options.scale != 1.0:
+                model = stage('scale', scale_model, model, options.scale)
+                stage('write', Fmdl.write, model, Fpk.entry_path(files.fpk_folder, name))
+
+        if options.reencode_textures:
+            cache = TextureCache(options.texture_cache_path) if options.texture_cache_path else None
+            for texture in files.textures():
+                if os.path.exists(texture + '.PNG') or os.path.exists(texture + '.ftex'):
+                    stage('textures', reencode_texture, texture, options.texture_quality, cache)
+
+        stage('pack', Fpk.pack, files.face_fpk, files.fpk_folder, names, references)
+        result.output = files.face_fpk
+    except Exception as ex:
+        result.error = f"{type(ex).__name__}: {ex}"
+    return result
+
+
+def run(face_fpks, options, workers=None):
+    """ Processes face_fpks on a pool of processes, printing each result as it arrives; returns the results """
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_face_fpk, face_fpk, options): face_fpk for face_fpk in face_fpks}
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result.timings.items())
+            if result.error is None:
+                print(f"OK    {result.output or result.face_fpk} ({result.seconds:.2f}s: {stages})")
+            else:
+                print(f"FAIL  {result.face_fpk} ({result.seconds:.2f}s): {result.error}")
+    return results
+
+
+def parse_renumber(values):
+    renumbering = {}
+    for value in values:
+        old, _, new = value.partition(':')
+        if not old.isdigit() or not new.isdigit():
+            raise argparse.ArgumentTypeError(f"--renumber takes OLD:NEW player ids, got '{value}'")
+        renumbering[old] = new
+    return renumbering
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m PesFacemod.Batch', description=__doc__.split('\n\n')[0])
+    parser.add_argument('paths', nargs='+', help="face.fpk files, or folders searched for <id>/#Win/face.fpk")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument('--validate-only', action='store_true', help="unpack and check, don't repack")
+    parser.add_argument('--renumber', action='append', default=[], metavar='OLD:NEW',
+                        help="copy player OLD to NEW and process the copy")
+    parser.add_argument('--scale', type=float, default=1.0, help="scale every model by this factor")
+    parser.add_argument('--reencode-textures', action='store_true',
+                        help="compress the PNG (or the current .ftex) of every texture again")
+    parser.add_argument('--texture-quality', type=int, default=Dxt.QUALITY_NORMAL,
+                        choices=(Dxt.QUALITY_FAST, Dxt.QUALITY_NORMAL, Dxt.QUALITY_HIGH))
+    parser.add_argument('--texture-cache', default=None, help="folder of the encoded texture cache")
+    parser.add_argument('--memory-budget', type=float, default=DEFAULT_MEMORY_BUDGET / 2 ** 20, metavar='MIB',
+                        help="MiB of vertices decoded at a time while validating")
+    arguments = parser.parse_args(argv)
+
+    options = BatchOptions(renumber=parse_renumber(arguments.renumber), scale=arguments.scale,
+                           reencode_textures=arguments.reencode_textures,
+                           texture_quality=arguments.texture_quality, texture_cache_path=arguments.texture_cache,
+                           validate_only=arguments.validate_only,
+                           memory_budget=int(arguments.memory_budget * 2 ** 20))
+    face_fpks = find_face_fpks(arguments.paths)
+    if not face_fpks:
+        print("No face.fpk found")
+        return 1
+    start = time.perf_counter()
+    results = run(face_fpks, options, arguments.workers)
+    failures = [result for result in results if result.error is not None]
+    print(f"{len(results) - len(failures)} of {len(results)} face.fpk files processed in "
+          f"{time.perf_counter() - start:.2f}s, {len(failures)} failed")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
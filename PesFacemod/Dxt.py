@@ -0,0 +1,224 @@
+""" DXT1 / DXT5 (BC1 / BC3) block compression with NumPy, on every 4x4 block of an image at once.
+
+Images are (height, width, 4) uint8 RGBA arrays. Compressed data is the DDS / FTEX mip map layout: 8 (DXT1) or
+16 (DXT5) bytes per block, blocks in rows from the top left.
+"""
+import numpy as np
+
+# Encoder quality / speed trade-off
+QUALITY_FAST = 0  # bounding box end points
+QUALITY_NORMAL = 1  # end points along the principal axis of each block, refined once by least squares
+QUALITY_HIGH = 2  # like QUALITY_NORMAL with three refinement passes
+
+# least squares refinement passes per quality
+REFINEMENT_PASSES = {QUALITY_FAST: 0, QUALITY_NORMAL: 1, QUALITY_HIGH: 3}
+
+# blocks encoded per pass, small enough for the temporary arrays to stay in cache
+BATCH_BLOCKS = 1 << 13
+
+PIXEL_SHIFTS = np.arange(16, dtype=np.uint64)
+# block index of each palette level, levels running from the first end point to the second
+COLOR_INDICES = np.array([0, 2, 3, 1], dtype=np.uint64)
+ALPHA_INDICES = np.array([1, 7, 6, 5, 4, 3, 2, 0], dtype=np.uint64)
+
+
+def to_blocks(rgba):
+    """ (height, width, channels) image to (blocks, 16, channels); partial blocks repeat the last row / column """
+    height, width, channels = rgba.shape
+    if height % 4 or width % 4:
+        rgba = np.pad(rgba, ((0, -height % 4), (0, -width % 4), (0, 0)), mode='edge')
+    rows, columns = rgba.shape[0] // 4, rgba.shape[1] // 4
+    return rgba.reshape(rows, 4, columns, 4, channels).transpose(0, 2, 1, 3, 4).reshape(rows * columns, 16, channels)
+
+
+def from_blocks(blocks, height, width):
+    rows, columns = (height + 3) // 4, (width + 3) // 4
+    channels = blocks.shape[-1]
+    image = blocks.reshape(rows, columns, 4, 4, channels).transpose(0, 2, 1, 3, 4)
+    return image.reshape(rows * 4, columns * 4, channels)[:height, :width]
+
+
+def unpack_565(colors):
+    """ 5:6:5 colors to (..., 3) int32 8 bit channels, replicating the high bits """
+    colors = colors.astype(np.int32)
+    r, g, b = (colors >> 11) & 31, (colors >> 5) & 63, colors & 31
+    return np.stack(((r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)), axis=-1)
+
+
+def pack_565(rgb):
+    rgb = np.clip(np.rint(rgb * (np.array([31, 63, 31], dtype=np.float32) / 255)), 0, [31, 63, 31]).astype(np.uint16)
+    return (rgb[..., 0] << 11) | (rgb[..., 1] << 5) | rgb[..., 2]
+
+
+def color_palette(color0, color1, four_color=True):
+    """ (blocks, 4, 3) palettes of 5:6:5 end point pairs, and whether each block has a transparent entry """
+    end_points = unpack_565(np.stack((color0, color1), axis=1))
+    c0, c1 = end_points[:, 0], end_points[:, 1]
+    palette = np.stack((c0, c1, (2 * c0 + c1 + 1) // 3, (c0 + 2 * c1 + 1) // 3), axis=1)
+    transparent = np.zeros(len(palette), dtype=bool) if four_color else color0 <= color1
+    palette[transparent, 2] = (c0[transparent] + c1[transparent] + 1) // 2
+    palette[transparent, 3] = 0
+    return palette, transparent
+
+
+def alpha_palette(alpha0, alpha1):
+    """ (blocks, 8) palettes; eight interpolated values when alpha0 > alpha1, else six plus 0 and 255 """
+    a0, a1 = alpha0.astype(np.int32)[:, None], alpha1.astype(np.int32)[:, None]
+    steps = np.arange(1, 7)
+    eight = ((7 - steps) * a0 + steps * a1 + 3) // 7
+    six = ((5 - steps[:4]) * a0 + steps[:4] * a1 + 2) // 5
+    six = np.concatenate((six, np.zeros_like(a0), np.full_like(a0, 255)), axis=1)
+    return np.concatenate((a0, a1, np.where(a0 > a1, eight, six)), axis=1)
+
+
+def decode_color_blocks(blocks, four_color):
+    colors = np.ascontiguousarray(blocks[:, :4]).view('<u2')
+    indices = np.ascontiguousarray(blocks[:, 4:8]).view('<u4')[:, 0].astype(np.uint64)
+    palette, transparent = color_palette(colors[:, 0], colors[:, 1], four_color)
+    selected = ((indices[:, None] >> (PIXEL_SHIFTS * 2)) & 3).astype(np.intp)
+    rgb = np.take_along_axis(palette, selected[..., None], axis=1)
+    alpha = np.where(transparent[:, None] & (selected == 3), 0, 255)
+    return rgb, alpha
+
+
+def decode_alpha_blocks(blocks):
+    bits = np.zeros(len(blocks), dtype=np.uint64)
+    for byte in range(6):
+        bits |= blocks[:, 2 + byte].astype(np.uint64) << np.uint64(8 * byte)
+    selected = ((bits[:, None] >> (PIXEL_SHIFTS * 3)) & 7).astype(np.intp)
+    return np.take_along_axis(alpha_palette(blocks[:, 0], blocks[:, 1]), selected, axis=1)
+
+
+def decode_dxt1(data, width, height):
+    blocks = np.frombuffer(data, dtype=np.uint8).reshape(-1, 8)
+    rgb, alpha = decode_color_blocks(blocks, four_color=False)
+    pixels = np.concatenate((rgb, alpha[..., None]), axis=-1).astype(np.uint8)
+    return from_blocks(pixels, height, width)
+
+
+def decode_dxt5(data, width, height):
+    blocks = np.frombuffer(data, dtype=np.uint8).reshape(-1, 16)
+    rgb, _ = decode_color_blocks(blocks[:, 8:], four_color=True)
+    alpha = decode_alpha_blocks(blocks)
+    pixels = np.concatenate((rgb, alpha[..., None]), axis=-1).astype(np.uint8)
+    return from_blocks(pixels, height, width)
+
+
+def principal_axis(r, g, b, iterations=4):
+    """ Dominant direction of each block's colors, by power iteration on the covariance; unit (blocks,) components """
+    r, g, b = r - r.mean(axis=0), g - g.mean(axis=0), b - b.mean(axis=0)
+    rr, gg, bb = (r * r).sum(axis=0), (g * g).sum(axis=0), (b * b).sum(axis=0)
+    rg, rb, gb = (r * g).sum(axis=0), (r * b).sum(axis=0), (g * b).sum(axis=0)
+    x, y, z = r.max(axis=0) - r.min(axis=0), g.max(axis=0) - g.min(axis=0), b.max(axis=0) - b.min(axis=0)
+    for _ in range(iterations):
+        x, y, z = rr * x + rg * y + rb * z, rg * x + gg * y + gb * z, rb * x + gb * y + bb * z
+        norm = np.maximum(np.maximum(np.abs(x), np.abs(y)), np.maximum(np.abs(z), 1e-12))
+        x, y, z = x / norm, y / norm, z / norm
+    # unit length (zero for flat blocks), so projections on the axis are distances along it
+    length = np.maximum(np.sqrt(x * x + y * y + z * z), 1e-12)
+    return x / length, y / length, z / length
+
+
+def fit_colors(rgb, color0, color1):
+    """ Palette levels (0 = color0 .. 3 = color1) of every pixel and the squared error, for 5:6:5 end points.
+
+    The end points are ordered so the block decodes in four color mode; pixels are projected on the line between
+    them to pick the closest of the four colors.
+    """
+    swap = color0 < color1
+    color0, color1 = np.where(swap, color1, color0), np.where(swap, color0, color1)
+    end0, end1 = unpack_565(color0).T.astype(np.float32), unpack_565(color1).T.astype(np.float32)
+    direction = end1 - end0
+    direction *= 3 / np.maximum((direction * direction).sum(axis=0), 1)
+    projection = (rgb[0] - end0[0]) * direction[0]
+    projection += (rgb[1] - end0[1]) * direction[1]
+    projection += (rgb[2] - end0[2]) * direction[2]
+    levels = np.clip(np.rint(projection, out=projection), 0, 3, out=projection)
+    error = np.zeros(len(color0), dtype=np.float32)
+    for channel in range(3):
+        # palette value of a level: ((3 - level) * c0 + level * c1 + 1) // 3
+        difference = np.floor((end0[channel] * 3 + 1 + levels * (end1[channel] - end0[channel])) / 3)
+        difference -= rgb[channel]
+        error += (difference * difference).sum(axis=0)
+    return color0, color1, levels, error
+
+
+def refine_end_points(rgb, levels):
+    """ Least squares end points for fixed palette levels, and which blocks have a unique solution """
+    b = levels / 3
+    a = 1 - b
+    aa, bb, ab = (a * a).sum(axis=0), (b * b).sum(axis=0), (a * b).sum(axis=0)
+    determinant = aa * bb - ab * ab
+    solvable = determinant > 1e-6
+    determinant = np.where(solvable, determinant, 1)
+    end0, end1 = [], []
+    for channel in rgb:
+        ap, bp = (a * channel).sum(axis=0), (b * channel).sum(axis=0)
+        end0.append((bb * ap - ab * bp) / determinant)
+        end1.append((aa * bp - ab * ap) / determinant)
+    return np.stack(end0, axis=1), np.stack(end1, axis=1), solvable
+
+
+def pack_indices(indices, bits):
+    """ (16, blocks) indices to one little endian integer per block, pixel 0 in the lowest bits """
+    return (indices << (PIXEL_SHIFTS[:, None] * np.uint64(bits))).sum(axis=0, dtype=np.uint64)
+
+
+def encode_color_blocks(rgb, quality):
+    """ rgb is a (3, 16, blocks) float32 array; returns the (blocks, 8) color halves of the blocks """
+    if quality == QUALITY_FAST:
+        low, high = rgb.min(axis=1).T, rgb.max(axis=1).T
+        inset = (high - low) / 16
+        end0, end1 = high - inset, low + inset
+    else:
+        mean = rgb.mean(axis=1)
+        axis = principal_axis(*rgb)
+        projection = (rgb[0] - mean[0]) * axis[0] + (rgb[1] - mean[1]) * axis[1] + (rgb[2] - mean[2]) * axis[2]
+        axis = np.stack(axis, axis=1)
+        end0 = mean.T + axis * projection.max(axis=0)[:, None]
+        end1 = mean.T + axis * projection.min(axis=0)[:, None]
+    color0, color1, levels, error = fit_colors(rgb, pack_565(end0), pack_565(end1))
+    for _ in range(REFINEMENT_PASSES[quality]):
+        end0, end1, solvable = refine_end_points(rgb, levels)
+        refined = fit_colors(rgb, pack_565(end0), pack_565(end1))
+        better = solvable & (refined[3] < error)
+        color0, color1 = np.where(better, refined[0], color0), np.where(better, refined[1], color1)
+        levels, error = np.where(better, refined[2], levels), np.where(better, refined[3], error)
+    bits = pack_indices(COLOR_INDICES[levels.astype(np.intp)], 2).astype('<u4')
+    return np.concatenate((np.stack((color0, color1), axis=1).astype('<u2').view(np.uint8),
+                           bits[:, None].view(np.uint8)), axis=1)
+
+
+def encode_alpha_blocks(alpha):
+    """ alpha is a (16, blocks) float32 array; returns the (blocks, 8) alpha halves of the blocks """
+    alpha0, alpha1 = alpha.max(axis=0), alpha.min(axis=0)
+    levels = np.rint((alpha - alpha1) * (7 / np.maximum(alpha0 - alpha1, 1)))
+    bits = pack_indices(ALPHA_INDICES[levels.astype(np.intp)], 3).astype('<u8')
+    return np.concatenate((np.stack((alpha0, alpha1), axis=1).astype(np.uint8),
+                           bits[:, None].view(np.uint8)[:, :6]), axis=1)
+
+
+def encode_dxt5(rgba, quality=QUALITY_NORMAL):
+    """ Compresses an RGBA image; returns the DXT5 blocks as bytes """
+    blocks = to_blocks(np.asarray(rgba, dtype=np.uint8))
+    encoded = np.empty((len(blocks), 16), dtype=np.uint8)
+    for start in range(0, len(blocks), BATCH_BLOCKS):
+        # channel and pixel major, so the per block reductions run over contiguous rows
+        channels = np.ascontiguousarray(blocks[start:start + BATCH_BLOCKS].transpose(2, 1, 0), dtype=np.float32)
+        encoded[start:start + BATCH_BLOCKS, :8] = encode_alpha_blocks(channels[3])
+        encoded[start:start + BATCH_BLOCKS, 8:] = encode_color_blocks(channels[:3], quality)
+    return encoded.tobytes()
+
+
+def mip_maps(rgba):
+    """ The image followed by its 2x2 box filtered reductions, down to 1x1. Odd last rows / columns are dropped. """
+    levels = [np.asarray(rgba, dtype=np.uint8)]
+    while levels[-1].shape[0] > 1 or levels[-1].shape[1] > 1:
+        image = levels[-1].astype(np.float32)
+        height, width = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+        if height:
+            image = (image[0:height:2] + image[1:height:2]) / 2
+        if width:
+            image = (image[:, 0:width:2] + image[:, 1:width:2]) / 2
+        levels.append(np.rint(image).astype(np.uint8))
+    return levels
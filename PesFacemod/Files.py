@@ -0,0 +1,21 @@
+""" Writing files so that nobody reading them sees half of one. """
+import contextlib
+import os
+import threading
+
+
+def replace_file(path, data):
+    """ Writes data to a temporary file next to path and renames it over path.
+
+    A hard linked path is replaced rather than changed for every link, and a failed write leaves path as it was.
+    The temporary name is unique per process and thread, so concurrent writers of one path don't collide.
+    """
+    temporary_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    try:
+        with open(temporary_path, 'wb') as out_file:
+            out_file.write(data)
+        os.replace(temporary_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temporary_path)
+        raise
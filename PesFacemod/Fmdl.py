@@ -0,0 +1,951 @@
+""" FMDL (Fox engine model) reader and writer.
+
+Pure data - no Blender imports - so models can be decoded, validated, converted and written outside of Blender.
+See fdml.md for the layout of every block.
+"""
+import mmap
+import re
+import struct
+from dataclasses import dataclass, field, fields, astuple, is_dataclass, replace
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from . import Profile
+from .FmdlVertexBuffer import split_vertex_formats, submesh_dtypes, read_records, align, layout_stream, \
+    layout_faces, as_bytes
+
+# Section 0 block ids
+BLOCK_BONES = 0x00
+BLOCK_MESH_GROUPS = 0x01
+BLOCK_MESH_GROUP_ASSIGNMENTS = 0x02
+BLOCK_MESHES = 0x03
+BLOCK_MATERIAL_INSTANCES = 0x04
+BLOCK_BONE_GROUPS = 0x05
+BLOCK_TEXTURES = 0x06
+BLOCK_MATERIAL_PARAMETERS = 0x07
+BLOCK_MATERIALS = 0x08
+BLOCK_MESH_FORMAT_ASSIGNMENTS = 0x09
+BLOCK_MESH_FORMATS = 0x0A
+BLOCK_VERTEX_FORMATS = 0x0B
+BLOCK_STRINGS = 0x0C
+BLOCK_BOUNDING_BOXES = 0x0D
+BLOCK_BUFFER_OFFSETS = 0x0E
+BLOCK_LODS = 0x10
+BLOCK_FACE_INDICES = 0x11
+BLOCK_0x12 = 0x12
+BLOCK_0x14 = 0x14
+
+# Section 1 block ids
+SECTION1_MATERIAL_PARAMETERS = 0
+SECTION1_UNKNOWN = 1
+SECTION1_VERTEX_BUFFER = 2
+SECTION1_STRINGS = 3
+
+# 0x0E entries
+BUFFER_POSITIONS = 0
+BUFFER_VERTEX_DATA = 1
+BUFFER_FACES = 2
+
+LODS_PER_MESH = 8
+# zero bytes after the vertex buffer of models that don't come with their own
+VERTEX_BUFFER_TRAILER_SIZE = 32
+
+HEADER = struct.Struct("<4sfQQQ2I2I2I8x")
+SECTION0_BLOCK = struct.Struct("<2HI")
+SECTION1_BLOCK = struct.Struct("<3I")
+
+
+@dataclass
+class FmdlHeader:
+    signature: bytes = b'FMDL'
+    version: float = 2.03
+    blocks_offset: int = HEADER.size
+    section0_flags: int = 0
+    section1_flags: int = 0
+    section0_block_count: int = 0
+    section1_block_count: int = 0
+    section0_offset: int = 0
+    section0_length: int = 0
+    section1_offset: int = 0
+    section1_length: int = 0
+
+
+@dataclass
+class Section0Block:
+    block_id: int
+    entry_count: int
+    offset: int
+
+
+@dataclass
+class Section1Block:
+    block_id: int
+    offset: int
+    length: int
+
+
+@dataclass
+class Bone:
+    name_index: int
+    parent: int
+    bounding_box: int
+    unknown0: int
+    unknown1: int
+    padding: int
+    local_x: float
+    local_y: float
+    local_z: float
+    local_w: float
+    world_x: float
+    world_y: float
+    world_z: float
+    world_w: float
+
+
+@dataclass
+class MeshGroup:
+    name_index: int
+    invisible: int
+    parent: int
+    unknown: int = 0xFFFF
+
+
+@dataclass
+class MeshGroupAssignment:
+    mesh_group: int
+    mesh_count: int
+    first_mesh: int
+    entry_id: int
+    unknown: int
+
+
+@dataclass
+class Mesh:
+    # not 'flags', which record arrays already have
+    mesh_flags: int
+    material_instance: int
+    bone_group: int
+    entry_id: int
+    vertex_count: int
+    first_face_vertex: int
+    face_vertex_count: int
+    first_face_index: int
+
+
+@dataclass
+class MaterialInstance:
+    name_index: int
+    material: int
+    texture_count: int
+    parameter_count: int
+    first_texture: int
+    first_parameter: int
+
+
+@dataclass
+class BoneGroup:
+    unknown: int
+    bones: List[int]
+
+
+@dataclass
+class Texture:
+    name_index: int
+    path_index: int
+
+
+@dataclass
+class MaterialParameter:
+    type_name_index: int
+    reference: int
+
+
+@dataclass
+class Material:
+    name_index: int
+    type_index: int
+
+
+@dataclass
+class MeshFormatAssignment:
+    mesh_format_count: int
+    vertex_format_count: int
+    unknown: int
+    first_mesh_format: int
+    first_vertex_format: int
+
+
+@dataclass
+class MeshFormat:
+    buffer_offset_id: int
+    vertex_format_count: int
+    length: int
+    type: int
+    offset: int
+
+
+@dataclass
+class VertexFormat:
+    usage: int
+    data_type: int
+    offset: int
+
+
+@dataclass
+class BoundingBox:
+    max_x: float
+    max_y: float
+    max_z: float
+    max_w: float
+    min_x: float
+    min_y: float
+    min_z: float
+    min_w: float
+
+
+@dataclass
+class BufferOffset:
+    unknown: int
+    length: int
+    offset: int
+
+
+@dataclass
+class Lod:
+    lod_count: int
+    hd_distance: float
+    sd_distance: float
+    lo_distance: float
+
+
+@dataclass
+class FaceIndex:
+    first_face_vertex: int
+    face_vertex_count: int
+
+
+@dataclass
+class MeshBuffer:
+    """ Vertex and face data of one mesh, as stored in section 1 block 2 (Fox engine orientation and winding).
+
+    positions and vertex_data are structured arrays with the mesh's vertex format dtypes, faces is (n, 3) uint16.
+    """
+    positions: np.ndarray
+    vertex_data: np.ndarray
+    faces: np.ndarray
+
+
+class Entry(np.record):
+    """ One record of an EntryTable; fields read as Python ints and floats, like the entry dataclasses """
+
+    def __getattribute__(self, name):
+        value = np.record.__getattribute__(self, name)
+        return value.item() if isinstance(value, np.generic) else value
+
+
+class EntryTable(np.recarray):
+    """ Record array whose records are Entry, so arithmetic on fields doesn't wrap around at the on-disk width """
+
+    def __array_finalize__(self, obj):
+        if self.dtype.type is not Entry and self.dtype.names is not None:
+            self.dtype = self.dtype
+
+    def __setattr__(self, name, value):
+        # np.recarray turns every structured dtype set here back into np.record
+        if name == 'dtype' and value.names is not None:
+            object.__setattr__(self, name, np.dtype((Entry, value)))
+        else:
+            super().__setattr__(name, value)
+
+    def copy(self):
+        """ Writable copy, padding bytes included - ndarray.copy() copies the fields only, leaving garbage between """
+        records = np.ascontiguousarray(self.view(np.ndarray).view(f'V{self.dtype.itemsize}'))
+        return np.frombuffer(bytearray(records), dtype=self.dtype).view(EntryTable)
+
+
+class FmdlBlocks:
+    """ Block directory lookups shared by FmdlModel and FmdlFile """
+
+    def has_block(self, block_id):
+        return self.section0_block(block_id) is not None
+
+    def section0_block(self, block_id):
+        for block in self.section0_blocks:
+            if block.block_id == block_id:
+                return block
+        return None
+
+    def has_section1_block(self, block_id):
+        return self.section1_block(block_id) is not None
+
+    def section1_block(self, block_id):
+        for block in self.section1_blocks:
+            if block.block_id == block_id:
+                return block
+        return None
+
+    def vertex_dtypes(self, mesh_index):
+        """ Record dtypes of the position and vertex data streams of a mesh """
+        assignment = self.mesh_format_assignments[mesh_index]
+        first = assignment.first_mesh_format
+        mesh_formats = entry_table(BLOCK_MESH_FORMATS, self.mesh_formats)[
+            first:first + assignment.mesh_format_count].tolist()
+        format_defs = split_vertex_formats(entry_table(BLOCK_VERTEX_FORMATS, self.vertex_formats).tolist())
+        return submesh_dtypes(format_defs[mesh_index], mesh_formats)
+
+
+def empty_table(block_id):
+    return field(default_factory=lambda: entry_table(block_id))
+
+
+@dataclass
+class FmdlModel(FmdlBlocks):
+    """ A whole .fmdl file.
+
+    Fixed size section 0 blocks are entry tables (see entry_table): record arrays laid out like the block on disk,
+    whose records read like the entry dataclasses (model.bones[0].local_x). Decoded tables are read-only views into
+    the file data; copy() one to change it. A model being put together may hold lists of entry dataclasses instead,
+    they are converted when it is written.
+    """
+    header: FmdlHeader = field(default_factory=FmdlHeader)
+    section0_blocks: List[Section0Block] = field(default_factory=list)
+    section1_blocks: List[Section1Block] = field(default_factory=list)
+    bones: EntryTable = empty_table(BLOCK_BONES)
+    mesh_groups: EntryTable = empty_table(BLOCK_MESH_GROUPS)
+    mesh_group_assignments: EntryTable = empty_table(BLOCK_MESH_GROUP_ASSIGNMENTS)
+    meshes: EntryTable = empty_table(BLOCK_MESHES)
+    material_instances: EntryTable = empty_table(BLOCK_MATERIAL_INSTANCES)
+    bone_groups: List[BoneGroup] = field(default_factory=list)
+    textures: EntryTable = empty_table(BLOCK_TEXTURES)
+    material_parameters: EntryTable = empty_table(BLOCK_MATERIAL_PARAMETERS)
+    materials: EntryTable = empty_table(BLOCK_MATERIALS)
+    mesh_format_assignments: EntryTable = empty_table(BLOCK_MESH_FORMAT_ASSIGNMENTS)
+    mesh_formats: EntryTable = empty_table(BLOCK_MESH_FORMATS)
+    vertex_formats: EntryTable = empty_table(BLOCK_VERTEX_FORMATS)
+    strings: List[str] = field(default_factory=list)
+    bounding_boxes: EntryTable = empty_table(BLOCK_BOUNDING_BOXES)
+    buffer_offsets: EntryTable = empty_table(BLOCK_BUFFER_OFFSETS)
+    lods: EntryTable = empty_table(BLOCK_LODS)
+    face_indices: EntryTable = empty_table(BLOCK_FACE_INDICES)
+    block_0x12: List[bytes] = field(default_factory=list)
+    block_0x14: List[bytes] = field(default_factory=list)
+    # bytes of the section 0 blocks that aren't decoded, by block id
+    unknown_blocks: Dict[int, bytes] = field(default_factory=dict)
+    material_parameter_data: bytes = b''
+    section1_unknown_data: Optional[bytes] = None
+    mesh_buffers: List[MeshBuffer] = field(default_factory=list)
+    # what follows the vertex buffer (section 1 block 2) up to the next section 1 block, possibly LOD related
+    vertex_buffer_trailer: bytes = bytes(VERTEX_BUFFER_TRAILER_SIZE)
+
+
+# Fixed size entries: on-disk layout and the dataclass naming its fields
+ENTRY_LAYOUTS = {
+    BLOCK_BONES: (struct.Struct("<6H4x4f4f"), Bone),
+    BLOCK_MESH_GROUPS: (struct.Struct("<HBx2H"), MeshGroup),
+    BLOCK_MESH_GROUP_ASSIGNMENTS: (struct.Struct("<4x4H4xH14x"), MeshGroupAssignment),
+    BLOCK_MESHES: (struct.Struct("<I4H4x3I20x"), Mesh),
+    BLOCK_MATERIAL_INSTANCES: (struct.Struct("<H2xH2B2H4x"), MaterialInstance),
+    BLOCK_TEXTURES: (struct.Struct("<2H"), Texture),
+    BLOCK_MATERIAL_PARAMETERS: (struct.Struct("<2H"), MaterialParameter),
+    BLOCK_MATERIALS: (struct.Struct("<2H"), Material),
+    BLOCK_MESH_FORMAT_ASSIGNMENTS: (struct.Struct("<2B3H"), MeshFormatAssignment),
+    BLOCK_MESH_FORMATS: (struct.Struct("<4BI"), MeshFormat),
+    BLOCK_VERTEX_FORMATS: (struct.Struct("<2BH"), VertexFormat),
+    BLOCK_BOUNDING_BOXES: (struct.Struct("<8f"), BoundingBox),
+    BLOCK_BUFFER_OFFSETS: (struct.Struct("<3I4x"), BufferOffset),
+    BLOCK_LODS: (struct.Struct("<I3f"), Lod),
+    BLOCK_FACE_INDICES: (struct.Struct("<2I"), FaceIndex),
+}
+BONE_GROUP = struct.Struct("<2H")
+BONE_GROUP_SIZE = 0x44
+STRING_DEF = struct.Struct("<2HI")
+RAW_ENTRY_SIZES = {
+    BLOCK_0x12: 8,
+    BLOCK_0x14: 32,
+}
+
+
+def entry_dtype(layout):
+    """ Structured dtype with the fields of the entry dataclass at their struct offsets, padding included """
+    entry_struct, entry_class = layout
+    names = [entry_field.name for entry_field in fields(entry_class)]
+    formats, offsets = [], []
+    offset = 0
+    for count, code in re.findall(r'(\d*)([a-zA-Z?])', entry_struct.format):
+        count = int(count or 1)
+        if code == 'x':
+            offset += count
+            continue
+        for _ in range(count):
+            formats.append('<' + code)
+            offsets.append(offset)
+            offset += struct.calcsize('<' + code)
+    if len(formats) != len(names) or offset != entry_struct.size:
+        raise Exception(f"{entry_class.__name__}: fields don't match '{entry_struct.format}'")
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': entry_struct.size})
+
+
+ENTRY_DTYPES = {block_id: entry_dtype(layout) for block_id, layout in ENTRY_LAYOUTS.items()}
+KNOWN_BLOCKS = set(ENTRY_LAYOUTS) | set(RAW_ENTRY_SIZES) | {BLOCK_BONE_GROUPS, BLOCK_STRINGS}
+
+# order in which section 0 blocks are written
+SECTION0_ORDER = [BLOCK_BONES, BLOCK_MESH_GROUPS, BLOCK_MESH_GROUP_ASSIGNMENTS, BLOCK_MESHES,
+                  BLOCK_MATERIAL_INSTANCES, BLOCK_BONE_GROUPS, BLOCK_TEXTURES, BLOCK_MATERIAL_PARAMETERS,
+                  BLOCK_MATERIALS, BLOCK_MESH_FORMAT_ASSIGNMENTS, BLOCK_MESH_FORMATS, BLOCK_VERTEX_FORMATS,
+                  BLOCK_STRINGS, BLOCK_BOUNDING_BOXES, BLOCK_BUFFER_OFFSETS, BLOCK_LODS, BLOCK_FACE_INDICES,
+                  BLOCK_0x12, BLOCK_0x14]
+
+
+def entry_table(block_id, entries=()):
+    """ Record array of a fixed size block, as stored on disk.
+
+    entries is a table already (returned as is), or entry dataclasses or tuples. Padding bytes of new tables are zero.
+    """
+    dtype = ENTRY_DTYPES[block_id]
+    if isinstance(entries, np.ndarray) and entries.dtype == dtype:
+        return entries.view(EntryTable)
+    table = np.zeros(len(entries), dtype=dtype)
+    if len(entries):
+        table[:] = [astuple(entry) if is_dataclass(entry) else tuple(entry) for entry in entries]
+    return table.view(EntryTable)
+
+
+def decode_entries(data, block_id):
+    """ Entry table of a block, a view into data """
+    return np.frombuffer(data, dtype=ENTRY_DTYPES[block_id]).view(EntryTable)
+
+
+def decode_bone_groups(data, count):
+    bone_groups = []
+    for group in range(count):
+        group_offset = group * BONE_GROUP_SIZE
+        unknown, bone_count = BONE_GROUP.unpack_from(data, group_offset)
+        bones = list(struct.unpack_from("<%dH" % bone_count, data, group_offset + BONE_GROUP.size))
+        bone_groups.append(BoneGroup(unknown, bones))
+    return bone_groups
+
+
+def decode_strings(string_defs, string_data):
+    strings = []
+    for string_type, string_length, string_offset in STRING_DEF.iter_unpack(string_defs):
+        strings.append(bytes(string_data[string_offset:string_offset + string_length]).decode("utf-8"))
+    return strings
+
+
+def lazy_block(decode):
+    """ Property that decodes on first access and caches the result """
+    def get(self):
+        return self.cached(decode.__name__, lambda: decode(self))
+    return property(get, doc=decode.__doc__)
+
+
+def entry_block(block_id):
+    """ Lazily decoded entry table of a fixed size section 0 block """
+    def get(self):
+        return self.cached(block_id, lambda: self.decode_entries(block_id))
+    return property(get)
+
+
+class FmdlFile(FmdlBlocks):
+    """ Lazily decoded .fmdl file.
+
+    The header and both block directories are read when the file is opened; every block is read and decoded
+    on first access and cached, so tools that only need e.g. the strings read a few hundred bytes per file.
+    source is a bytes-like object or a binary file opened for reading.
+
+    With a bytes-like source (or a mapping, see map()) blocks are sliced out of it without copying: mesh buffers
+    are np.frombuffer views into the source.
+    """
+
+    bones = entry_block(BLOCK_BONES)
+    mesh_groups = entry_block(BLOCK_MESH_GROUPS)
+    mesh_group_assignments = entry_block(BLOCK_MESH_GROUP_ASSIGNMENTS)
+    meshes = entry_block(BLOCK_MESHES)
+    material_instances = entry_block(BLOCK_MATERIAL_INSTANCES)
+    textures = entry_block(BLOCK_TEXTURES)
+    material_parameters = entry_block(BLOCK_MATERIAL_PARAMETERS)
+    materials = entry_block(BLOCK_MATERIALS)
+    mesh_format_assignments = entry_block(BLOCK_MESH_FORMAT_ASSIGNMENTS)
+    mesh_formats = entry_block(BLOCK_MESH_FORMATS)
+    vertex_formats = entry_block(BLOCK_VERTEX_FORMATS)
+    bounding_boxes = entry_block(BLOCK_BOUNDING_BOXES)
+    buffer_offsets = entry_block(BLOCK_BUFFER_OFFSETS)
+    lods = entry_block(BLOCK_LODS)
+    face_indices = entry_block(BLOCK_FACE_INDICES)
+
+    def __init__(self, source):
+        if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+            self.file = None
+            self.data = memoryview(source)
+        else:
+            self.file = source
+            self.data = None
+        self.mapping = None
+        self.cache = {}
+
+        self.header = FmdlHeader(*HEADER.unpack(self.read(0, HEADER.size)))
+        header = self.header
+        if header.signature != b'FMDL':
+            print(f"Warning: wrong header - expected 'FMDL', got '{header.signature}'")
+
+        section0_size = SECTION0_BLOCK.size * header.section0_block_count
+        directory = self.read(header.blocks_offset, section0_size + SECTION1_BLOCK.size * header.section1_block_count)
+        self.section0_blocks = [Section0Block(*values) for values in
+                                SECTION0_BLOCK.iter_unpack(directory[:section0_size])]
+        self.section1_blocks = [Section1Block(*values) for values in
+                                SECTION1_BLOCK.iter_unpack(directory[section0_size:])]
+
+    @classmethod
+    def open(cls, path):
+        return cls(open(path, 'rb'))
+
+    @classmethod
+    def map(cls, path):
+        """ Memory-maps the file; the OS pages in only the blocks that get decoded """
+        with open(path, 'rb') as fmdl_file:
+            mapping = mmap.mmap(fmdl_file.fileno(), 0, access=mmap.ACCESS_READ)
+        fmdl = cls(mapping)
+        fmdl.mapping = mapping
+        return fmdl
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        if self.mapping is not None:
+            self.data.release()
+            try:
+                self.mapping.close()
+            except BufferError:
+                # mesh buffers still point into the mapping, it is unmapped once they are gone
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def cached(self, key, decode):
+        if key not in self.cache:
+            with Profile.stage('decode block', block=key):
+                self.cache[key] = decode()
+        return self.cache[key]
+
+    def read(self, offset, length):
+        if self.file is None:
+            return self.data[offset:offset + length]
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def read_section0_block(self, block_id, entry_size):
+        block = self.section0_block(block_id)
+        if block is None:
+            return None, 0
+        return self.read(self.header.section0_offset + block.offset, entry_size * block.entry_count), block.entry_count
+
+    def read_section1_block(self, block_id):
+        block = self.section1_block(block_id)
+        if block is None:
+            return None
+        return self.read(self.header.section1_offset + block.offset, block.length)
+
+    def decode_entries(self, block_id):
+        data, count = self.read_section0_block(block_id, ENTRY_DTYPES[block_id].itemsize)
+        return entry_table(block_id) if data is None else decode_entries(data, block_id)
+
+    def decode_raw_entries(self, block_id):
+        size = RAW_ENTRY_SIZES[block_id]
+        data, count = self.read_section0_block(block_id, size)
+        return [bytes(data[i * size:(i + 1) * size]) for i in range(count)]
+
+    @lazy_block
+    def bone_groups(self):
+        data, count = self.read_section0_block(BLOCK_BONE_GROUPS, BONE_GROUP_SIZE)
+        return decode_bone_groups(data, count)
+
+    @lazy_block
+    def strings(self):
+        string_defs, count = self.read_section0_block(BLOCK_STRINGS, STRING_DEF.size)
+        if string_defs is None:
+            return []
+        return decode_strings(string_defs, self.read_section1_block(SECTION1_STRINGS))
+
+    @lazy_block
+    def block_0x12(self):
+        return self.decode_raw_entries(BLOCK_0x12)
+
+    @lazy_block
+    def block_0x14(self):
+        return self.decode_raw_entries(BLOCK_0x14)
+
+    @lazy_block
+    def unknown_blocks(self):
+        """ Bytes of every unknown section 0 block, up to the next block (or the end of section 0) """
+        header = self.header
+        section0_end = header.section1_offset - header.section0_offset
+        if 0 < header.section0_length < section0_end:
+            section0_end = header.section0_length
+        starts = sorted({block.offset for block in self.section0_blocks} | {section0_end})
+        unknown_blocks = {}
+        for block in self.section0_blocks:
+            if block.block_id not in KNOWN_BLOCKS:
+                print(f"Unknown section 0 block {block.block_id:#x}, kept as is")
+                end = next((start for start in starts if start > block.offset), block.offset)
+                unknown_blocks[block.block_id] = bytes(self.read(header.section0_offset + block.offset,
+                                                                 end - block.offset))
+        return unknown_blocks
+
+    @lazy_block
+    def material_parameter_data(self):
+        return bytes(self.read_section1_block(SECTION1_MATERIAL_PARAMETERS) or b'')
+
+    @lazy_block
+    def section1_unknown_data(self):
+        data = self.read_section1_block(SECTION1_UNKNOWN)
+        return None if data is None else bytes(data)
+
+    @lazy_block
+    def vertex_buffer_trailer(self):
+        """ Bytes between the end of the vertex buffer and the next section 1 block (or the end of section 1) """
+        vertex_buffer = self.section1_block(SECTION1_VERTEX_BUFFER)
+        if vertex_buffer is None:
+            return b''
+        start = vertex_buffer.offset + vertex_buffer.length
+        end = min([block.offset for block in self.section1_blocks if block.offset >= start] +
+                  [self.header.section1_length])
+        return bytes(self.read(self.header.section1_offset + start, max(end - start, 0)))
+
+    @lazy_block
+    def mesh_stream_offsets(self):
+        """ (positions, vertex data, faces) offsets of every mesh, relative to the file start """
+        buffer_start = self.header.section1_offset + self.section1_block(SECTION1_VERTEX_BUFFER).offset
+        position_offset = buffer_start + self.buffer_offsets[BUFFER_POSITIONS].offset
+        vertex_data_offset = buffer_start + self.buffer_offsets[BUFFER_VERTEX_DATA].offset
+        face_offset = buffer_start + self.buffer_offsets[BUFFER_FACES].offset
+
+        stream_offsets = []
+        for mesh_index, mesh in enumerate(self.meshes):
+            position_dtype, vertex_data_dtype = self.vertex_dtypes(mesh_index)
+            stream_offsets.append((position_offset, vertex_data_offset, face_offset + mesh.first_face_vertex * 2))
+            position_offset = align(position_offset + mesh.vertex_count * position_dtype.itemsize)
+            vertex_data_offset = align(vertex_data_offset + mesh.vertex_count * vertex_data_dtype.itemsize)
+        return stream_offsets
+
+    def mesh_buffer(self, mesh_index):
+        """ Vertex records and faces of one mesh, read on first access """
+        return self.cached(('mesh_buffer', mesh_index), lambda: self.decode_mesh_buffer(mesh_index))
+
+    def decode_mesh_buffer(self, mesh_index):
+        mesh = self.meshes[mesh_index]
+        position_dtype, vertex_data_dtype = self.vertex_dtypes(mesh_index)
+        position_offset, vertex_data_offset, face_offset = self.mesh_stream_offsets[mesh_index]
+        positions = read_records(self.read(position_offset, mesh.vertex_count * position_dtype.itemsize), 0,
+                                 mesh.vertex_count, position_dtype)
+        vertex_data = read_records(self.read(vertex_data_offset, mesh.vertex_count * vertex_data_dtype.itemsize), 0,
+                                   mesh.vertex_count, vertex_data_dtype)
+        faces = np.frombuffer(self.read(face_offset, mesh.face_vertex_count // 3 * 6), dtype='<u2').reshape(-1, 3)
+        return MeshBuffer(positions, vertex_data, faces)
+
+    @property
+    def mesh_buffers(self):
+        if not self.has_section1_block(SECTION1_VERTEX_BUFFER):
+            return []
+        return [self.mesh_buffer(mesh_index) for mesh_index in range(len(self.meshes))]
+
+    def to_model(self):
+        """ Decodes every block into an FmdlModel """
+        return FmdlModel(**{model_field.name: getattr(self, model_field.name) for model_field in fields(FmdlModel)})
+
+
+def loads(data):
+    """ Decodes a whole .fmdl file from a bytes-like object """
+    return FmdlFile(data).to_model()
+
+
+def read(path, mapped=False):
+    """ Reads an .fmdl file into an FmdlModel.
+
+    mapped memory-maps the file instead of reading it: the mesh buffers of the model are then read-only views
+    into the mapping, which stays alive as long as they do.
+    """
+    if mapped:
+        with FmdlFile.map(path) as fmdl_file:
+            return fmdl_file.to_model()
+    with open(path, 'rb') as fmdl_file:
+        data = fmdl_file.read()
+    Profile.count('bytes read', len(data))
+    return loads(data)
+
+
+def mesh_format_offsets(model):
+    """ Block 0x0A table with the stream offsets recomputed for the current mesh buffers """
+    vertex_counts = [len(mesh_buffer.positions) for mesh_buffer in model.mesh_buffers]
+    mesh_formats = entry_table(BLOCK_MESH_FORMATS, model.mesh_formats).copy()
+    buffer_offsets = []
+    sub_mesh = -1
+    stream_offsets = {0: 0, 1: 0, 2: 0, 3: 0}
+    buffer_offset = 0
+    for mfd_type, length in zip(mesh_formats.type.tolist(), mesh_formats.length.tolist()):
+        if mfd_type not in stream_offsets:
+            raise Exception("0x0A: Unexpected type in vbuff def list")
+        if mfd_type == 0:
+            sub_mesh += 1  # update submesh count
+        stream_size = align(vertex_counts[sub_mesh] * length)
+        if mfd_type == 2 and sub_mesh > 0 and stream_offsets[2] == 0:
+            # the type 2 stream starts where the vertex data stream is at; this entry keeps the previous offset
+            stream_offsets[2] = stream_offsets[1]
+        else:
+            buffer_offset = stream_offsets[mfd_type]
+            stream_offsets[mfd_type] += stream_size
+        buffer_offsets.append(buffer_offset)
+    mesh_formats.offset = buffer_offsets
+    return mesh_formats
+
+
+def buffer_offset_table(model, mesh_formats):
+    """ Block 0x0E: position, vertex data and face chunk sizes and offsets in section 1 block 2 """
+    vert_buffer_total = 0
+    uv_buffer_total = 0
+    face_buffer_total = 0
+    format_entry_offset = 0
+    for mesh_index, mesh_buffer in enumerate(model.mesh_buffers):
+        vertex_count = len(mesh_buffer.positions)
+        vert_buffer_total += align(vertex_count * 12)
+        uv_buffer_total += align(vertex_count * mesh_formats[format_entry_offset + 1].length)
+        format_entry_offset += model.mesh_format_assignments[mesh_index].mesh_format_count
+        face_buffer_total += len(mesh_buffer.faces) * 6
+    face_buffer_total = align(face_buffer_total)
+
+    # default game files ocassionally have extra data written in the blocks, probably lod data
+    # it's not known what that data represents if anything, as have not found headers that adress that data
+    # This formula does not account for that data so exported files may differ from their imports
+    unknowns = entry_table(BLOCK_BUFFER_OFFSETS, model.buffer_offsets).unknown.tolist()
+    return entry_table(BLOCK_BUFFER_OFFSETS, [
+        (unknowns[BUFFER_POSITIONS], vert_buffer_total, 0),
+        (unknowns[BUFFER_VERTEX_DATA], uv_buffer_total, vert_buffer_total),
+        (unknowns[BUFFER_FACES], face_buffer_total, vert_buffer_total + uv_buffer_total)])
+
+
+def encode_entries(entries, block_id):
+    """ The block bytes of an entry table (or list of entries); a table is written out as is, without packing """
+    return as_bytes(entry_table(block_id, entries))
+
+
+def encode_bone_groups(bone_groups):
+    data = bytearray(BONE_GROUP_SIZE * len(bone_groups))
+    for group, bone_group in enumerate(bone_groups):
+        group_offset = group * BONE_GROUP_SIZE
+        BONE_GROUP.pack_into(data, group_offset, bone_group.unknown, len(bone_group.bones))
+        struct.pack_into("<%dH" % len(bone_group.bones), data, group_offset + BONE_GROUP.size, *bone_group.bones)
+    return bytes(data)
+
+
+def layout_model(model):
+    """ Encodes every block of model and works out where it goes in the file.
+
+    Returns the file size and the (offset, data) chunks in file order; the gaps between chunks are zero padding.
+    Vertex and face counts, stream offsets (0x0A, 0x0E), string definitions, block offsets and the section
+    offsets and lengths are recomputed from the model. The LOD face ranges (0x11) of a mesh are kept while its
+    face count is unchanged, else every LOD uses the whole face list. Unknown section 0 blocks are written as they
+    were read, after the known ones.
+    """
+    header = model.header
+    mesh_formats = mesh_format_offsets(model)
+    buffer_offsets = buffer_offset_table(model, mesh_formats)
+    face_counts = [len(mesh_buffer.faces) for mesh_buffer in model.mesh_buffers]
+
+    # face and hair model files have an undocumented behaviour that can add 6 or 12 verts to one of its
+    # first_face_vert_ids
+    meshes = entry_table(BLOCK_MESHES, model.meshes)[:len(model.mesh_buffers)].copy()
+    face_vertex_counts = np.array(face_counts[:len(meshes)], dtype=np.int64) * 3
+    meshes.vertex_count = [len(mesh_buffer.positions) for mesh_buffer in model.mesh_buffers[:len(meshes)]]
+    meshes.first_face_vertex = np.cumsum(face_vertex_counts) - face_vertex_counts
+    meshes.face_vertex_count = face_vertex_counts
+
+    face_indices = entry_table(BLOCK_FACE_INDICES, model.face_indices).copy()
+    original_counts = entry_table(BLOCK_MESHES, model.meshes).face_vertex_count.tolist()
+    for mesh_index in range(min(len(face_indices) // LODS_PER_MESH, len(face_counts))):
+        if mesh_index >= len(original_counts) or original_counts[mesh_index] != face_counts[mesh_index] * 3:
+            lods = face_indices[mesh_index * LODS_PER_MESH:(mesh_index + 1) * LODS_PER_MESH]
+            lods.first_face_vertex = 0
+            lods.face_vertex_count = face_counts[mesh_index] * 3
+
+    encoded_strings = [string.encode("utf-8") for string in model.strings]
+    string_defs = []
+    char_offset = 0
+    for string in encoded_strings:
+        string_defs.append(STRING_DEF.pack(3, len(string), char_offset))
+        char_offset += len(string) + 1
+
+    entries = {
+        BLOCK_BONES: model.bones,
+        BLOCK_MESH_GROUPS: model.mesh_groups,
+        BLOCK_MESH_GROUP_ASSIGNMENTS: model.mesh_group_assignments,
+        BLOCK_MESHES: meshes,
+        BLOCK_MATERIAL_INSTANCES: model.material_instances,
+        BLOCK_TEXTURES: model.textures,
+        BLOCK_MATERIAL_PARAMETERS: model.material_parameters,
+        BLOCK_MATERIALS: model.materials,
+        BLOCK_MESH_FORMAT_ASSIGNMENTS: model.mesh_format_assignments,
+        BLOCK_MESH_FORMATS: mesh_formats,
+        BLOCK_VERTEX_FORMATS: model.vertex_formats,
+        BLOCK_BOUNDING_BOXES: model.bounding_boxes,
+        BLOCK_BUFFER_OFFSETS: buffer_offsets,
+        BLOCK_LODS: model.lods,
+        BLOCK_FACE_INDICES: face_indices,
+    }
+    section0_data = {block_id: encode_entries(block_entries, block_id)
+                     for block_id, block_entries in entries.items()}
+    section0_data[BLOCK_BONE_GROUPS] = encode_bone_groups(model.bone_groups)
+    section0_data[BLOCK_STRINGS] = b''.join(string_defs)
+    section0_data[BLOCK_0x12] = b''.join(model.block_0x12)
+    section0_data[BLOCK_0x14] = b''.join(model.block_0x14)
+    entry_counts = {block_id: len(block_entries) for block_id, block_entries in entries.items()}
+    entry_counts.update({BLOCK_BONE_GROUPS: len(model.bone_groups), BLOCK_STRINGS: len(model.strings),
+                         BLOCK_0x12: len(model.block_0x12), BLOCK_0x14: len(model.block_0x14)})
+
+    chunks = []
+    offset = HEADER.size + SECTION0_BLOCK.size * len(model.section0_blocks) + \
+        SECTION1_BLOCK.size * len(model.section1_blocks)
+    offset += 16 - offset % 16
+
+    # Section 0
+    section_0_start = offset
+    block_offsets = {}
+    present = {block.block_id for block in model.section0_blocks}
+    for block_id in SECTION0_ORDER:
+        if block_id not in present:
+            continue
+        block_offsets[block_id] = offset - section_0_start
+        chunks.append((offset, section0_data[block_id]))
+        offset += len(section0_data[block_id])
+        if block_id == BLOCK_STRINGS:
+            # dynamically pad block until divisble by 16
+            offset = align(offset)
+    for block in model.section0_blocks:
+        if block.block_id in model.unknown_blocks:
+            offset = align(offset)
+            block_offsets[block.block_id] = offset - section_0_start
+            chunks.append((offset, model.unknown_blocks[block.block_id]))
+            offset += len(model.unknown_blocks[block.block_id])
+    offset = align(offset)
+    section_0_length = offset - section_0_start
+
+    # blank section?
+    offset += 96
+
+    section_1_start = offset
+    section1_directory = {}
+    for block in model.section1_blocks:
+        start = offset
+        if block.block_id == SECTION1_MATERIAL_PARAMETERS:
+            chunks.append((offset, model.material_parameter_data))
+            offset += len(model.material_parameter_data)
+        elif block.block_id == SECTION1_UNKNOWN:
+            chunks.append((offset, model.section1_unknown_data or b''))
+            offset += len(model.section1_unknown_data or b'')
+        elif block.block_id == SECTION1_VERTEX_BUFFER:
+            # vertexes, then UV, normals, weighting, bone ids, etc, then faces
+            for stream in ([mesh_buffer.positions for mesh_buffer in model.mesh_buffers],
+                           [mesh_buffer.vertex_data for mesh_buffer in model.mesh_buffers]):
+                placed, offset = layout_stream(stream, offset)
+                chunks += placed
+            placed, offset = layout_faces([mesh_buffer.faces for mesh_buffer in model.mesh_buffers], offset)
+            chunks += placed
+        elif block.block_id == SECTION1_STRINGS:
+            string_data = b''.join(string + b'\0' for string in encoded_strings)
+            chunks.append((offset, string_data))
+            offset += len(string_data)
+        section1_directory[block.block_id] = (start - section_1_start, offset - start)
+        if block.block_id == SECTION1_VERTEX_BUFFER:
+            chunks.append((offset, model.vertex_buffer_trailer))
+            offset += len(model.vertex_buffer_trailer)
+
+    header_data = [HEADER.pack(header.signature, header.version, HEADER.size, header.section0_flags,
+                               header.section1_flags, len(model.section0_blocks), len(model.section1_blocks),
+                               section_0_start, section_0_length, section_1_start, offset - section_1_start)]
+    for block in model.section0_blocks:
+        header_data.append(SECTION0_BLOCK.pack(block.block_id, entry_counts.get(block.block_id, block.entry_count),
+                                               block_offsets.get(block.block_id, 0)))
+    for block in model.section1_blocks:
+        header_data.append(SECTION1_BLOCK.pack(block.block_id, *section1_directory[block.block_id]))
+    chunks.insert(0, (0, b''.join(header_data)))
+    return offset, chunks
+
+
+def replace_strings(data, strings):
+    """ A copy of the .fmdl in data with other strings, as a bytearray.
+
+    Only the string definitions (0x0C) and the string data (section 1 block 3) are rewritten, so nothing else is
+    decoded. The section 1 blocks after the string data move with it and stay 16 byte aligned; every other byte is
+    copied unchanged. strings must have as many entries as the file's string table.
+    """
+    fmdl_file = FmdlFile(data)
+    header = fmdl_file.header
+    definitions = fmdl_file.section0_block(BLOCK_STRINGS)
+    string_block = fmdl_file.section1_block(SECTION1_STRINGS)
+    if definitions is None or string_block is None or definitions.entry_count != len(strings):
+        raise Exception(f"Cannot replace the strings: the file has {definitions.entry_count if definitions else 0} "
+                        f"string definitions for {len(strings)} strings")
+
+    string_types = [string_type for string_type, _, _ in
+                    STRING_DEF.iter_unpack(fmdl_file.read_section0_block(BLOCK_STRINGS, STRING_DEF.size)[0])]
+    encoded_strings = [string.encode("utf-8") for string in strings]
+    string_defs = []
+    char_offset = 0
+    for string_type, string in zip(string_types, encoded_strings):
+        string_defs.append(STRING_DEF.pack(string_type, len(string), char_offset))
+        char_offset += len(string) + 1
+    string_data = b''.join(string + b'\0' for string in encoded_strings)
+
+    growth = len(string_data) - string_block.length
+    following = [index for index, block in enumerate(fmdl_file.section1_blocks) if block.offset > string_block.offset]
+    shift = growth + -growth % 16 if following else growth
+    string_start = header.section1_offset + string_block.offset
+    string_end = string_start + string_block.length
+    output = bytearray(len(data) + shift)
+    output[:string_start] = data[:string_start]
+    output[string_start:string_start + len(string_data)] = string_data
+    output[string_end + shift:] = data[string_end:]
+
+    definitions_start = header.section0_offset + definitions.offset
+    output[definitions_start:definitions_start + len(string_defs) * STRING_DEF.size] = b''.join(string_defs)
+    HEADER.pack_into(output, 0, *astuple(replace(header, section1_length=header.section1_length + shift)))
+    section1_directory = header.blocks_offset + SECTION0_BLOCK.size * len(fmdl_file.section0_blocks)
+    for index, block in enumerate(fmdl_file.section1_blocks):
+        if block is string_block:
+            block = replace(block, length=len(string_data))
+        elif index in following:
+            block = replace(block, offset=block.offset + shift)
+        SECTION1_BLOCK.pack_into(output, section1_directory + index * SECTION1_BLOCK.size, *astuple(block))
+    return output
+
+
+def dumps(model):
+    """ Encodes model into a preallocated bytearray """
+    size, chunks = layout_model(model)
+    data = bytearray(size)
+    view = memoryview(data)
+    for offset, chunk in chunks:
+        view[offset:offset + len(chunk)] = chunk
+    return data
+
+
+def dump(model, stream):
+    """ Writes model to a binary stream in a single forward pass; the stream doesn't need to be seekable """
+    size, chunks = layout_model(model)
+    position = 0
+    for offset, chunk in chunks:
+        if offset > position:
+            stream.write(bytes(offset - position))
+        stream.write(chunk)
+        position = offset + len(chunk)
+    stream.write(bytes(size - position))
+
+
+def write(model, path):
+    """ Writes an FmdlModel to an .fmdl file """
+    with open(path, 'wb') as fmdl_file:
+        dump(model, fmdl_file)
+        Profile.count('bytes written', fmdl_file.tell())
@@ -0,0 +1,301 @@
+""" Timing helpers for the FMDL import/export paths.
+
+The codec benchmark runs without Blender on synthetic models, so results can be compared between commits. From
+the folder holding the PesFacemod package:
+
+    python -m PesFacemod.FmdlBenchmark --vertices 1000 10000 100000 1000000 --json results.json
+
+The vertex weight benchmark needs Blender with the addon enabled, e.g.:
+
+    blender --background --python-expr "from PesFacemod.PesFacemod import FmdlBenchmark; \
+FmdlBenchmark.benchmark_vertex_weights(['C:/.../face_fpk/face_high.fmdl', 'C:/.../face_fpk/hair_high.fmdl'])"
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tracemalloc
+from dataclasses import replace
+from time import perf_counter
+
+import numpy as np
+
+from . import Fmdl
+from .FmdlVertexBuffer import DEFAULT_MEMORY_BUDGET, model_vertices
+
+# (bones, vertex colors, second uv set) of the models in a face.fpk
+MODEL_TYPES = {
+    'face': (24, True, True),
+    'hair': (12, True, False),
+    'oral': (8, False, False),
+}
+
+# submeshes stay below the uint16 face index limit, like the game's own models
+SUBMESH_VERTICES = 60000
+
+# (usage, data type, offset) of the vertex formats: position in its own stream, then normal, tangent, color,
+# bone weights, bone ids, uv0 and uv1 interleaved in the vertex data stream
+POSITION_FORMAT = [(0, 1, 0)]
+VERTEX_DATA_FORMATS = [(2, 6, 0), (14, 6, 8), (3, 8, 16), (1, 8, 20), (7, 9, 24), (8, 7, 28), (9, 7, 32)]
+VERTEX_DATA_STRIDE = 36
+BONES_PER_GROUP = 32
+
+
+def set_vertex_weights_per_vertex(mesh_obj, bone_name_list, bone_id_list, bone_weight_list, memory_budget=None):
+    """ The original weight assignment - one vertex_groups[i].add() per vertex and weight. Returns the weights read
+    back from the vertex groups, as the original import fingerprint did; memory_budget is unused.
+    """
+    from . import FmdlManager
+
+    for bone_number in range(len(bone_name_list)):
+        mesh_obj.vertex_groups.new(name=bone_name_list[bone_number])
+    for vert_inst in range(len(mesh_obj.data.vertices)):
+        id_tuple = bone_id_list[vert_inst]
+        weight_tuple = bone_weight_list[vert_inst]
+        for slot in range(4):
+            if weight_tuple[slot] > 0.0 and len(mesh_obj.vertex_groups) > id_tuple[slot]:
+                mesh_obj.vertex_groups[int(id_tuple[slot])].add((vert_inst,), float(weight_tuple[slot]), 'ADD')
+    return FmdlManager.collect_vertex_weights(mesh_obj.data.vertices)
+
+
+def _timed(function, timings):
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        result = function(*args, **kwargs)
+        timings.append(perf_counter() - start)
+        return result
+    return wrapper
+
+
+def _import_with(weights_function, fmdl_path, model_type):
+    """ Imports a model into an empty scene with the given weight assignment; returns the timings and weights """
+    import bpy
+    from . import FmdlManager
+
+    bpy.ops.wm.read_homefile(use_empty=True)
+    weight_timings = []
+    original = FmdlManager.set_vertex_weights
+    FmdlManager.set_vertex_weights = _timed(weights_function, weight_timings)
+    try:
+        manager = FmdlManager.FmdlManagerBase(fmdl_path, os.path.dirname(fmdl_path))
+        manager.model_type = model_type
+        start = perf_counter()
+        manager.importmodel(fmdl_path)
+        import_time = perf_counter() - start
+    finally:
+        FmdlManager.set_vertex_weights = original
+    weights = [FmdlManager.collect_vertex_weights(obj.data.vertices) for obj in manager.internal_mesh_list]
+    return import_time, sum(weight_timings), weights
+
+
+def benchmark_vertex_weights(fmdl_paths, repeat=3):
+    """ Compares import time with per-vertex and batched vertex group assignment on skinned models """
+    from . import FmdlManager
+
+    results = []
+    for fmdl_path in fmdl_paths:
+        model_type = 'Hair' if 'hair' in os.path.basename(fmdl_path).lower() else 'Face'
+        row = {'file': fmdl_path}
+        reference = None
+        for name, function in (('per_vertex', set_vertex_weights_per_vertex),
+                               ('batched', FmdlManager.set_vertex_weights)):
+            best_import, best_weights = float('inf'), float('inf')
+            for _ in range(repeat):
+                import_time, weights_time, weights = _import_with(function, fmdl_path, model_type)
+                best_import, best_weights = min(best_import, import_time), min(best_weights, weights_time)
+            if reference is None:
+                reference = weights
+            else:
+                row['identical'] = all((ids == ref_ids).all() and (w == ref_w).all()
+                                       for (ids, w), (ref_ids, ref_w) in zip(weights, reference))
+            row[name + '_import'] = best_import
+            row[name + '_weights'] = best_weights
+        results.append(row)
+        print(f"{fmdl_path}: import {row['per_vertex_import']:.3f}s -> {row['batched_import']:.3f}s, "
+              f"weights {row['per_vertex_weights']:.3f}s -> {row['batched_weights']:.3f}s, "
+              f"identical weights: {row['identical']}")
+    return results
+
+
+def grid_faces(vertex_count, columns):
+    """ Two triangles per grid cell of vertex_count vertices laid out in rows of columns """
+    rows = vertex_count // columns
+    corners = (np.arange(rows - 1)[:, None] * columns + np.arange(columns - 1)).ravel()
+    faces = np.concatenate([np.stack((corners, corners + columns, corners + 1), axis=1),
+                            np.stack((corners + 1, corners + columns, corners + columns + 1), axis=1)])
+    return faces.astype('<u2')
+
+
+def synthetic_mesh_buffer(model, mesh_index, vertex_count, has_colors, has_uv1, rng):
+    position_dtype, vertex_data_dtype = model.vertex_dtypes(mesh_index)
+    columns = max(2, int(math.sqrt(vertex_count)))
+    grid = np.arange(vertex_count)
+    positions = np.zeros(vertex_count, dtype=position_dtype)
+    positions['position'] = np.stack((grid % columns / columns - 0.5, grid // columns / columns,
+                                      rng.normal(0, 0.01, vertex_count)), axis=1)
+
+    records = np.zeros(vertex_count, dtype=vertex_data_dtype)
+    normals = rng.normal(size=(vertex_count, 3))
+    normals /= np.linalg.norm(normals, axis=1)[:, None]
+    records['normal'] = np.concatenate((normals, np.ones((vertex_count, 1))), axis=1)
+    records['tangent'] = np.concatenate((np.cross(normals, [0, 0, 1]), np.ones((vertex_count, 1))), axis=1)
+    if has_colors:
+        records['color'] = rng.randint(0, 256, (vertex_count, 4))
+    weights = rng.randint(0, 256, (vertex_count, 4))
+    records['bone_weights'] = weights * 255 // np.maximum(weights.sum(axis=1), 1)[:, None]
+    bone_count = len(model.bone_groups[model.meshes[mesh_index].bone_group].bones)
+    records['bone_ids'] = rng.randint(0, bone_count, (vertex_count, 4))
+    records['uv0'] = rng.random_sample((vertex_count, 2))
+    if has_uv1:
+        records['uv1'] = rng.random_sample((vertex_count, 2))
+    return Fmdl.MeshBuffer(positions, records, grid_faces(vertex_count, columns))
+
+
+def synthetic_model(vertex_count, model_type='face', seed=0):
+    """ An FmdlModel with the block structure of a face.fpk model and vertex_count vertices in total """
+    bone_count, has_colors, has_uv1 = MODEL_TYPES[model_type]
+    rng = np.random.RandomState(seed)
+    mesh_count = max(1, -(-vertex_count // SUBMESH_VERTICES))
+    strings = [''] + [f'SKL_{bone:03d}' for bone in range(bone_count)] + \
+        [f'{model_type}_mtl', 'fox3DDF_Blin', 'Base_Tex_SRGB', 'NormalMap_Tex_NRM',
+         f'/Assets/pes16/model/character/face/real/0/sourceimages/{model_type}_bsm_alp.ftex']
+    mtl_string = bone_count + 1
+
+    model = Fmdl.FmdlModel()
+    model.bones = [Fmdl.Bone(bone + 1, bone - 1 if bone else 0xFFFF, 0, 0, 0, 0, *rng.random_sample(3).tolist(),
+                             1.0, *rng.random_sample(3).tolist(), 1.0) for bone in range(bone_count)]
+    model.mesh_groups = [Fmdl.MeshGroup(mtl_string, 0, 0xFFFF)]
+    model.mesh_group_assignments = [Fmdl.MeshGroupAssignment(0, mesh_count, 0, 0, 0)]
+    model.material_instances = [Fmdl.MaterialInstance(mtl_string, 0, 2, 0, 0, 0)]
+    model.bone_groups = [Fmdl.BoneGroup(4, list(range(start, min(start + BONES_PER_GROUP, bone_count))))
+                         for start in range(0, bone_count, BONES_PER_GROUP)]
+    model.textures = [Fmdl.Texture(mtl_string + 2, mtl_string + 4), Fmdl.Texture(mtl_string + 3, mtl_string + 4)]
+    model.material_parameters = [Fmdl.MaterialParameter(mtl_string + 2, 0), Fmdl.MaterialParameter(mtl_string + 3, 1)]
+    model.materials = [Fmdl.Material(mtl_string, mtl_string + 1)]
+    model.strings = strings
+    model.bounding_boxes = [Fmdl.BoundingBox(0.5, 1.0, 0.1, 1.0, -0.5, 0.0, -0.1, 1.0)]
+    model.buffer_offsets = [Fmdl.BufferOffset(0, 0, 0), Fmdl.BufferOffset(0, 0, 0), Fmdl.BufferOffset(1, 0, 0)]
+    model.lods = [Fmdl.Lod(1, 1.0, 1.0, 1.0)]
+    model.face_indices = [Fmdl.FaceIndex(0, 0)] * (Fmdl.LODS_PER_MESH * mesh_count)
+    model.block_0x12 = [bytes(8)]
+    model.block_0x14 = [bytes(32)]
+    model.material_parameter_data = bytes(32)
+    model.section1_unknown_data = bytes(16)
+
+    vertex_formats = POSITION_FORMAT + VERTEX_DATA_FORMATS
+    model.meshes, model.mesh_format_assignments, model.mesh_formats, model.vertex_formats = [], [], [], []
+    for mesh_index in range(mesh_count):
+        model.meshes.append(Fmdl.Mesh(0x100, 0, mesh_index % len(model.bone_groups), mesh_index, 0, 0, 0, 0))
+        model.mesh_format_assignments.append(Fmdl.MeshFormatAssignment(3, len(vertex_formats), 0, 3 * mesh_index,
+                                                                       len(vertex_formats) * mesh_index))
+        model.mesh_formats += [Fmdl.MeshFormat(0, 1, 12, 0, 0), Fmdl.MeshFormat(1, len(VERTEX_DATA_FORMATS),
+                                                                                VERTEX_DATA_STRIDE, 1, 0),
+                               Fmdl.MeshFormat(1, 0, 4, 2, 0)]
+        model.vertex_formats += [Fmdl.VertexFormat(*vertex_format) for vertex_format in vertex_formats]
+
+    model.section0_blocks = [Fmdl.Section0Block(block_id, 0, 0) for block_id in Fmdl.SECTION0_ORDER]
+    model.section1_blocks = [Fmdl.Section1Block(block_id, 0, 0) for block_id in
+                             (Fmdl.SECTION1_MATERIAL_PARAMETERS, Fmdl.SECTION1_UNKNOWN, Fmdl.SECTION1_VERTEX_BUFFER,
+                              Fmdl.SECTION1_STRINGS)]
+
+    for mesh_index in range(mesh_count):
+        mesh_vertices = vertex_count // mesh_count + (mesh_index < vertex_count % mesh_count)
+        model.mesh_buffers.append(synthetic_mesh_buffer(model, mesh_index, mesh_vertices, has_colors, has_uv1, rng))
+    # a written and read back model has its counts, offsets and block directory filled in
+    return Fmdl.loads(Fmdl.dumps(model))
+
+
+def decode(data, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """ What parse_fmdl does before touching Blender """
+    model = Fmdl.loads(data)
+    return model, model_vertices(model, memory_budget)
+
+
+def keep_unexported_fields(source, records):
+    """ Copies what Blender doesn't hand back to exportmodel - the tangents it recomputes and the color alpha it
+    drops - from the source records, so an unchanged model encodes to the bytes it was decoded from
+    """
+    fields = records.dtype.names
+    if 'tangent' in fields and 'tangent' in source.dtype.names:
+        records['tangent'] = source['tangent']
+    if 'color' in fields and 'color' in source.dtype.names:
+        records['color'][:, 3] = source['color'][:, 3]
+
+
+def encode(model, submesh_vertices, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """ What exportmodel does after reading the Blender meshes, of an unchanged model """
+    mesh_buffers = []
+    for mesh_index, (mesh_buffer, vertices) in enumerate(zip(model.mesh_buffers, submesh_vertices)):
+        positions, vertex_data = vertices.to_records(*model.vertex_dtypes(mesh_index), memory_budget)
+        keep_unexported_fields(mesh_buffer.vertex_data, vertex_data)
+        mesh_buffers.append(Fmdl.MeshBuffer(positions, vertex_data, mesh_buffer.faces))
+    return Fmdl.dumps(replace(model, mesh_buffers=mesh_buffers))
+
+
+def best_time(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def peak_memory(function):
+    """ Peak bytes allocated while function runs, NumPy buffers included """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_codec(vertex_counts, model_type='face', repeat=3, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """ Best decode, encode and round trip times and peak memory of synthetic models of every size """
+    results = []
+    for vertex_count in vertex_counts:
+        data = bytes(Fmdl.dumps(synthetic_model(vertex_count, model_type)))
+        model, submesh_vertices = decode(data, memory_budget)
+        stages = {
+            'decode': lambda: decode(data, memory_budget),
+            'encode': lambda: encode(model, submesh_vertices, memory_budget),
+            'round_trip': lambda: encode(*decode(data, memory_budget), memory_budget),
+        }
+        row = {'model': model_type, 'vertices': vertex_count, 'submeshes': len(model.meshes), 'bytes': len(data),
+               'memory_budget': memory_budget, 'identical': bytes(Fmdl.dumps(Fmdl.loads(data))) == data}
+        for name, function in stages.items():
+            row[name + '_seconds'] = best_time(function, repeat)
+            row[name + '_mb_per_second'] = len(data) / row[name + '_seconds'] / 1e6
+            row[name + '_peak_bytes'] = peak_memory(function)
+        results.append(row)
+        print(f"{model_type} {vertex_count:>8} vertices ({len(data) / 1e6:.1f} MB): "
+              + ", ".join(f"{name} {row[name + '_seconds'] * 1000:.1f} ms / "
+                          f"{row[name + '_peak_bytes'] / 1e6:.1f} MB peak" for name in stages))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m PesFacemod.FmdlBenchmark',
+                                     description="Times the FMDL codec on synthetic models, without Blender")
+    parser.add_argument('--vertices', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--model', choices=sorted(MODEL_TYPES), default='face')
+    parser.add_argument('--repeat', type=int, default=3, help="runs per measurement, the best one counts")
+    parser.add_argument('--memory-budget', type=float, default=DEFAULT_MEMORY_BUDGET / 2 ** 20, metavar='MIB',
+                        help="MiB of vertices decoded or encoded at a time")
+    parser.add_argument('--json', default=None, help="also write the results to this file")
+    arguments = parser.parse_args(argv)
+
+    results = benchmark_codec(arguments.vertices, arguments.model, arguments.repeat,
+                              int(arguments.memory_budget * 2 ** 20))
+    if arguments.json:
+        with open(arguments.json, 'w') as out_file:
+            json.dump({'python': platform.python_version(), 'numpy': np.__version__, 'results': results},
+                      out_file, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,18 @@
 import os.path
 
-import bpy, os, binascii, bmesh, shutil, os.path, struct
+import bpy, os, shutil, os.path, struct
 from bpy_extras import object_utils
 from bpy.props import *
 from struct import *
-from math import sqrt
-from dataclasses import dataclass
-import subprocess
+from dataclasses import dataclass, replace
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import os
 from .PesFacemodGlobalData import PesFacemodGlobalData
+from . import Fmdl, Profile
+from .FmdlVertexBuffer import DEFAULT_MEMORY_BUDGET, MAX_MESH_VERTICES, SubmeshVertices, model_vertices, \
+    chunk_ranges, chunk_vertices, face_problems, flip_winding
 
 
 @dataclass
@@ -18,59 +22,11 @@ class MaterialAssignment:
     name_index: int
 
 
-@dataclass
-class Texture:
-    name_index: int
-    path_index: int
-
-
 def log(*args, logtype='debug', sep=' '):
     # getattr(logger, logtype)(sep.join(str(a) for a in args))
     pass
 
 
-def refresh_offset(file, start, block_number):
-    current_pos = file.tell()
-    file.seek(start + (block_number * 8) + 4)
-    file.write(pack("I", current_pos))
-    file.seek(current_pos)
-
-
-def exec_tool(*args):
-    path, *arguments = args
-    path = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', path))
-    escaped_args = [path, *arguments]
-    print("\t*** Executing tool: ", *escaped_args)
-    try:
-        subprocess.run(escaped_args)
-        return True
-    except subprocess.CalledProcessError as ex:
-        print("Process ended with error:", ex.returncode, ex.output)
-        return False
-    except PermissionError as pex:
-        print("There was a permissions error: ", pex.filename, pex.args, pex.errno, pex.strerror)
-        return False
-    except FileNotFoundError as fex:
-        print("The file to execute was not found: ", fex.filename, fex.errno, fex.strerror)
-        return False
-
-
-def ftex_to_tga(ftexfilepath):
-    exec_tool(os.path.join('Tools', 'FtexDdsTools.exe'), ftexfilepath)
-    (fname, ext) = os.path.splitext(ftexfilepath)
-    exec_tool(os.path.join('Tools', 'nvidia-texture-tools', 'bin64', 'nvdecompress.exe'), fname + '.dds',
-              '-format', 'tga')
-    return fname + '.tga'
-
-
-def tga_to_dds(tgafilepath):
-    (fname, ext) = os.path.splitext(tgafilepath)
-    exec_tool(os.path.join('Tools', 'nvidia-texture-tools', 'bin64', 'nvcompress.exe'), '-bc3',
-              fname + '.tga', fname + '.dds')
-    exec_tool(os.path.join('Tools', 'DdsFtexTools.exe'), fname + '.dds')
-    return fname + '.dds'
-
-
 def get_active_mesh():
     if bpy.context.object is not None:
         return bpy.context.object.data
@@ -90,97 +46,84 @@ def collect_objects(obj_type):
     return obj_list
 
 
-def collect_vertex_colors(mesh_data, layer_name, destination_list):
-    color_layer = mesh_data.vertex_colors[layer_name].data
-    v_loop_color_list = {}
-    for loop in mesh_data.loops:
-        if loop.vertex_index not in v_loop_color_list:
-            clr_list = []
-            v_loop_color_list[loop.vertex_index] = clr_list
-            v_loop_color_list[loop.vertex_index].append(color_layer[loop.vertex_index].color)
-        else:
-            v_loop_color_list[loop.vertex_index].append(color_layer[loop.vertex_index].color)
+def get_loop_vertices(mesh):
+    loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_vertices)
+    return loop_vertices
 
-    for key in v_loop_color_list:  # not sure, may have to average values from multiple tuples per vertex
-        destination_list[key] = v_loop_color_list[key][0]
 
+def loops_to_vertices(loop_vertices, loop_values, vertex_count, last=True):
+    """ Per-vertex values from per-loop values, taking the last (or first) loop of each vertex.
 
-def normalize_tangents(in_x, in_y, in_z):
-    radius = 1
-    len_p = sqrt(in_x * in_x + in_y * in_y + in_z * in_z)
-    out_x, out_y, out_z = 0, 0, 0
-    if in_x != 0:
-        out_x = (radius * in_x) / len_p
-    if in_y != 0:
-        out_y = (radius * in_y) / len_p
-    if in_z != 0:
-        out_z = (radius * in_z) / len_p
-    return out_x, out_y, out_z
+    Vertices without loops are left at zero.
+    """
+    loop_values = np.asarray(loop_values)
+    values = np.zeros((vertex_count,) + loop_values.shape[1:], dtype=loop_values.dtype)
+    if last:
+        vertices, loops = np.unique(loop_vertices[::-1], return_index=True)
+        loops = len(loop_vertices) - 1 - loops
+    else:
+        vertices, loops = np.unique(loop_vertices, return_index=True)
+    values[vertices] = loop_values[loops]
+    return values
+
+
+def collect_vertex_colors(mesh_data, layer_name, destination):
+    color_layer = mesh_data.vertex_colors[layer_name].data
+    loop_colors = np.empty((len(color_layer), 4), dtype=np.float32)
+    color_layer.foreach_get("color", loop_colors.ravel())
+    # not sure, may have to average values from multiple loops per vertex
+    loop_vertices = get_loop_vertices(mesh_data)
+    vertices, loops = np.unique(loop_vertices, return_index=True)
+    destination[vertices] = loop_colors[loops]
 
 
 def get_face_tuples(mesh_obj):
+    """ (n, 3) vertex indices of the triangles of a mesh, from its loop triangles (calc_loop_triangles() first), so
+    quads and n-gons are triangulated the way Blender draws them """
     mesh = mesh_obj.data
-    t_face_list = []
-    for poly in mesh.polygons:
-        # for idx in poly.vertices:
-        #    vector = mesh.vertices[idx].co
-        #    if len(vector) != 3:
-        #        raise Exception("Mesh not triangulated")
-        if len(poly.vertices) != 3:
-            raise Exception(f"Mesh not triangulated: {mesh_obj.name_full} - polygon {poly.index} has {len(poly.vertices)} vertices")
-        t_face_list.append([poly.vertices[0], poly.vertices[1], poly.vertices[2]])
-    return t_face_list
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+    not_triangles = np.count_nonzero(loop_totals != 3)
+    if not_triangles:
+        print(f"{mesh_obj.name_full}: triangulating {not_triangles} polygons with more than 3 vertices")
+    faces = np.empty((len(mesh.loop_triangles), 3), dtype=np.int32)
+    mesh.loop_triangles.foreach_get("vertices", faces.ravel())
+    return faces
 
 
 def get_uv_map(mesh_obj, map_name):
     mesh = mesh_obj.data
-    uv_list = {}
     uvlayer = mesh.uv_layers[map_name]
-    for loop in mesh.loops:
-        uv_coords = uvlayer.data[loop.index].uv
-        uv_list[loop.vertex_index] = (uv_coords[0], uv_coords[1])
-    return uv_list
+    loop_uvs = np.empty((len(uvlayer.data), 2), dtype=np.float32)
+    uvlayer.data.foreach_get("uv", loop_uvs.ravel())
+    return loops_to_vertices(get_loop_vertices(mesh), loop_uvs, len(mesh.vertices))
 
 
 def get_custom_vertex_normals(mesh_obj):
-    mesh_obj.data.calc_normals_split()
-    nrm_avg_list = [None] * len(mesh_obj.data.vertices)
-    for loop in mesh_obj.data.loops:
-        nrm_avg_list[loop.vertex_index] = (loop.normal.x, loop.normal.y, loop.normal.z)
-    output = [idx for idx, element in enumerate(nrm_avg_list) if element is None]
+    mesh = mesh_obj.data
+    mesh.calc_normals_split()
+    loop_normals = np.empty((len(mesh.loops), 3), dtype=np.float32)
+    mesh.loops.foreach_get("normal", loop_normals.ravel())
+    loop_vertices = get_loop_vertices(mesh)
+    nrm_avg_list = loops_to_vertices(loop_vertices, loop_normals, len(mesh.vertices))
+    output = np.setdiff1d(np.arange(len(mesh.vertices)), loop_vertices)
     if len(output) > 0:
         print(f"None value found: {output}")
-        for idx in output:
-            nrm_avg_list[idx] = (0, 0, 0)
+        nrm_avg_list[output] = (0.0, -0.0, 0.0)  # -0.0 so the fox engine flip writes +0.0
     return nrm_avg_list
 
 
 def get_custom_vertex_tangents(mesh_obj, map_name):
     mesh = mesh_obj.data
-    cv_tan_list = {}
     if map_name == "":
         mesh.calc_tangents()
     else:
         mesh.calc_tangents(uvmap=map_name)
-    for loop in mesh.loops:
-        if cv_tan_list.get(loop.vertex_index) is None:
-            # sorting into dictionary because other methods produced weird bugs
-            cv_tan_list[loop.vertex_index] = [loop.tangent]
-        else:
-            # slight concern order of keys may not match vertex order
-            cv_tan_list[loop.vertex_index].append(loop.tangent)
-
-    # sort into sublist
-    tan_avg_list = []
-    for key in cv_tan_list:
-        loop_list = cv_tan_list[key]
-        avg_vec = loop_list[0]
-        for vec in range(len(loop_list)):
-            vec_instance = loop_list[vec]
-            # avg_vec = avg_vec.slerp(vec_instance, 0.5)
-        tan_avg_list.append((key, avg_vec))
-
-    return tan_avg_list
+    loop_tangents = np.empty((len(mesh.loops), 3), dtype=np.float32)
+    mesh.loops.foreach_get("tangent", loop_tangents.ravel())
+    # first loop of each vertex, no averaging
+    return loops_to_vertices(get_loop_vertices(mesh), loop_tangents, len(mesh.vertices), last=False)
 
 
 def generate_skeleton(skeleton_prefix, bone_name_list, bone_position_list):
@@ -212,10 +155,20 @@ def generate_skeleton(skeleton_prefix, bone_name_list, bone_position_list):
 
 
 def allocate_object(object_name, vert_list, face_list):
-    edge_list = []  # never used?
+    vert_list = np.asarray(vert_list, dtype=np.float32).reshape(-1, 3)
+    face_list = np.asarray(face_list, dtype=np.int32).reshape(-1, 3)
+    face_count = len(face_list)
 
     mesh = bpy.data.meshes.new(object_name)
-    mesh.from_pydata(vert_list, edge_list, face_list)
+    mesh.vertices.add(len(vert_list))
+    mesh.vertices.foreach_set("co", vert_list.ravel())
+    mesh.loops.add(face_count * 3)
+    mesh.polygons.add(face_count)
+    mesh.polygons.foreach_set("loop_start", np.arange(0, face_count * 3, 3, dtype=np.int32))
+    mesh.polygons.foreach_set("loop_total", np.full(face_count, 3, dtype=np.int32))
+    mesh.polygons.foreach_set("vertices", face_list.ravel())
+    mesh.update(calc_edges=True)
+
     active_obj = object_utils.object_data_add(bpy.context, mesh, operator=None)
     active_obj.location = 0, 0, 0
     active_obj.show_all_edges = 1
@@ -226,79 +179,126 @@ def allocate_object(object_name, vert_list, face_list):
 
 def allocate_maps(mesh_obj, face_list, uvlist, uvlist_normal):
     active_mesh = mesh_obj.data
-    bpy.ops.mesh.uv_texture_add('EXEC_SCREEN')
-    mapping_mesh = bmesh.new()
-    mapping_mesh.from_mesh(active_mesh)
-    uv_layer = mapping_mesh.loops.layers.uv.verify()
+    loop_vertices = get_loop_vertices(active_mesh)
 
-    for f in range(len(mapping_mesh.faces)):
-        mapping_mesh.faces.ensure_lookup_table()
-        for i in range(len(mapping_mesh.faces[f].loops)):
-            fuv = mapping_mesh.faces[f].loops[i][uv_layer]
-            fuv.uv = uvlist[face_list[f][i]]
+    uv_layer = active_mesh.uv_layers.new(name="UVMap")
+    uv_layer.data.foreach_set("uv", np.asarray(uvlist, dtype=np.float32)[loop_vertices].ravel())
 
     if len(uvlist_normal) != 0:
-        mapping_mesh.loops.layers.uv.new("normal_map")
-        uv_normal_layer = mapping_mesh.loops.layers.uv["normal_map"]
-
-        for f_nrm in range(len(mapping_mesh.faces)):
-            for i_nrm in range(len(mapping_mesh.faces[f_nrm].loops)):
-                fuv_nrm = mapping_mesh.faces[f_nrm].loops[i_nrm][uv_normal_layer]
-                fuv_nrm.uv = uvlist_normal[face_list[f_nrm][i_nrm]]
-
-    mapping_mesh.to_mesh(active_mesh)
-    mapping_mesh.free()
+        uv_normal_layer = active_mesh.uv_layers.new(name="normal_map")
+        uv_normal_layer.data.foreach_set("uv", np.asarray(uvlist_normal, dtype=np.float32)[loop_vertices].ravel())
 
 
 def set_vertex_colors(layer_name, obj_data, color_list):
     if layer_name not in obj_data.vertex_colors.keys():
         color_layer = obj_data.vertex_colors.new(name=layer_name)
-        for poly in obj_data.polygons:
-            for idx in range(poly.loop_start, poly.loop_start + poly.loop_total):
-                c_r = color_list[obj_data.loops[idx].vertex_index][0]  # filtering out the alpha channel
-                c_g = color_list[obj_data.loops[idx].vertex_index][1]
-                c_b = color_list[obj_data.loops[idx].vertex_index][2]
-                color_layer.data[idx].color = (c_r, c_g, c_b, 1.0)
+        loop_colors = np.asarray(color_list, dtype=np.float32)[get_loop_vertices(obj_data)]
+        loop_colors[:, 3] = 1.0  # filtering out the alpha channel
+        color_layer.data.foreach_set("color", loop_colors.ravel())
         print("Vertex colors: Creating layer: ", obj_data.vertex_colors.keys())
     else:
         print("Vertex colors: Layer already present: ", layer_name, obj_data.vertex_colors.keys())
 
 
-def set_vertex_weights(mesh_obj, bone_name_list, bone_id_list, bone_weight_list):
+# bytes of index and weight arrays add_vertex_weights works with per vertex
+WEIGHT_SCRATCH_BYTES = 256
+
+
+def set_vertex_weights(mesh_obj, bone_name_list, bone_id_list, bone_weight_list, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """ Adds the vertex groups and weights; returns them as collect_vertex_weights will read them back """
     for bone_number in range(len(bone_name_list)):
         v_group = mesh_obj.vertex_groups.new(name=bone_name_list[bone_number])
         print("Generating vertex group", v_group)
-    for vert_inst in range(len(mesh_obj.data.vertices)):
-        id_tuple = bone_id_list[vert_inst]
-        weight_tuple = bone_weight_list[vert_inst]
-
-        if weight_tuple[0] > 0.0:
-            if len(mesh_obj.vertex_groups) > id_tuple[0]:
-                mesh_obj.vertex_groups[id_tuple[0]].add((vert_inst,), weight_tuple[0], 'ADD')
-        if weight_tuple[1] > 0.0:
-            if len(mesh_obj.vertex_groups) > id_tuple[1]:
-                mesh_obj.vertex_groups[id_tuple[1]].add((vert_inst,), weight_tuple[1], 'ADD')
-        if weight_tuple[2] > 0.0:
-            if len(mesh_obj.vertex_groups) > id_tuple[2]:
-                mesh_obj.vertex_groups[id_tuple[2]].add((vert_inst,), weight_tuple[2], 'ADD')
-        if weight_tuple[3] > 0.0:
-            if len(mesh_obj.vertex_groups) > id_tuple[3]:
-                mesh_obj.vertex_groups[id_tuple[3]].add((vert_inst,), weight_tuple[3], 'ADD')
 
+    group_count = len(mesh_obj.vertex_groups)
+    vertex_count = len(mesh_obj.data.vertices)
+    stored_ids = np.zeros((vertex_count, 4), dtype=np.int32)
+    stored_weights = np.zeros((vertex_count, 4), dtype=np.float32)
+    if group_count == 0 or vertex_count == 0:
+        return stored_ids, stored_weights
+    bone_ids = np.asarray(bone_id_list).reshape(-1, 4)[:vertex_count]
+    bone_weights = np.asarray(bone_weight_list, dtype=np.float32).reshape(-1, 4)[:vertex_count]
+    for start, stop in chunk_ranges(len(bone_ids), chunk_vertices(memory_budget, WEIGHT_SCRATCH_BYTES)):
+        stored_ids[start:stop], stored_weights[start:stop] = add_vertex_weights(
+            mesh_obj, start, bone_ids[start:stop], bone_weights[start:stop], group_count)
+    return stored_ids, stored_weights
+
+
+def add_vertex_weights(mesh_obj, first_vertex, bone_ids, bone_weights, group_count):
+    """ Adds the (n, 4) bone ids and weights of the vertices from first_vertex on to the vertex groups; returns the
+    (n, 4) groups and weights the vertices hold afterwards """
+    vertex_count = len(bone_ids)
+    bone_ids = bone_ids.astype(np.int64).ravel()
+    bone_weights = bone_weights.ravel()
+    vertices = np.repeat(np.arange(vertex_count), 4)
+    used = (bone_weights > 0.0) & (bone_ids < group_count)
+
+    # a vertex listing the same bone twice gets the sum, as repeated 'ADD's would do, kept within Blender's 0..1
+    keys, inverse = np.unique(vertices[used] * group_count + bone_ids[used], return_inverse=True)
+    weights = np.zeros(len(keys), dtype=np.float32)
+    np.add.at(weights, inverse, bone_weights[used])
+    weights = np.minimum(weights, np.float32(1.0))
+    vertices, groups = np.divmod(keys, group_count)
+
+    # groups are added in ascending order, so that is the order of each vertex's groups - the first four are read back
+    slots = np.arange(len(keys)) - np.searchsorted(vertices, vertices)
+    first_four = slots < 4
+    stored_ids = np.zeros((vertex_count, 4), dtype=np.int32)
+    stored_weights = np.zeros((vertex_count, 4), dtype=np.float32)
+    stored_ids[vertices[first_four], slots[first_four]] = groups[first_four]
+    stored_weights[vertices[first_four], slots[first_four]] = weights[first_four]
+
+    # one add() per vertex group and weight value - weights are bytes, so there are few distinct values
+    order = np.lexsort((weights, groups))
+    vertices, groups, weights = first_vertex + vertices[order], groups[order], weights[order]
+    starts = np.flatnonzero(np.r_[True, (np.diff(groups) != 0) | (np.diff(weights) != 0)])
+    for start, end in zip(starts, np.r_[starts[1:], len(groups)]):
+        mesh_obj.vertex_groups[int(groups[start])].add(vertices[start:end].tolist(), float(weights[start]), 'ADD')
+    return stored_ids, stored_weights
 
-def collect_vertex_weights(vertex_data):
-    vertex_weight_list = []
-    for vertex in vertex_data:
-        sub_list = []
-        for gp in vertex.groups:
-            w_group = gp.group
-            w_weight = gp.weight
-            sub_list.append((w_group, w_weight))
-        while len(sub_list) < 4:
-            sub_list.append((0, 0.0))
-        vertex_weight_list.append(sub_list)
 
-    return vertex_weight_list
+def collect_vertex_weights(vertex_data):
+    """ Group indices and weights of the first four groups of every vertex, as two (n, 4) arrays """
+    bone_ids = np.zeros((len(vertex_data), 4), dtype=np.int32)
+    bone_weights = np.zeros((len(vertex_data), 4), dtype=np.float32)
+    # the API has no bulk access to vertex groups - one pass gathers them, numpy places them
+    entries = [(vertex.index, slot, gp.group, gp.weight)
+               for vertex in vertex_data for slot, gp in zip(range(4), vertex.groups)]
+    if entries:
+        vertices, slots, groups, weights = zip(*entries)
+        bone_ids[vertices, slots] = groups
+        bone_weights[vertices, slots] = weights
+    return bone_ids, bone_weights
+
+
+def mesh_fingerprint(obj, vertex_weights=None):
+    """ Hash of everything exportmodel reads from a mesh object: geometry, UVs, normals, colors, weights, strings;
+    vertex_weights are the collect_vertex_weights arrays when the caller has them already """
+    mesh = obj.data
+    digest = hashlib.sha1(obj.name.encode("utf-8"))
+
+    def add(collection, attribute, dtype, width=1):
+        values = np.empty(len(collection) * width, dtype=dtype)
+        collection.foreach_get(attribute, values)
+        digest.update(values.tobytes())
+
+    add(mesh.vertices, "co", np.float32, 3)
+    add(mesh.loops, "vertex_index", np.int32)
+    add(mesh.polygons, "loop_total", np.int32)
+    mesh.calc_normals_split()
+    add(mesh.loops, "normal", np.float32, 3)
+    for name in sorted(mesh.uv_layers.keys()):
+        digest.update(name.encode("utf-8"))
+        add(mesh.uv_layers[name].data, "uv", np.float32, 2)
+    for name in sorted(mesh.vertex_colors.keys()):
+        digest.update(name.encode("utf-8"))
+        add(mesh.vertex_colors[name].data, "color", np.float32, 4)
+    digest.update(repr(obj.vertex_groups.keys()).encode("utf-8"))
+    if obj.vertex_groups:
+        for array in vertex_weights or collect_vertex_weights(mesh.vertices):
+            digest.update(array.tobytes())
+    digest.update(repr([item.name for item in obj.fmdl_strings]).encode("utf-8"))
+    return digest.hexdigest()
 
 
 def add_image_texture_to_material(node_type, texture_path, material):
@@ -376,63 +376,16 @@ def get_material(texture_name):
     return mat
 
 
-# http://davidejones.com/blog/1413-python-precision-floating-point/
-def halffloat2float(float16):
-    sign = int((float16 >> 15) & 0x00000001)
-    exponent = int((float16 >> 10) & 0x0000001f)
-    fraction = int(float16 & 0x000003ff)
-    if exponent == 0:
-        if fraction == 0:
-            return int(sign << 31)
-        else:
-            while not (fraction & 0x00000400):
-                fraction = fraction << 1
-                exponent -= 1
-            exponent += 1
-            fraction &= ~0x00000400
-    elif exponent == 31:
-        if fraction == 0:
-            return int((sign << 31) | 0x7f800000)
-        else:
-            return int((sign << 31) | 0x7f800000 | (fraction << 13))
-
-    exponent = exponent + (127 - 15)
-    fraction = fraction << 13
-    result = int((sign << 31) | (exponent << 23) | fraction)
-    return result
-
-
-# http://davidejones.com/blog/1413-python-precision-floating-point/
-def float2halffloat(float32):
-    F16_EXPONENT_BITS = 0x1F
-    F16_EXPONENT_SHIFT = 10
-    F16_EXPONENT_BIAS = 15
-    F16_MANTISSA_BITS = 0x3ff
-    F16_MANTISSA_SHIFT = (23 - F16_EXPONENT_SHIFT)
-    F16_MAX_EXPONENT = (F16_EXPONENT_BITS << F16_EXPONENT_SHIFT)
-
-    a = pack('>f', float32)
-    b = binascii.hexlify(a)
-
-    f32 = int(b, 16)
-    f16 = 0
-    sign = (f32 >> 16) & 0x8000
-    exponent = ((f32 >> 23) & 0xff) - 127
-    mantissa = f32 & 0x007fffff
-
-    if exponent == 128:
-        f16 = sign | F16_MAX_EXPONENT
-        if mantissa:
-            f16 |= (mantissa & F16_MANTISSA_BITS)
-    elif exponent > 15:
-        f16 = sign | F16_MAX_EXPONENT
-    elif exponent > -15:
-        exponent += F16_EXPONENT_BIAS
-        mantissa >>= F16_MANTISSA_SHIFT
-        f16 = sign | exponent << F16_EXPONENT_SHIFT | mantissa
-    else:
-        f16 = sign
-    return f16
+def load_models(managers_and_paths, cache=None):
+    """ Decodes several models at once, one thread each (file reads and NumPy decoding release the GIL).
+
+    managers_and_paths holds (manager, fmdl path) pairs; importmodel then only builds the Blender objects, which
+    has to happen on the main thread.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, len(managers_and_paths))) as pool:
+        futures = [pool.submit(manager.load_fmdl, path, cache) for manager, path in managers_and_paths]
+        for future in futures:
+            future.result()
 
 
 class FmdlManagerBase:
@@ -441,1251 +394,282 @@ class FmdlManagerBase:
         self.model_type = None
         self.temp_path = ""
         self.img_search_path = ""
-        self.export_offset = 0
-        self.export_vertex_offset = 0
-        self.vertex_header_position = 0
-        self.trailing_data_start = 0
-        self.trailing_data_end = 0
-        self.byte_16 = 0
-        self.byte_32 = 0
-        self.section0_header_count = 0
-        self.section1_header_count = 0
-        self.section0_offset = 0
-        self.section1_offset = 0
-        self.Section0_length = 0
-        self.section1_length = 0
-        self.section0_block_list = {}
-        self.section1_block_list = {}
-        self.skeleton_flag = False
-        self.skeleton_list = []
-        self.mesh_group_def_list = []
-        self.object_assignment_list = []
-        self.object_data_list = []
-        self.block4_data_list = []
-        self.bone_group_list = []
-        self.block6_data_list = []
-        self.mat_param_data_list = []
-        self.block8_data_list = []
-        self.block9_data_list = []
-        self.vbuffer_def_list = []
-        self.vert_format_def_list = []
-        self.string_buffer_list = []
-        self.string_list = []
-        self.block13_data_list = []
-        self.buffer_offset_list = []
-        self.lod_list = []
-        self.face_index_table_list = []
-        self.block18_data_list = []
-        self.block20_data_list = []
-        self.block1_0_data_list = []
-        self.block1_1_data_list = []
-        self.vformat_per_submesh_list = []
+        self.model = Fmdl.FmdlModel()
         self.local_mesh_data = []
-        self.internal_ex_submesh_vert_weights_list = []
         self.internal_mesh_list = []
         self.material_assignment = []
-        self.textures = []
         self.sourceimages_path = os.path.normpath(os.path.join(os.path.dirname(base_path), '..',
                                                                'sourceimages/#windx11'))
         self.vertexgroup_disable = False
         self.auto_smooth = True
         self.temp_path = tempfile_path
+        # decoded model and vertices, filled by load_fmdl
+        self.loaded_path = None
+        self.submesh_vertices = []
+        # fingerprint of the meshes as last imported / exported, to skip exports that wouldn't change the file
+        self.fingerprint = None
+        # weights set_vertex_weights wrote, by object name, so the import fingerprint needn't read them back
+        self.imported_weights = {}
         super().__init__()
 
-    def parse_fmdl(self, work_filepath):
+    @property
+    def skeleton_flag(self):
+        return self.model.has_block(Fmdl.BLOCK_BONES)
+
+    def load_fmdl(self, work_filepath, cache=None):
+        """ Decodes the model and its vertices into plain arrays, or takes them from an ImportCache. Doesn't touch
+        Blender, so it can run on a worker thread while other models load. """
         print("Opening fmdl file: ", work_filepath)
-        sub_mesh_list = []
-        work_file = open(work_filepath, 'rb')
-        buf = unpack("4c", work_file.read(4))
-        # if buf != "FMDL":
-        print(f"Warning: wrong header - expected 'FMDL', got '{buf}'")
-        [fl] = unpack("f", work_file.read(4))
-        print(f"File version: {fl:.2f}")
-
-        # 0x10 - 0x17 (uint64): Section 0 blocks' binary flags.
-        work_file.seek(0x10, 0)
-        self.byte_16 = unpack("B", work_file.read(1))[0]
-        # 0x18 - 0x1F (uint64): Section 1 blocks' binary flags.
-        work_file.seek(0x18, 0)
-        self.byte_32 = unpack("B", work_file.read(1))[0]
-
-        # 0x20 - 0x23 (uint32): Number of blocks in section 0.
-        # 0x24 - 0x27 (uint32): Number of blocks in section 1.
-        work_file.seek(0x20, 0)
-        self.section0_header_count, self.section1_header_count = unpack("2I", work_file.read(8))
-        # 0x28 - 0x2B (uint32): Section 0 offset.
-        # 0x2C - 0x2F (uint32): Section 0 length.
-        self.section0_offset, self.Section0_length = unpack("2I", work_file.read(8))
-        # 0x30 - 0x33 (uint32): Section 1 offset.
-        # 0x34 - 0x37 (uint32): Section 1 length.
-        self.section1_offset, self.section1_length = unpack("2I", work_file.read(8))
-        # 0x38 - 0x3F: Padding.
-
-        # Section 0x0 Blocks
-        work_file.seek(0x40, 0)
-        for data_block0 in range(self.section0_header_count):
-            block_id = unpack("H", work_file.read(2))[0]
-            entry_count = unpack("H", work_file.read(2))[0]
-            block_offset = unpack("I", work_file.read(4))[0]
-            self.section0_block_list[block_id] = [block_id, entry_count, block_offset]
-
-        # print ("entry1 ",work_file.tell(),"\n")
-        for data_block1 in range(self.section1_header_count):
-            block_id, block_offset, block_size = unpack("3I", work_file.read(12))
-            self.section1_block_list[block_id] = [block_id, block_offset, block_size]
-
-        sub_mesh_count = self.section0_block_list[3][1]
-        log("sub_mesh_count", sub_mesh_count)
-
-        # get skeleton if available
-        if self.section0_block_list.get(0) is not None:
-            self.skeleton_flag = True
+        with Profile.stage('decode fmdl', file=os.path.basename(work_filepath)):
+            memory_budget = PesFacemodGlobalData.vertex_memory_budget
+            if cache is not None:
+                self.model, self.submesh_vertices = cache.read_model(work_filepath, memory_budget)
+            else:
+                self.model = Fmdl.read(work_filepath)
+                self.submesh_vertices = model_vertices(self.model, memory_budget)
+        self.loaded_path = work_filepath
 
-        if self.skeleton_flag:
-            work_file.seek(self.section0_offset + self.section0_block_list[0][2], 0)
-            log("\n0x00   Skelly@", work_file.tell())
-            for bn in range(self.section0_block_list[0][1]):
-                bone_id, bone_parent, bounding_box_id, unknown0, unknown1, padding0 = unpack("6H", work_file.read(12))
-
-                padding1 = unpack("I", work_file.read(4))
-
-                bx_l, by_l, bz_l, bw_l = unpack("4f", work_file.read(16))  # local
-                bx_w, by_w, bz_w, bw_w = unpack("4f", work_file.read(16))  # world
-
-                self.skeleton_list.append((bone_id, bone_parent, bounding_box_id, unknown0, unknown1, padding0, bx_l,
-                                           by_l, bz_l, bw_l, bx_w, by_w, bz_w, bw_w))
-                log("bone@", work_file.tell())
-                log("bone", bone_id, bone_parent, bounding_box_id, unknown0, unknown1, padding0)
-                log("Coords:", by_l, bx_l, bz_l, bw_l, "Coords2:", bx_w, by_w, bz_w, bw_w)  # 0xFFFF = root
-            log("Block13 data:not printed")
-
-        # get mesh group defs
-        work_file.seek(self.section0_offset + self.section0_block_list[1][2], 0)
-        log("\nOxO1   mesh group def@", work_file.tell())
-        for mgd in range(self.section0_block_list[1][1]):
-            name_position = unpack("H", work_file.read(2))[0]
-            invis_flag, pad = unpack("2B", work_file.read(2))
-            parent_id, unknown = unpack("2H", work_file.read(4))
-            self.mesh_group_def_list.append((name_position, invis_flag, parent_id))
-
-            log("mesh_group_def", name_position, invis_flag, parent_id, unknown)
-
-        # get object assignment table
-        work_file.seek(self.section0_offset + self.section0_block_list[2][2], 0)
-        log("\n0x02   Obj table@", work_file.tell())
-        for oba in range(self.section0_block_list[2][1]):
-            pad0, mesh_group_id, mesh_group_obj_count, preceding_obj_count, entry_id, pad1, unknown = unpack("I4HIH",
-                                                                                                             work_file.read(
-                                                                                                                 18))
-            work_file.seek(14, 1)
-            self.object_assignment_list.append(
-                (mesh_group_id, mesh_group_obj_count, preceding_obj_count, entry_id, unknown))
-
-            log("obj group", pad0, mesh_group_id, mesh_group_obj_count, preceding_obj_count, entry_id, pad1,
-                unknown)
-
-        print("Object assignment list: ", self.object_assignment_list)
-
-        # get object data (get vert counts)
-        work_file.seek(self.section0_offset + self.section0_block_list[3][2], 0)
-        log("\n0x03   Obj data@", work_file.tell())
-        for obd in range(self.section0_block_list[3][1]):
-            unknown_int = unpack("I", work_file.read(4))[0]
-            mat_instance_id, bone_group_id, entry_id, vert_count = unpack("4H", work_file.read(8))
-            work_file.seek(4, 1)  # padding
-            first_face_vert_id, face_vert_count = unpack("2I", work_file.read(8))
-            unknown_long = unpack("I", work_file.read(4))[0]
-            work_file.seek(20, 1)
-
-            self.object_data_list.append((unknown_int, mat_instance_id, bone_group_id, entry_id, vert_count,
-                                          first_face_vert_id, face_vert_count, unknown_long))
-            sub_mesh_list.append((vert_count, first_face_vert_id, face_vert_count))
-
-            print("Obj data", unknown_int, mat_instance_id, bone_group_id, entry_id, vert_count, first_face_vert_id,
-                  face_vert_count, unknown_long)
-
-            print("Material instance id: ", mat_instance_id)
+    def parse_fmdl(self, work_filepath):
+        if self.loaded_path != work_filepath:
+            self.load_fmdl(work_filepath)
+        model = self.model
+        print(f"File version: {model.header.version:.2f}")
+        log("sub_mesh_count", len(model.meshes))
+        print("Object assignment list: ", model.mesh_group_assignments)
+
+        for mesh in model.meshes:
+            print("Obj data", mesh)
+            print("Material instance id: ", mesh.material_instance)
             new_material_assignment = MaterialAssignment(
-                material_index=mat_instance_id, mesh_index=entry_id, name_index=0)
+                material_index=mesh.material_instance, mesh_index=mesh.entry_id, name_index=0)
             self.material_assignment.append(new_material_assignment)
 
-        # get Material instance def
-        work_file.seek(self.section0_offset + self.section0_block_list[4][2], 0)
-        log("\n0x04 Mat instance def@", work_file.tell())
-        for mtu in range(self.section0_block_list[4][1]):
-            name_position, pad_short, material_index = unpack("3H", work_file.read(6))
-            texture_count, parameter_count = unpack("2B", work_file.read(2))
-            first_texture_index, first_parameter_index, pad_int = unpack("2HI", work_file.read(8))
-            self.block4_data_list.append(
-                (name_position, material_index, texture_count, parameter_count, first_texture_index,
-                 first_parameter_index))
-
-        print("Block4 data (material instance)", self.block4_data_list)
-
-        # get bone group table
-        if self.skeleton_flag:
-            work_file.seek(self.section0_offset + self.section0_block_list[5][2], 0)
-            log("\n0x05   Bone group table@", work_file.tell())
-            for ob in range(self.section0_block_list[5][1]):
-                unknown_int, bone_entry_count = unpack("2H", work_file.read(4))
-                bone_entry_list = []
-                for bec in range(bone_entry_count):
-                    bone_entry = unpack("H", work_file.read(2))[0]
-                    bone_entry_list.append(bone_entry)
-                work_file.seek(64 - bone_entry_count * 2, 1)
-                self.bone_group_list.append((unknown_int, bone_entry_count, bone_entry_list))
-                log("bone group", unknown_int, bone_entry_count, "\nbone_entry_list", bone_entry_list)
-            log("Bone Groups:not printed")
-
-        # get texture defs
-        work_file.seek(self.section0_offset + self.section0_block_list[6][2], 0)
-        log("\n0x06 Texture defs@", work_file.tell())
-        for te in range(self.section0_block_list[6][1]):
-            name_position, texture_name_position = unpack("2H", work_file.read(4))
-            self.block6_data_list.append((name_position, texture_name_position))
-            print("Block6 data", name_position, texture_name_position)
-            self.textures.append(Texture(name_index=name_position, path_index=texture_name_position))
-
-        # get material parameter defs
-        work_file.seek(self.section0_offset + self.section0_block_list[7][2], 0)
-        log("\n0x07 Mat param Defs@", work_file.tell())
-        for mpd in range(self.section0_block_list[7][1]):
-            mat_param_type_name_position, mat_param_name_position = unpack("2H", work_file.read(4))
-            self.mat_param_data_list.append((mat_param_type_name_position, mat_param_name_position))
-            log("Mat param data", mat_param_type_name_position, mat_param_name_position)
-        log("Mat param Defs:not printed")
-
-        # get Material type defs
-        work_file.seek(self.section0_offset + self.section0_block_list[8][2], 0)
-        log("\n0x08 Mat type defs@", work_file.tell())
-        for bl8 in range(self.section0_block_list[8][1]):
-            string_id, material_type = unpack("2H", work_file.read(4))
-            self.block8_data_list.append((string_id, material_type))
-            log("Block8 data", string_id, material_type)
-        log("Mat type defs:not printed")
-
-        # get mesh format assignment
-        work_file.seek(self.section0_offset + self.section0_block_list[9][2], 0)
-        log("\n0x09 Mesh format assignment@", work_file.tell())
-        for bl9 in range(self.section0_block_list[9][1]):
-            mesh_fe_count, vert_fe_count, unknown_short, first_mfe_id, first_vfd_id = unpack("2B3H", work_file.read(8))
-            self.block9_data_list.append((mesh_fe_count, vert_fe_count, unknown_short, first_mfe_id, first_vfd_id))
-            log("Block9 data", mesh_fe_count, vert_fe_count, unknown_short, first_mfe_id, first_vfd_id)
-        log("Mesh format def:not printed")
-
-        #
-        work_file.seek(self.section0_offset + self.section0_block_list[10][2], 0)
-        log("\n0x0A VBuffer Defs@", work_file.tell())
-        for vbd in range(self.section0_block_list[10][1]):
-            buffer_offset_id, vert_fe_count, buffer_length, mfd_type, buffer_offset = unpack("4BI", work_file.read(8))
-            self.vbuffer_def_list.append((buffer_offset_id, vert_fe_count, buffer_length, mfd_type, buffer_offset))
-            log("Vbuffer data", buffer_offset_id, vert_fe_count, buffer_length, mfd_type, buffer_offset)
-        log("Block10 data:not printed")
-
-        # get block11, data types unknown, each entry 4 bytes long
-        work_file.seek(self.section0_offset + self.section0_block_list[11][2], 0)
-        log("\n0x0B Vertex format defs@", work_file.tell())
-        for blb in range(self.section0_block_list[11][1]):
-            usage, data_type, format_offset = unpack("2BH", work_file.read(4))
-            self.vert_format_def_list.append((usage, data_type, format_offset))
-            log("Vert format def", usage, data_type, format_offset)
-        log("Block11 data:not printed")
-
-        # fetch string buffer data
-        work_file.seek(self.section0_offset + self.section0_block_list[12][2], 0)
-        log("\n0x0C String Buffer@", work_file.tell())
-        for sb in range(self.section0_block_list[12][1]):
-            string_type, string_length, string_offset = unpack("2HI", work_file.read(8))
-            self.string_buffer_list.append((string_type, string_length, string_offset))
-
-        # fetch strings
-        self.string_list.clear()
-        for sa in range(self.section0_block_list[12][1]):
-            work_file.seek(self.section1_offset + self.section1_block_list[3][1] + self.string_buffer_list[sa][2], 0)
-            temp_string_length = self.string_buffer_list[sa][1]
-            unpack_string = str(temp_string_length) + "s"
-            temp_string = unpack(unpack_string, work_file.read(temp_string_length))[0]
-            self.string_list.append(temp_string.decode("utf-8"))
-        print("String list: ", self.string_list)
-
-        # get Bounding box defs
-        work_file.seek(self.section0_offset + self.section0_block_list[13][2], 0)
-        log("\n0x0D Bounding box defs@", work_file.tell())
-        for bld in range(self.section0_block_list[13][1]):
-            d_0, d_1, d_2, d_3 = unpack("4f", work_file.read(16))
-            d_4, d_5, d_6, d_7 = unpack("4f", work_file.read(16))
-            self.block13_data_list.append((d_0, d_1, d_2, d_3, d_4, d_5, d_6, d_7))
-            log("Block13 data", d_0, d_1, d_2, d_3, d_4, d_5, d_6, d_7)
-        log("Bounding box defs:not printed")
-
-        # Get buffer offset table
-        work_file.seek(self.section0_offset + self.section0_block_list[14][2], 0)
-        log("\n0x0E buffer offset table@", work_file.tell())
-        for bot in range(self.section0_block_list[14][1]):
-            unknown_int, buffer_size, buffer_offset, padding = unpack("4I", work_file.read(
-                16))  # unknown_int might be EoF flag
-            self.buffer_offset_list.append((unknown_int, buffer_size, buffer_offset))
-            log("buffer offset table", unknown_int, buffer_size, buffer_offset, padding)
-
-        # block 0x0f = Error 404 block not found
-
-        # get LOD info
-        work_file.seek(self.section0_offset + self.section0_block_list[16][2], 0)
-        log("\n0x10 Lod info@", work_file.tell())
-        for lfi in range(self.section0_block_list[16][1]):
-            lod_count, hd_distance, sd_distance, lo_distance = unpack("I3f", work_file.read(16))
-            self.lod_list.append((lod_count, hd_distance, sd_distance, lo_distance))
-            log("Lod data", lod_count, hd_distance, sd_distance, lo_distance)
-
-        # get LOD face index table
-        work_file.seek(self.section0_offset + self.section0_block_list[17][2], 0)
-        log("\n0x11 face index table@", work_file.tell())
-        for blfi in range(self.section0_block_list[17][1]):
-            preceeding_face_vert_count, face_vert_count = unpack("2I", work_file.read(8))
-            self.face_index_table_list.append((preceeding_face_vert_count, face_vert_count))
-            log("face index table", preceeding_face_vert_count, face_vert_count)
-        log("Block11 data:not printed")
-
-        # get block18, unknown purpose, 8 byte entries always all 0s
-        work_file.seek(self.section0_offset + self.section0_block_list[18][2], 0)
-        log("\n0x12 Block18@", work_file.tell())
-        for bln in range(self.section0_block_list[18][1]):
-            entry_bin = work_file.read(8)
-            self.block18_data_list.append(entry_bin)
-            log("Block18 data", entry_bin)
-        log("Block18 data:not printed")
-
-        # block 0x13 = Error 404 block not found
-
-        # get block20, unknown purpose and data types currently assumed 32 bytes long
-        work_file.seek(self.section0_offset + self.section0_block_list[20][2], 0)
-        log("\n0x14 Block20@", work_file.tell())
-        for bln in range(self.section0_block_list[20][1]):
-            entry_bin = work_file.read(32)
-            self.block20_data_list.append(entry_bin)
-            log("Block20 data", entry_bin)
-        log("Block20 data:not printed")
-
-        # 8 bytes of padding (rounds header to nearest 16)
-        # 96 bytes of padding before the section1 headers start
-
-        ##--section 1 headers below --
-
-        # section1 header 0 start, unknown purpose, 16 bytes of 0s
-        work_file.seek(self.section1_offset + self.section1_block_list[0][1], 0)
-        log("\nSection1-0@", work_file.tell())
-        entry_bin = work_file.read(self.section1_block_list[0][2])
-        self.block1_0_data_list.append(entry_bin)
-        log("Section1-0 data", entry_bin)
-        log("Block1-0 data:not printed")
-
-        # section1 header 1 start, unknown purpose
-        if self.section1_block_list.get(1) is not None:
-            work_file.seek(self.section1_offset + self.section1_block_list[1][1], 0)
-            log("\nSection1-1@", work_file.tell())
-            entry_bin = work_file.read(self.section1_block_list[1][2])
-            self.block1_1_data_list.append(entry_bin)
-            log("Section1-1 data", entry_bin)
-            log("Block1-1 data:not printed")
-
-        # get header 2
-        work_file.seek(self.section1_offset + self.section1_block_list[2][1], 0)
-        log("\nSection1-2@", work_file.tell())
-
-        # Below is where the mesh is constructed
-        #
-        #
-        #
-
-        # Get Mesh Geometry
-        buffer_offset1 = self.section1_block_list[2][1]
-
-        vertex_list_offset = self.section1_offset + buffer_offset1
-
-        uv_buffer_offset = self.buffer_offset_list[1][2]
-        uv_list_offset = self.section1_offset + buffer_offset1 + uv_buffer_offset
-        log("\nuv_list_offset", uv_list_offset)
-        log("uv_list_size  ", self.buffer_offset_list[1][1])
-
-        face_buffer_offset = self.buffer_offset_list[2][2]
-        face_list_offset = self.section1_offset + buffer_offset1 + face_buffer_offset
-        log("\nface_list_offset ", face_list_offset)
+        print("Block4 data (material instance)", model.material_instances)
+        print("String list: ", model.strings)
 
         # organize skeleton list into specific lists
-        # bone_list=[]
         bone_position_list = []
         bone_name_list = []
         submesh_bone_names_list = []
         if self.skeleton_flag:
-            for bone_ent in range(len(self.skeleton_list)):
-                # bone_list.append(self.skeleton_list[bone_ent][0])
-                b_x = self.skeleton_list[bone_ent][6]
-                b_y = self.skeleton_list[bone_ent][7]
-                b_z = self.skeleton_list[bone_ent][8]
-                bone_position_list.append((b_x, b_y, b_z))
-                bone_name_list.append(self.string_list[bone_ent + 1])
+            for bone_ent, bone in enumerate(model.bones):
+                bone_position_list.append((bone.local_x, bone.local_y, bone.local_z))
+                bone_name_list.append(model.strings[bone_ent + 1])
             if not self.vertexgroup_disable:
-                mesh_rig = generate_skeleton(self.model_type, bone_name_list, bone_position_list)
+                with Profile.stage('skeleton', model=self.model_type):
+                    mesh_rig = generate_skeleton(self.model_type, bone_name_list, bone_position_list)
 
-            for bgl in range(len(self.bone_group_list)):
-                sub_list = []
-                for name_entry in range(len(self.bone_group_list[bgl][2])):
-                    bone_name = bone_name_list[self.bone_group_list[bgl][2][name_entry]]
-                    sub_list.append(bone_name)
-                submesh_bone_names_list.append(sub_list)
+            for bone_group in model.bone_groups:
+                submesh_bone_names_list.append([bone_name_list[bone_entry] for bone_entry in bone_group.bones])
 
             log("bone sub lists")
             log(submesh_bone_names_list)
 
         # construct list of MTL strings
         first_mtl_string = 1
-        first_mtl_string += len(self.skeleton_list)
+        first_mtl_string += len(model.bones)
 
-        mtl_list = self.string_list[first_mtl_string:]
+        mtl_list = model.strings[first_mtl_string:]
         log("MTL list")
         log(mtl_list)
 
-        # organize format list into a list per submesh
-        format_sublist = []
-        for ent in range(len(self.vert_format_def_list)):
-            if self.vert_format_def_list[ent][0] == 0:
-                if len(format_sublist) != 0:
-                    self.vformat_per_submesh_list.append(format_sublist)
-                    format_sublist = [0]
-                else:
-                    format_sublist.append(0)
-            else:
-                format_sublist.append(self.vert_format_def_list[ent][0])
-        self.vformat_per_submesh_list.append(format_sublist)  # add last list, sloppy cleanup code
-
-        log("vformat", self.vformat_per_submesh_list)
-
-        for subm in range(sub_mesh_count):
-            vertexlist, uvlist, facelist = [], [], []
-            uvlist_normal = []
-            bone_weight_list = []
-            bone_id_list = []
-            vertex_color_list = []
-
-            sub_mesh_verts = sub_mesh_list[subm][0]
-            sub_mesh_format = self.vformat_per_submesh_list[subm]
-            v_normals_list = []
-
-            work_file.seek(vertex_list_offset, 0)
-            for vert in range(sub_mesh_verts):
-                x, z, y = unpack("3f", work_file.read(12))
-                vertexlist.append((x, y * -1, z))  # flip from fox engine orientation
-            # print ("Vert list end ",work_file.tell(),"\n")
-
-            # seek to next vertex block
-            while (work_file.tell() % 16) != 0:
-                work_file.seek(4, 1)
-            vertex_list_offset = work_file.tell()
-
-            work_file.seek(uv_list_offset)
-            for uvc in range(sub_mesh_verts):
-                for ent in range(len(sub_mesh_format)):
-                    current_usage = sub_mesh_format[ent]
-                    # the order in which these are evaluated is very important
-                    if current_usage == 2:  # normals
-                        norm_x, norm_y, norm_z, norm_w = unpack("4H", work_file.read(8))  # actually half floats
-                        sx = halffloat2float(norm_x)
-                        sy = halffloat2float(norm_y)
-                        sz = halffloat2float(norm_z)
-                        sw = halffloat2float(norm_w)
-                        str0 = pack('I', sx)
-                        str1 = pack('I', sy)
-                        str2 = pack('I', sz)
-                        str3 = pack('I', sw)
-                        fl_x = unpack('f', str0)[0]
-                        fl_y = unpack('f', str1)[0]
-                        fl_z = unpack('f', str2)[0]
-                        fl_w = unpack('f', str3)[0]
-                        v_normals_list.append((fl_x, fl_z * -1, fl_y))  # flip from fox engine orientation
-                    if current_usage == 14:  # tangents
-                        tan_x, tan_y, tan_z, tan_w = unpack("4H", work_file.read(8))  # actually half floats
-                    if current_usage == 3:  # color
-                        r, g, b, a = unpack("4B", work_file.read(4))
-                        vertex_color_list.append((r / 255, g / 255, b / 255, a / 255))
-                    if current_usage == 1:  # bone weight
-                        bw0, bw1, bw2, bw3 = unpack("4B", work_file.read(4))
-                        bone_weight_list.append((bw0 / 255, bw1 / 255, bw2 / 255, bw3 / 255))
-                    if current_usage == 7:  # bone ids
-                        bid0, bid1, bid2, bid3 = unpack("4B", work_file.read(4))
-                        bone_id_list.append((bid0, bid1, bid2, bid3))
-                    if current_usage == 8:  # UV
-                        tu, tv = unpack("2H", work_file.read(4))
-                        su = halffloat2float(tu)
-                        sv = halffloat2float(tv)
-                        str0 = pack('I', su)
-                        str1 = pack('I', sv)
-                        fu = unpack('f', str0)[0]
-                        fv = unpack('f', str1)[0]
-                        uvlist.append((fu, (fv - 1) * -1))
-                    if current_usage == 9:  # UV2
-                        nu, nv = unpack("2H", work_file.read(4))
-                        snu = halffloat2float(nu)
-                        snv = halffloat2float(nv)
-                        str2 = pack('I', snu)
-                        str3 = pack('I', snv)
-                        fnu = unpack('f', str2)[0]
-                        fnv = unpack('f', str3)[0]
-                        uvlist_normal.append((fnu, (fnv * -1) + 1))
-            while (work_file.tell() % 16) != 0:
-                work_file.seek(4, 1)
-            uv_list_offset = work_file.tell()
-
-            work_file.seek(face_list_offset + (sub_mesh_list[subm][1] * 2),
-                           0)  # change sub_mesh_list[0][1] to -> sub_mesh_list[subm][1]
-            log("face_start ", work_file.tell())
-            for face in range(int(sub_mesh_list[subm][2] / 3)):  # change face_nodes to -> sub_mesh_list[subm][2]
-                f1, f2, f3 = unpack("3H", work_file.read(6))
-                facelist.append((f3, f2, f1))
-            log("face_end   ", work_file.tell())
-
-            # attempt to construct mesh
+        for subm, mesh_buffer in enumerate(model.mesh_buffers):
             submesh_name = self.model_type + "_" + str(subm)
-            print("Creating object ", submesh_name)
-            submesh_object = allocate_object(submesh_name, vertexlist, facelist)
-            self.internal_mesh_list.append(submesh_object)
-            allocate_maps(submesh_object, facelist, uvlist, uvlist_normal)
-
-            # attempt to apply custom vertex normals???
-            sub_mesh_data = submesh_object.data
-            sub_mesh_data.calc_normals_split()
-
-            # Smooth shading for all polys
-            sub_mesh_data.use_auto_smooth = True
-            for f in sub_mesh_data.polygons:
-                f.use_smooth = True
-            sub_mesh_data.normals_split_custom_set_from_vertices(v_normals_list)
-
-            # apply vertex colors
-            if len(vertex_color_list) != 0:
-                set_vertex_colors(self.model_type + '_Anim', submesh_object.data, vertex_color_list)
-            self.local_mesh_data.append(sub_mesh_data)
-            # populate sring list for editing
-            if subm == 1:
-                for st in range(len(mtl_list)):
-                    item = submesh_object.fmdl_strings.add()
-                    item.name = mtl_list[st]
-                    print("item.name = ", mtl_list[st])
-            # link to skeleton
-            if self.skeleton_flag:
-                mod = submesh_object.modifiers.new(self.model_type + '_rig_modifier', 'ARMATURE')
-                mod.object = mesh_rig
-                mod.use_bone_envelopes = False
-                mod.use_vertex_groups = True
-                mesh_rig.select_set(False)
-                bone_group_id = self.object_data_list[subm][2]
-                bone_sub_list = submesh_bone_names_list[bone_group_id]
-                set_vertex_weights(submesh_object, bone_sub_list, bone_id_list, bone_weight_list)
+            with Profile.stage('build submesh', submesh=submesh_name):
+                sub_mesh_vertices = self.submesh_vertices[subm]
+                # blender winding is the reverse of the fox engine's
+                facelist = flip_winding(mesh_buffer.faces)
+                out_of_range, degenerate = face_problems(facelist, sub_mesh_vertices.count)
+                if out_of_range.any() or degenerate.any():
+                    print(f"{submesh_name}: skipping {np.count_nonzero(out_of_range)} triangles past the "
+                          f"{sub_mesh_vertices.count} vertices and {np.count_nonzero(degenerate)} degenerate ones")
+                    facelist = facelist[~(out_of_range | degenerate)]
+                Profile.count('vertices', sub_mesh_vertices.count)
+                Profile.count('faces', len(facelist))
+
+                # attempt to construct mesh
+                print("Creating object ", submesh_name)
+                submesh_object = allocate_object(submesh_name, sub_mesh_vertices.positions, facelist)
+                self.internal_mesh_list.append(submesh_object)
+                with Profile.stage('uv maps', submesh=submesh_name):
+                    allocate_maps(submesh_object, facelist, sub_mesh_vertices.uvs, sub_mesh_vertices.uvs_normal)
+
+                # attempt to apply custom vertex normals???
+                sub_mesh_data = submesh_object.data
+                with Profile.stage('normals', submesh=submesh_name):
+                    sub_mesh_data.calc_normals_split()
+
+                    # Smooth shading for all polys
+                    sub_mesh_data.use_auto_smooth = True
+                    sub_mesh_data.polygons.foreach_set("use_smooth",
+                                                       np.ones(len(sub_mesh_data.polygons), dtype=bool))
+                    sub_mesh_data.normals_split_custom_set_from_vertices(sub_mesh_vertices.normals)
+
+                # apply vertex colors
+                if sub_mesh_vertices.colors.size != 0:
+                    set_vertex_colors(self.model_type + '_Anim', submesh_object.data, sub_mesh_vertices.colors)
+                self.local_mesh_data.append(sub_mesh_data)
+                # populate sring list for editing
+                if subm == 1:
+                    for st in range(len(mtl_list)):
+                        item = submesh_object.fmdl_strings.add()
+                        item.name = mtl_list[st]
+                        print("item.name = ", mtl_list[st])
+                # link to skeleton
+                if self.skeleton_flag:
+                    mod = submesh_object.modifiers.new(self.model_type + '_rig_modifier', 'ARMATURE')
+                    mod.object = mesh_rig
+                    mod.use_bone_envelopes = False
+                    mod.use_vertex_groups = True
+                    mesh_rig.select_set(False)
+                    bone_sub_list = submesh_bone_names_list[model.meshes[subm].bone_group]
+                    with Profile.stage('vertex weights', submesh=submesh_name):
+                        self.imported_weights[submesh_object.name] = set_vertex_weights(
+                            submesh_object, bone_sub_list, sub_mesh_vertices.bone_ids, sub_mesh_vertices.bone_weights,
+                            memory_budget=PesFacemodGlobalData.vertex_memory_budget)
+                # Blender has its own copy now
+                self.submesh_vertices[subm] = None
+        # decoded again if the file is imported again
+        self.submesh_vertices = []
+        self.loaded_path = None
 
     def importmodel(self, file_path):
-        # reinitialize all variables
-        self.byte_16 = 0
-        self.byte_32 = 0
-
-        self.section0_header_count = 0
-        self.section1_header_count = 0
-
-        self.section0_offset = 0
-        self.section1_offset = 0
-
-        self.Section0_length = 0
-        self.section1_length = 0
-
-        self.section0_block_list = {}
-        self.section1_block_list = {}
-        self.skeleton_flag = False
-        self.skeleton_list = []
-        self.mesh_group_def_list = []
-        self.object_assignment_list = []
-        self.object_data_list = []
-        self.block4_data_list = []
-        self.bone_group_list = []
-        self.block6_data_list = []
-        self.mat_param_data_list = []
-        self.block8_data_list = []
-        self.block9_data_list = []
-        self.vbuffer_def_list = []
-        self.vert_format_def_list = []
-        self.string_buffer_list, string_list = [], []
-        self.block13_data_list = []
-        self.buffer_offset_list = []
-        self.lod_list = []
-        self.face_index_table_list = []
-        self.block18_data_list = []
-        self.block20_data_list = []
-        self.block1_0_data_list = []
-        self.block1_1_data_list = []
-        self.vformat_per_submesh_list = []
         self.img_search_path = os.path.dirname(file_path) + os.sep
-        self.internal_ex_submesh_vert_weights_list.clear()
 
         self.parse_fmdl(file_path)
         self.show_materials()
+        self.fingerprint = self.meshes_fingerprint(collect_objects(self.model_type), self.imported_weights)
+        self.imported_weights = {}
         return self.local_mesh_data
 
+    @staticmethod
+    def meshes_fingerprint(objlist, vertex_weights=None):
+        """ vertex_weights maps object names to their collect_vertex_weights arrays, where known """
+        digest = hashlib.sha1()
+        for obj in objlist:
+            digest.update(mesh_fingerprint(obj, (vertex_weights or {}).get(obj.name)).encode("ascii"))
+        return digest.hexdigest()
+
     def exportmodel(self, fmdl_filename):
-        scn = bpy.context.scene
-        submesh_vert_count_list = []
-
-        ex_section1_block_list = []
-
-        submesh_vertex_list = []
-        ex_submesh_face_tuple_list = []
-        ex_submesh_uv_list = []
-        ex_submesh_nrm_uv_list = []
-        ex_submesh_count = 0
-        ex_custom_normals_list = []
-        ex_custom_tangents_list = []
-
-        ex_submesh_vert_weights_list = []
-        ex_submesh_vert_color_list = []
-        ex_vbuffer_def_list = []
-        ex_buffer_offset_list = []
-
-        ex_string_defs = []
-        ex_string_list = []
+        """ Writes the model's meshes to fmdl_filename; returns False when they are unchanged since the last import
+        or export and the file is kept as it is """
+        mesh_buffers = []
         ex_mtl_strings = []
 
         objlist = collect_objects(self.model_type)
-        ex_submesh_count = len(objlist)
+        # read once, for the fingerprint and the export
+        vertex_weights = {obj.name: collect_vertex_weights(obj.data.vertices) for obj in objlist if obj.vertex_groups}
+        fingerprint = self.meshes_fingerprint(objlist, vertex_weights)
+        if fingerprint == self.fingerprint and os.path.exists(fmdl_filename):
+            print(f"{self.model_type} meshes unchanged, keeping {fmdl_filename}")
+            return False
 
         for count, obj in enumerate(objlist):
-            # obj.data.calc_tessface()  # supresses tessalation error when getting UV data
-            obj.data.calc_loop_triangles()
-            submesh_vert_count_list.append(len(obj.data.vertices))
-            submesh_vertex_list.append(obj.data.vertices)
-
-            face_list = get_face_tuples(obj)
-            ex_submesh_face_tuple_list.append(face_list)
-
-            uv_list = get_uv_map(obj, "UVMap")
-            ex_submesh_uv_list.append(uv_list)
-
-            if "normal_map" in obj.data.uv_layers:
-                uv_nrml_list = get_uv_map(obj, "normal_map")
-            else:
-                uv_nrml_list = get_uv_map(obj, "UVMap")
-            ex_submesh_nrm_uv_list.append(uv_nrml_list)
-
-            custom_nrm_list = get_custom_vertex_normals(obj)
-            ex_custom_normals_list.append(custom_nrm_list)
-            print(f"Adding normals info for {obj.name} - {len(custom_nrm_list)} vertices")
-
-            if "normal_map" in obj.data.uv_layers:
-                custom_tan_list = get_custom_vertex_tangents(obj, "normal_map")
-            else:
-                custom_tan_list = get_custom_vertex_tangents(obj, "UVMap")
-            ex_custom_tangents_list.append(custom_tan_list)
-
-            if self.skeleton_flag:
-                ex_submesh_vert_weights_list.append(collect_vertex_weights(obj.data.vertices))
-
-            vertex_color_list = []
-            if obj.data.vertex_colors:
-                # initialize list of default vertex colors
-                vertex_color_list = [[1, 1, 1, 1]] * len(obj.data.vertices)
-                for layer in obj.data.vertex_colors.keys():
-                    collect_vertex_colors(obj.data, layer, vertex_color_list)
-            ex_submesh_vert_color_list.append(vertex_color_list)
-
-            if count == 1:
-                for ent in range(len(obj.fmdl_strings)):
-                    ex_mtl_strings.append(obj.fmdl_strings[ent].name)
-
-        # Precalculation segment
-        #
-
-        print(f"Normals present for {len(ex_custom_normals_list)} submeshes")
-
-        # 0x0A  precalc vertex buffer def list
-        vbuff_def_sub_mesh = -1
-        vbuff_def_vert_offset = 0
-        vbuff_def_uv_offset = 0
-        vbuff_def_type_2_offset = 0
-        vbuff_def_type_3_offset = 0
-        for obj in range(self.section0_block_list[10][1]):
-            buffer_offset_id = self.vbuffer_def_list[obj][0]
-            vert_fe_count = self.vbuffer_def_list[obj][1]
-            buffer_length = self.vbuffer_def_list[obj][2]
-            mfd_type = self.vbuffer_def_list[obj][3]
-            if mfd_type == 0:
-                vbuff_def_sub_mesh += 1  # update submesh count
-
-                buffer_offset = vbuff_def_vert_offset
-
-                new_vert_offset = submesh_vert_count_list[vbuff_def_sub_mesh] * buffer_length
-                while (new_vert_offset % 16) != 0:
-                    new_vert_offset += 4
-                vbuff_def_vert_offset += new_vert_offset
-
-            elif mfd_type == 1:
-                buffer_offset = vbuff_def_uv_offset
-
-                new_vert_offset = submesh_vert_count_list[vbuff_def_sub_mesh] * buffer_length
-                while (new_vert_offset % 16) != 0:
-                    new_vert_offset += 4
-                vbuff_def_uv_offset += new_vert_offset
-
-            elif mfd_type == 2:
-                if vbuff_def_sub_mesh > 0 and vbuff_def_type_2_offset == 0:
-                    vbuff_def_type_2_offset = vbuff_def_uv_offset
+            with Profile.stage('collect submesh', submesh=obj.name):
+                # obj.data.calc_tessface()  # supresses tessalation error when getting UV data
+                obj.data.calc_loop_triangles()
+                vertex_positions = np.empty((len(obj.data.vertices), 3), dtype=np.float32)
+                obj.data.vertices.foreach_get("co", vertex_positions.ravel())
+                if len(vertex_positions) > MAX_MESH_VERTICES:
+                    raise Exception(f"{obj.name_full} has {len(vertex_positions)} vertices, an fmdl mesh holds at "
+                                    f"most {MAX_MESH_VERTICES} - split it in several objects")
+
+                face_list = get_face_tuples(obj)
+
+                uv_list = get_uv_map(obj, "UVMap")
+                if "normal_map" in obj.data.uv_layers:
+                    uv_nrml_list = get_uv_map(obj, "normal_map")
                 else:
-                    buffer_offset = vbuff_def_type_2_offset
-
-                    new_vert_offset = submesh_vert_count_list[vbuff_def_sub_mesh] * buffer_length
-                    while (new_vert_offset % 16) != 0:
-                        new_vert_offset += 4
-                    vbuff_def_type_2_offset += new_vert_offset
+                    uv_nrml_list = get_uv_map(obj, "UVMap")
 
-            elif mfd_type == 3:
-                buffer_offset = vbuff_def_type_3_offset
+                custom_nrm_list = get_custom_vertex_normals(obj)
+                print(f"Adding normals info for {obj.name} - {len(custom_nrm_list)} vertices")
 
-                new_vert_offset = submesh_vert_count_list[vbuff_def_sub_mesh] * buffer_length
-                while (new_vert_offset % 16) != 0:
-                    new_vert_offset += 4
-                vbuff_def_type_3_offset += new_vert_offset
-
-            else:
-                raise Exception("0x0A: Unexpected type in vbuff def list")
-
-            ex_vbuffer_def_list.append((buffer_offset_id, vert_fe_count, buffer_length, mfd_type, buffer_offset))
-            log("calc vbuff defs", buffer_offset_id, vert_fe_count, buffer_length, mfd_type, buffer_offset)
-
-        # 0x0C  setup string defs and table
-        first_mtl_string = len(self.skeleton_list) + 1  # make sure aligns with offset during import
-        ex_string_list = self.string_list[:first_mtl_string]
-        ex_string_list = ex_string_list + ex_mtl_strings
-
-        str_type = 3
-        char_offset = 0
-        for ste in range(len(ex_string_list)):
-            char_length = len(ex_string_list[ste])
-            ex_string_defs.append((str_type, char_length, char_offset))
-            char_offset += char_length + 1
-
-        # 0x0E precalc buffer offset table
-
-        # default game files ocassionally have extra data written in the blocks, probably lod data
-        # it's not known what that data represents if anything, as have not found headers that adress that data
-        # This formula does not account for that data so exported files may differ from their imports
-
-        vert_buffer_total = 0
-        uv_buffer_total = 0
-        face_buffer_total = 0
-        format_entry_offset = 0
-        log("subm_count", ex_submesh_count)
-
-        for sbm in range(ex_submesh_count):
-            sbm_v_count = submesh_vert_count_list[sbm]
-            vert_bytes = sbm_v_count * 12
-            rounded_bytes = vert_bytes
-            while (rounded_bytes % 16) != 0:
-                rounded_bytes += 4
-            vert_buffer_total += rounded_bytes
-            log("\ntotal vert bytes", vert_buffer_total)
-
-            # self.block9_data_list
-            uv_bytes = sbm_v_count * ex_vbuffer_def_list[format_entry_offset + 1][2]
-            rounded_bytes = uv_bytes
-            while (rounded_bytes % 16) != 0:
-                rounded_bytes += 4
-            uv_buffer_total += rounded_bytes
-            log("total uv   bytes", uv_buffer_total)
-
-            format_entry_offset += self.block9_data_list[sbm][0]
-
-            sbm_f_count = len(ex_submesh_face_tuple_list[sbm])
-            face_bytes = sbm_f_count * 6
-            log("face_bytes", face_bytes)
-            rounded_bytes = face_bytes
-
-            face_buffer_total += rounded_bytes
-            log("total face bytes", face_buffer_total)
-
-        # might still need to pad out to bytes divisble by 16, but only at very end of block?
-        while (face_buffer_total % 16) != 0:
-            face_buffer_total += 2
-
-        # not sure if an extra 32 bytes is necessary for unknown block? seems to contain lod face vert indexes
-
-        # not sure if hard code 3 entries is the best way to go, but it'll have to do for now
-        ex_buffer_offset_list.append((self.buffer_offset_list[0][0], vert_buffer_total, 0))
-        ex_buffer_offset_list.append((self.buffer_offset_list[1][0], uv_buffer_total, vert_buffer_total))
-        ex_buffer_offset_list.append(
-            (self.buffer_offset_list[2][0], face_buffer_total, uv_buffer_total + vert_buffer_total))
-
-        # setup section 1 header values now that meshes have been calculated
-        block1_offset = 0
-        if self.section1_block_list.get(0) is not None:  # currently no idea of what this section does
-            ex_size = self.section1_block_list[0][2]
-            ex_section1_block_list.append([0, block1_offset, ex_size])
-            block1_offset += ex_size
-        if self.section1_block_list.get(1) is not None:  # currently no idea of what this section does
-            ex_type = self.section1_block_list[1][0]
-            ex_size = self.section1_block_list[1][2]
-            ex_section1_block_list.append([1, block1_offset, ex_size])
-            block1_offset += ex_size
-        if self.section1_block_list.get(2) is not None:
-            ex_size = vert_buffer_total + uv_buffer_total + face_buffer_total + 32  # extra 32 bytes for lod faces???
-            ex_section1_block_list.append([2, block1_offset, ex_size])
-            block1_offset += ex_size
-        if self.section1_block_list.get(3) is not None:  # string block
-            ex_size = self.section1_block_list[3][2]
-            ex_section1_block_list.append([3, block1_offset, ex_size])
-            block1_offset += ex_size
-
-        # EXPORT segment, for the most part
-        #
-
-        # set parameters, then pack
-        export_file = open(fmdl_filename, 'wb')
-        fmdl_string = "FMDL"
-        export_file.write(pack("4s", fmdl_string.encode("utf-8")))
-        export_file.write(pack("4B", 133, 235, 1, 64))  # replace values with hex literals for clarity
-        export_file.write(pack("B7x", 64))
-        # 255 for face/hair/suit =skeletons, 222 for ball = no skeletons
-        export_file.write(pack("3B5x", self.byte_16, 127, 23))
-        # 15 for face/hair/suit =skeletons, 13 for ball
-        export_file.write(pack("1B7x", self.byte_32))
-
-        export_file.write(pack("2I", self.section0_header_count, self.section1_header_count))
-
-        export_file.write(pack("2I", self.section0_offset, self.Section0_length))  # offset =(header-count x 8) + 64
-        export_file.write(pack("2I", self.section1_offset,
-                               block1_offset))  # offset =(header-count x 12) + section0_offset + 4 [or bytes to make header divisble by 16]
-        export_file.write(pack("8x"))
-
-        # Offsets will be refreshed below
-        section_0_offsets = export_file.tell()
-        print("Section 0 Offset start: ", section_0_offsets)
-        for key in self.section0_block_list:
-            print("Original offset for Section 0, key:", key, self.section0_block_list[key][2])
-            # id, entry count
-            export_file.write(pack("2H", self.section0_block_list[key][0], self.section0_block_list[key][1]))
-            # do math for section offsets
-            # FOR testing PURPOSES: just copy the old offset
-            export_file.write(pack("I", self.section0_block_list[key][2]))
-
-        section_1_offsets = export_file.tell()
-        print("Section 1 Offset start: ", section_1_offsets)
-        for ent in range(len(ex_section1_block_list)):
-            print("Original offset for Section 1, key:", ent, ex_section1_block_list[ent][1])
-            export_file.write(pack("I", ex_section1_block_list[ent][0]))  # id
-            export_file.write(pack("I", ex_section1_block_list[ent][1]))  # offset
-            export_file.write(pack("I", ex_section1_block_list[ent][2]))  # length
-
-        filler_bytes = 16 - (export_file.tell() % 16)
-        log("ex", export_file.tell())
-        log("md", filler_bytes)
-        export_file.write(pack(str(filler_bytes) + "x"))
-
-        # Section 0
-        section_0_start = export_file.tell()
-        if self.skeleton_flag:
-            self.section0_block_list[0][2] = export_file.tell()
-            for skl in range(self.section0_block_list[0][1]):
-                bone_string_id = self.skeleton_list[skl][0]
-                bone_parent = self.skeleton_list[skl][1]
-                bounding_box_id = self.skeleton_list[skl][2]
-                unknown_short0 = self.skeleton_list[skl][3]
-                unknown_short1 = self.skeleton_list[skl][4]
-                padding = self.skeleton_list[skl][5]
-                bx_l = self.skeleton_list[skl][6]
-                by_l = self.skeleton_list[skl][7]
-                bz_l = self.skeleton_list[skl][8]
-                bw_l = self.skeleton_list[skl][9]
-                bx_w = self.skeleton_list[skl][10]
-                by_w = self.skeleton_list[skl][11]
-                bz_w = self.skeleton_list[skl][12]
-                bw_w = self.skeleton_list[skl][13]
-
-                export_file.write(
-                    pack("6H", bone_string_id, bone_parent, bounding_box_id, unknown_short0, unknown_short1, padding))
-                export_file.write(pack("4x"))
-                export_file.write(pack("4f", bx_l, by_l, bz_l, bw_l))
-                export_file.write(pack("4f", bx_w, by_w, bz_w, bw_w))
-
-        self.section0_block_list[1][2] = export_file.tell()
-        for mgd in range(self.section0_block_list[1][1]):
-            name_position = self.mesh_group_def_list[mgd][0]
-            invisibility_flag = self.mesh_group_def_list[mgd][1]
-            parent_id = self.mesh_group_def_list[mgd][2]
-            export_file.write(pack("HBx2H", name_position, invisibility_flag, parent_id, 0xFFFF))
-
-        self.section0_block_list[2][2] = export_file.tell()
-        for oba in range(self.section0_block_list[2][1]):
-            mesh_group_id = self.object_assignment_list[oba][0]
-            mesh_group_obj_count = self.object_assignment_list[oba][1]
-            preceding_obj_count = self.object_assignment_list[oba][2]
-            entry_id = self.object_assignment_list[oba][3]
-            unknown_short = self.object_assignment_list[oba][4]
-
-            export_file.write(pack("4x4H", mesh_group_id, mesh_group_obj_count, preceding_obj_count, entry_id))
-            export_file.write(pack("4xH", unknown_short))
-            export_file.write(pack("14x"))
-
-        # Warning ---
-        # face and hair model files have an undocumented behaviour that can add 6 or 12 verts to one of its first_face_vert_ids
-
-        previous_face_vert_offset = 0
-        self.section0_block_list[3][2] = export_file.tell()
-        for obd in range(self.section0_block_list[3][1]):
-            unknown_int0 = self.object_data_list[obd][0]
-            mat_instance_id = self.object_data_list[obd][1]
-            bone_group_id = self.object_data_list[obd][2]
-            entry_id = self.object_data_list[obd][
-                3]  # should be equal to, but needs check for different submesh count than old file
-            vert_count = submesh_vert_count_list[obd]
-            first_face_vert_id = previous_face_vert_offset
-            face_vert_count = len(ex_submesh_face_tuple_list[obd]) * 3
-            unknown_int1 = self.object_data_list[obd][7]
-
-            previous_face_vert_offset += len(ex_submesh_face_tuple_list[obd]) * 3
-
-            export_file.write(pack("I4H", unknown_int0, mat_instance_id, bone_group_id, entry_id, vert_count))
-            export_file.write(pack("4x3I", first_face_vert_id, face_vert_count, unknown_int1))
-            export_file.write(pack("20x"))  # padding inaccurate?
-
-            log("Obj data", bone_group_id, entry_id, vert_count, first_face_vert_id, face_vert_count)
-
-        self.section0_block_list[4][2] = export_file.tell()
-        for bl4 in range(self.section0_block_list[4][1]):
-            name_position = self.block4_data_list[bl4][0]
-            section_8_entry_id = self.block4_data_list[bl4][1]
-            unknown_byte0 = self.block4_data_list[bl4][2]
-            unknown_byte1 = self.block4_data_list[bl4][3]
-            unknown_short0 = self.block4_data_list[bl4][4]
-            unknown_short1 = self.block4_data_list[bl4][5]
-
-            export_file.write(pack("H2xH", name_position, section_8_entry_id))
-            export_file.write(pack("2B", unknown_byte0, unknown_byte1))
-            export_file.write(pack("2H4x", unknown_short0, unknown_short1))
-
-        if self.skeleton_flag:
-            self.section0_block_list[5][2] = export_file.tell()
-            for bg in range(self.section0_block_list[5][1]):
-                unknown_short = self.bone_group_list[bg][0]
-                bone_entry_count = self.bone_group_list[bg][1]
-                export_file.write(pack("2H", unknown_short, bone_entry_count))
-
-                bone_entry_list = self.bone_group_list[bg][2]
-                for bec in range(bone_entry_count):
-                    bone_entry = bone_entry_list[bec]
-                    export_file.write(pack("H", bone_entry))
-
-                pad_bytes = 64 - (bone_entry_count * 2)
-                padding_string = str(pad_bytes) + "x"
-                export_file.write(pack(padding_string))
-
-        self.section0_block_list[6][2] = export_file.tell()
-        for te in range(self.section0_block_list[6][1]):
-            name_position = self.block6_data_list[te][0]
-            texture_name_position = self.block6_data_list[te][1]
-            export_file.write(pack("2H", name_position, texture_name_position))
-
-        self.section0_block_list[7][2] = export_file.tell()
-        for mpd in range(self.section0_block_list[7][1]):
-            mat_param_type_name_position = self.mat_param_data_list[mpd][0]
-            mat_param_name_position = self.mat_param_data_list[mpd][1]
-            export_file.write(pack("2H", mat_param_type_name_position, mat_param_name_position))
-
-        self.section0_block_list[8][2] = export_file.tell()
-        for bl8 in range(self.section0_block_list[8][1]):
-            string_id = self.block8_data_list[bl8][0]
-            material_type = self.block8_data_list[bl8][1]
-            export_file.write(pack("2H", string_id, material_type))
-
-        self.section0_block_list[9][2] = export_file.tell()
-        for bl9 in range(self.section0_block_list[9][1]):
-            mesh_fe_count = self.block9_data_list[bl9][0]
-            vert_fe_count = self.block9_data_list[bl9][1]
-            unknown_short = self.block9_data_list[bl9][2]
-            first_mfe_id = self.block9_data_list[bl9][3]
-            first_vfd_id = self.block9_data_list[bl9][4]
-            export_file.write(pack("2B3H", mesh_fe_count, vert_fe_count, unknown_short, first_mfe_id, first_vfd_id))
-            # entry_bin = self.block9_data_list[bl9]
-            # export_file.write(entry_bin)
-
-        self.section0_block_list[10][2] = export_file.tell()
-        for obj in range(self.section0_block_list[10][1]):
-            buffer_offset_id = ex_vbuffer_def_list[obj][0]
-            vert_fe_count = ex_vbuffer_def_list[obj][1]
-            buffer_length = ex_vbuffer_def_list[obj][2]
-            mfd_type = ex_vbuffer_def_list[obj][3]
-            buffer_offset = ex_vbuffer_def_list[obj][4]
-            export_file.write(pack("4B", buffer_offset_id, vert_fe_count, buffer_length, mfd_type))
-            export_file.write(pack("I", buffer_offset))
-            log("exp vbuff defs", buffer_offset_id, vert_fe_count, buffer_length, mfd_type, buffer_offset)
-
-        self.section0_block_list[11][2] = export_file.tell()
-        for blb in range(self.section0_block_list[11][1]):
-            usage = self.vert_format_def_list[blb][0]
-            data_type = self.vert_format_def_list[blb][1]
-            format_offset = self.vert_format_def_list[blb][2]
-            export_file.write(pack("2BH", usage, data_type, format_offset))
-
-        self.section0_block_list[12][2] = export_file.tell()
-        for sb in range(self.section0_block_list[12][1]):
-            string_type = ex_string_defs[sb][0]
-            string_length = ex_string_defs[sb][1]
-            string_offset = ex_string_defs[sb][2]
-            export_file.write(pack("2H", string_type, string_length))
-            export_file.write(pack("I", string_offset))
-        # dynamically pad block until divisble by 16
-        while (export_file.tell() % 16) != 0:
-            export_file.write(pack("2x"))
-
-        self.section0_block_list[13][2] = export_file.tell()
-        for bld in range(self.section0_block_list[13][1]):
-            d_0 = self.block13_data_list[bld][0]
-            d_1 = self.block13_data_list[bld][1]
-            d_2 = self.block13_data_list[bld][2]
-            d_3 = self.block13_data_list[bld][3]
-            d_4 = self.block13_data_list[bld][4]
-            d_5 = self.block13_data_list[bld][5]
-            d_6 = self.block13_data_list[bld][6]
-            d_7 = self.block13_data_list[bld][7]
-            export_file.write(pack("4f", d_0, d_1, d_2, d_3))
-            export_file.write(pack("4f", d_4, d_5, d_6, d_7))
-
-        self.section0_block_list[14][2] = export_file.tell()
-        for bot in range(self.section0_block_list[14][1]):  # missing 4 bytes before this block
-            unknown_int = ex_buffer_offset_list[bot][0]  # possible end of file flag
-            buffer_size = ex_buffer_offset_list[bot][1]
-            buffer_offset = ex_buffer_offset_list[bot][2]
-
-            export_file.write(pack("3I4x", unknown_int, buffer_size, buffer_offset))
-            log("ex buff offset table", unknown_int, buffer_size, buffer_offset)
-
-        self.section0_block_list[16][2] = export_file.tell()
-        for lfi in range(self.section0_block_list[16][1]):
-            lod_count = self.lod_list[lfi][0]
-            hd_distance = self.lod_list[lfi][1]
-            sd_distance = self.lod_list[lfi][2]
-            lo_distance = self.lod_list[lfi][3]
-            export_file.write(pack("I3f", lod_count, hd_distance, sd_distance, lo_distance))
-            log("Lod data", lod_count, hd_distance, sd_distance, lo_distance)
-
-        self.section0_block_list[17][2] = export_file.tell()
-        # FOR testing PURPOSES: overwriting lod values, old copy code preserved in comment below
-        log("Warning, LoDs eliminated")
-        for blfi in range(int(self.section0_block_list[17][1] / 8)):  # presumably 8 entries per sub mesh
-            preceeding_face_vert_count = 0
-            face_vert_count = len(ex_submesh_face_tuple_list[blfi]) * 3
-            export_file.write(
-                pack("2I", preceeding_face_vert_count, face_vert_count))  # really lazy way of eliminating lods
-            export_file.write(pack("2I", preceeding_face_vert_count, face_vert_count))
-            export_file.write(pack("2I", preceeding_face_vert_count, face_vert_count))
-            export_file.write(pack("2I", preceeding_face_vert_count, face_vert_count))
-
-            export_file.write(pack("2I", preceeding_face_vert_count, face_vert_count))
-            export_file.write(pack("2I", preceeding_face_vert_count, face_vert_count))
-            export_file.write(pack("2I", preceeding_face_vert_count, face_vert_count))
-            export_file.write(pack("2I", preceeding_face_vert_count, face_vert_count))
-            log("face index table", preceeding_face_vert_count, face_vert_count)
-
-        self.section0_block_list[18][2] = export_file.tell()
-        for bln in range(self.section0_block_list[18][1]):
-            entry_bin = self.block18_data_list[bln]
-            export_file.write(entry_bin)
-
-        self.section0_block_list[20][2] = export_file.tell()
-        for bln in range(self.section0_block_list[20][1]):
-            entry_bin = self.block20_data_list[bln]
-            export_file.write(entry_bin)
-
-        while (export_file.tell() % 16) != 0:  # round out the bytes to 16
-            export_file.write(pack("2x"))
-
-        # blank section?
-        export_file.write(pack("96x"))
-
-        section_1_start = export_file.tell()
-
-        # section 1-0 - Material Parameters
-        ex_section1_block_list[0][1] = export_file.tell()
-        export_file.write(self.block1_0_data_list[0])
-        log("1-0 bin", self.block1_0_data_list[0])
-        print("1-0 len", len(self.block1_0_data_list[0]))
-        ex_section1_block_list[0][2] = export_file.tell() - ex_section1_block_list[0][1]
-
-        # section 1-1 - ?
-        ex_section1_block_list[1][1] = export_file.tell()
-        if self.section1_block_list.get(1) is not None:  # currently no idea of what this section does
-            export_file.write(self.block1_1_data_list[0])
-            log("1-1 bin", self.block1_1_data_list[0])
-        ex_section1_block_list[1][2] = export_file.tell() - ex_section1_block_list[1][1]
-
-        # section 1-2 mesh data - Vertex Buffers
-        ex_section1_block_list[2][1] = export_file.tell()
-        # vertexes
-        for sbm in range(ex_submesh_count):
-            for vert in range(len(submesh_vertex_list[sbm])):
-                x, y, z = submesh_vertex_list[sbm][vert].co
-                export_file.write(pack("3f", x, z, y * -1))  # flip to fox engine orientation
-            while (export_file.tell() % 16) != 0:  # round out the bytes to 16
-                export_file.write(pack("2x"))
-
-        # UV, normals, weighting, bone ids, etc
-        for sbm in range(ex_submesh_count):
-            sub_mesh_format = self.vformat_per_submesh_list[sbm]
-            for vert in range(len(submesh_vertex_list[sbm])):
-                for ent in range(len(sub_mesh_format)):
-                    current_usage = sub_mesh_format[ent]
-                    if current_usage == 2:  # normals
-                        try:
-                            norm_x, norm_y, norm_z = ex_custom_normals_list[sbm][vert]
-                            norm_w = 1.0
-                            hf_x = float2halffloat(norm_x)
-                            hf_y = float2halffloat(norm_z)  # flip to fox engine orientation
-                            hf_z = float2halffloat(norm_y * -1)
-                            hf_w = float2halffloat(norm_w)
-                            export_file.write(pack("4H", hf_x, hf_y, hf_z, hf_w))
-                        except:
-                            print(f"Error obtaining normals for submesh {sbm}, vertex {vert} ({ex_custom_normals_list[sbm][vert]}")
-                            raise
-
-                    if current_usage == 14:  # tangents
-                        tan_x, tan_y, tan_z = ex_custom_tangents_list[sbm][vert][1]
-                        tan = normalize_tangents(tan_x, tan_y, tan_z)
-                        tan_w = 1.0
-                        hf_x = float2halffloat(tan[0])
-                        hf_y = float2halffloat(tan[1] * -1)  # flip to fox engine orientation
-                        hf_z = float2halffloat(tan[2] * -1)
-                        hf_w = float2halffloat(tan_w)
-                        export_file.write(pack("4H", hf_x, hf_z, hf_y, hf_w))
-
-                    if current_usage == 3:  # color
-                        ex_r = int(ex_submesh_vert_color_list[sbm][vert][0] * 255)
-                        ex_g = int(ex_submesh_vert_color_list[sbm][vert][1] * 255)
-                        ex_b = int(ex_submesh_vert_color_list[sbm][vert][2] * 255)
-                        ex_a = 255
-                        export_file.write(pack("4B", ex_r, ex_g, ex_b, ex_a))
-
-                    if current_usage == 1:  # bone weight
-                        # mesh, vertex, group, then weight
-                        # x255 to convert float value to byte
-                        bw_0 = int(ex_submesh_vert_weights_list[sbm][vert][0][1] * 255)
-                        bw_1 = int(ex_submesh_vert_weights_list[sbm][vert][1][1] * 255)
-                        bw_2 = int(ex_submesh_vert_weights_list[sbm][vert][2][1] * 255)
-                        bw_3 = int(ex_submesh_vert_weights_list[sbm][vert][3][1] * 255)
-                        export_file.write(pack("4B", bw_0, bw_1, bw_2, bw_3))
-                    if current_usage == 7:  # bone ids
-                        bid_0 = ex_submesh_vert_weights_list[sbm][vert][0][0]  # mesh, vertex, group, then id
-                        bid_1 = ex_submesh_vert_weights_list[sbm][vert][1][0]
-                        bid_2 = ex_submesh_vert_weights_list[sbm][vert][2][0]
-                        bid_3 = ex_submesh_vert_weights_list[sbm][vert][3][0]
-                        export_file.write(pack("4B", bid_0, bid_1, bid_2, bid_3))
-                    if current_usage == 8:  # UV
-                        coord_u = ex_submesh_uv_list[sbm][vert][0]
-                        coord_v = ex_submesh_uv_list[sbm][vert][1]
-                        hf_u = float2halffloat(coord_u)
-                        hf_v = float2halffloat((coord_v - 1) * -1)
-                        export_file.write(pack("2H", hf_u, hf_v))
-                    if current_usage == 9:  # UV2
-                        coord_u = ex_submesh_nrm_uv_list[sbm][vert][0]
-                        coord_v = ex_submesh_nrm_uv_list[sbm][vert][1]
-                        hf_u = float2halffloat(coord_u)
-                        hf_v = float2halffloat((coord_v - 1) * -1)
-                        export_file.write(pack("2H", hf_u, hf_v))
-                    if current_usage == 10:  # UV3
-                        export_file.write(pack("4x"))
-                        log("3rd UV not implemented")
-                    if current_usage == 11:  # UV4
-                        export_file.write(pack("4x"))
-                        log("4th UV not implemented")
-                    if current_usage == 12:  # bone weight?
-                        export_file.write(pack("4x"))
-                        log("Secondary bone wieghts not implemented")
-                    if current_usage == 13:  # bone id?
-                        export_file.write(pack("4x"))
-                        log("Secondary bone ids not implemented")
-
-            while (export_file.tell() % 16) != 0:  # round out the bytes to 16
-                export_file.write(pack("2x"))
-
-        for sbm in range(ex_submesh_count):
-            for ftl in range(len(ex_submesh_face_tuple_list[sbm])):
-                f3 = ex_submesh_face_tuple_list[sbm][ftl][0]
-                f2 = ex_submesh_face_tuple_list[sbm][ftl][1]
-                f1 = ex_submesh_face_tuple_list[sbm][ftl][2]
-                export_file.write(pack("3H", f1, f2, f3))
-        while (export_file.tell() % 16) != 0:  # round out the bytes to 16
-            export_file.write(pack("2x"))
-        ex_section1_block_list[2][2] = export_file.tell() - ex_section1_block_list[2][1]
-
-        export_file.write(pack("32x"))  # FOR testing PURPOSES: possible lod related block, zeros for filler for now
-
-        # Section 1-3 - Strings
-        ex_section1_block_list[3][1] = export_file.tell()
-        for sa in range(self.section0_block_list[12][1]):
-            pack_string = str(len(ex_string_list[sa])) + "sx"
-            temp_string = ex_string_list[sa]
-            export_file.write(pack(pack_string, temp_string.encode("utf-8")))
-        ex_section1_block_list[3][2] = export_file.tell() - ex_section1_block_list[3][1]
-
-        # Final step
-        # Refresh offsets
-        export_file.seek(section_0_offsets)
-        for key in self.section0_block_list:
-            print("Refreshing offset for Section 0, block:", key, self.section0_block_list[key][2] - section_0_start)
-            # id, entry count
-            export_file.write(pack("2H", self.section0_block_list[key][0], self.section0_block_list[key][1]))
-            # offset
-            export_file.write(pack("I", self.section0_block_list[key][2] - section_0_start))
-
-        export_file.seek(section_1_offsets)
-        for ent in range(len(ex_section1_block_list)):
-            print("Refreshing offset for Section 1, block:", ent, ex_section1_block_list[ent][1] - section_1_start)
-            export_file.write(pack("I", ex_section1_block_list[ent][0]))  # id
-            export_file.write(pack("I", ex_section1_block_list[ent][1] - section_1_start))  # offset
-            export_file.write(pack("I", ex_section1_block_list[ent][2]))  # length
-
-        export_file.flush()
-        export_file.close()
+                if "normal_map" in obj.data.uv_layers:
+                    custom_tan_list = get_custom_vertex_tangents(obj, "normal_map")
+                else:
+                    custom_tan_list = get_custom_vertex_tangents(obj, "UVMap")
+
+                bone_ids, bone_weights = None, None
+                if self.skeleton_flag:
+                    bone_ids, bone_weights = vertex_weights.get(obj.name) or collect_vertex_weights(obj.data.vertices)
+
+                vertex_color_list = None
+                if obj.data.vertex_colors:
+                    # initialize list of default vertex colors
+                    vertex_color_list = np.ones((len(obj.data.vertices), 4), dtype=np.float32)
+                    for layer in obj.data.vertex_colors.keys():
+                        collect_vertex_colors(obj.data, layer, vertex_color_list)
+
+                if count == 1:
+                    for ent in range(len(obj.fmdl_strings)):
+                        ex_mtl_strings.append(obj.fmdl_strings[ent].name)
+
+                submesh_vertices = SubmeshVertices(
+                    vertex_positions,
+                    normals=custom_nrm_list,
+                    tangents=custom_tan_list,
+                    colors=vertex_color_list,
+                    bone_weights=bone_weights,
+                    bone_ids=bone_ids,
+                    uvs=uv_list,
+                    uvs_normal=uv_nrml_list)
+                position_records, vertex_data_records = submesh_vertices.to_records(
+                    *self.model.vertex_dtypes(count), PesFacemodGlobalData.vertex_memory_budget)
+                Profile.count('vertices', submesh_vertices.count)
+                Profile.count('faces', len(face_list))
+                mesh_buffers.append(Fmdl.MeshBuffer(position_records, vertex_data_records, flip_winding(face_list)))
+
+        # 0x0C  bone names stay, material strings come from the fmdl_strings panel
+        first_mtl_string = len(self.model.bones) + 1  # make sure aligns with offset during import
+        ex_string_list = self.model.strings[:first_mtl_string] + ex_mtl_strings
+
+        with Profile.stage('write fmdl', file=os.path.basename(fmdl_filename)):
+            Fmdl.write(replace(self.model, strings=ex_string_list, mesh_buffers=mesh_buffers), fmdl_filename)
+        self.fingerprint = fingerprint
+        return True
 
     def show_materials(self):
+        model = self.model
+        strings = model.strings
         print("Material assignment: ", self.material_assignment)
-        print("Textures: ", self.textures)
+        print("Textures: ", model.textures)
 
-        print("\tFound %d textures" % (len(self.textures)))
+        print("\tFound %d textures" % (len(model.textures)))
         print("\t\tblock 6: ")
-        for texture_definition in self.block6_data_list:
-            print(f"\t{self.string_list[texture_definition[0]]} - {self.string_list[texture_definition[1]]}")
+        for texture_definition in model.textures:
+            print(f"\t{strings[texture_definition.name_index]} - {strings[texture_definition.path_index]}")
         print("\t\tblock 7: ")
-        for texture_param in self.mat_param_data_list:
-            print(f"\t\t\t{self.string_list[texture_param[0]]} {texture_param[1]}")
+        for texture_param in model.material_parameters:
+            print(f"\t\t\t{strings[texture_param.type_name_index]} {texture_param.reference}")
         print("\t\tblock 8: ")
-        for tup in self.block8_data_list:
-            print(f"{tup[0]}, {tup[1]}: {self.string_list[tup[0]]}, {self.string_list[tup[1]]}")
+        for material_type in model.materials:
+            print(f"{material_type.name_index}, {material_type.type_index}: {strings[material_type.name_index]}, "
+                  f"{strings[material_type.type_index]}")
 
         # Material instance definition
         i = 0
-        for tup in self.block4_data_list:
-            (name_index, mat_index, texture_count, param_count, first_texture_index, first_param_index) = tup
+        for material_instance in model.material_instances:
             # add material names to material assignment
             for mat_assign in self.material_assignment:
-                if mat_assign.material_index == mat_index:
-                    mat_assign.name_index = name_index
+                if mat_assign.material_index == material_instance.material:
+                    mat_assign.name_index = material_instance.name_index
 
-            material_name = self.string_list[name_index]
+            material_name = strings[material_instance.name_index]
 
-            print(f"\t{i}: {mat_index} - Texture: {material_name}")
+            print(f"\t{i}: {material_instance.material} - Texture: {material_name}")
             i = i + 1
             material = get_material(material_name)
-            texture_assignments = self.mat_param_data_list
-            for texture_index in range(first_texture_index, first_texture_index + texture_count):
+            texture_assignments = model.material_parameters
+            for texture_index in range(material_instance.first_texture,
+                                       material_instance.first_texture + material_instance.texture_count):
                 if texture_index >= len(texture_assignments):
                     print("Texture index not found in block6? %d > %d" % (texture_index, len(texture_assignments)))
                 else:
-                    type_name_index, texture_definition_index = texture_assignments[texture_index]
-                    texture_file_name_index, texture_folder_name_index = self.block6_data_list[texture_definition_index]
-                    texture_file_name = self.string_list[texture_file_name_index]
-                    type_name = self.string_list[type_name_index]
+                    type_name_index = texture_assignments[texture_index].type_name_index
+                    texture_definition = model.textures[texture_assignments[texture_index].reference]
+                    texture_file_name = strings[texture_definition.name_index]
+                    type_name = strings[type_name_index]
                     print("\t\t\tTexture type %s : %s" % (type_name, texture_file_name))
                     file_without_ext, ext = os.path.splitext(
                         os.path.join(os.path.normpath(self.sourceimages_path), texture_file_name))
@@ -1699,7 +683,7 @@ class FmdlManagerBase:
 
         print("Default material assignments:")
         for mat_assign in self.material_assignment:
-            material_name = self.string_list[mat_assign.name_index]
+            material_name = strings[mat_assign.name_index]
             obj = self.internal_mesh_list[mat_assign.mesh_index]
             print(f"\tTexture '{material_name}' ({mat_assign.name_index}) assigned to object '{obj.name}'")
             material = get_material(material_name)
@@ -0,0 +1,233 @@
+""" Import -> export fidelity and throughput check for reference .fmdl files, without Blender.
+
+Every .fmdl below the given folders (loose, or inside .fpk archives) is decoded and encoded again unchanged the
+way an import followed by an export does it: records to Blender-oriented vertices and back, see FmdlBenchmark.
+The output is compared with the input region by region - header, block directory, every section 0 block and
+every section 1 block - and the MB/s of each stage is reported, so a codec change can be checked against a
+whole library of files before it ships:
+
+    python -m PesFacemod.FmdlRoundTrip C:/faces --json round_trip.json
+    python -m PesFacemod.FmdlRoundTrip C:/faces --ignore 0x0E --ignore 0x11
+
+The exit status is 1 when any file diverges in a region that isn't ignored.
+"""
+import argparse
+import json
+import os
+import sys
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Dict, List
+
+import numpy as np
+
+from . import Fmdl, Fpk
+from .FmdlBenchmark import decode, encode
+
+
+@dataclass
+class Region:
+    """ Bytes of one part of an .fmdl file """
+    name: str
+    offset: int
+    size: int
+
+
+@dataclass
+class Divergence:
+    region: str
+    input_size: int
+    output_size: int
+    differing_bytes: int
+    # first differing byte, relative to the region start
+    first_difference: int
+
+    def __str__(self):
+        sizes = f"{self.input_size} bytes" if self.input_size == self.output_size else \
+            f"{self.input_size} -> {self.output_size} bytes"
+        return f"{self.region}: {self.differing_bytes} differ, first at +{self.first_difference:#x} ({sizes})"
+
+
+@dataclass
+class RoundTripResult:
+    name: str
+    size: int = 0
+    seconds: Dict[str, float] = field(default_factory=dict)
+    divergences: List[Divergence] = field(default_factory=list)
+    # which vertex fields differ, when the vertex buffer does
+    field_divergences: List[Divergence] = field(default_factory=list)
+    error: str = None
+
+    def mb_per_second(self, stage):
+        return self.size / self.seconds[stage] / 1e6 if self.seconds.get(stage) else 0.0
+
+
+def section0_entry_size(block_id):
+    if block_id in Fmdl.ENTRY_LAYOUTS:
+        return Fmdl.ENTRY_LAYOUTS[block_id][0].size
+    if block_id in Fmdl.RAW_ENTRY_SIZES:
+        return Fmdl.RAW_ENTRY_SIZES[block_id]
+    return {Fmdl.BLOCK_BONE_GROUPS: Fmdl.BONE_GROUP_SIZE, Fmdl.BLOCK_STRINGS: Fmdl.STRING_DEF.size}.get(block_id)
+
+
+def regions(fmdl_file):
+    """ The header, the block directory and every block listed in the directory of an FmdlFile """
+    header = fmdl_file.header
+    directory_size = Fmdl.SECTION0_BLOCK.size * len(fmdl_file.section0_blocks) + \
+        Fmdl.SECTION1_BLOCK.size * len(fmdl_file.section1_blocks)
+    found = [Region('header', 0, Fmdl.HEADER.size), Region('directory', header.blocks_offset, directory_size)]
+
+    # unknown blocks run up to the next block
+    blocks = sorted(fmdl_file.section0_blocks, key=lambda block: block.offset)
+    ends = [block.offset for block in blocks[1:]] + [header.section1_offset - header.section0_offset]
+    for block, end in zip(blocks, ends):
+        entry_size = section0_entry_size(block.block_id)
+        block_size = entry_size * block.entry_count if entry_size is not None else end - block.offset
+        found.append(Region(f'0x{block.block_id:02X}', header.section0_offset + block.offset, block_size))
+    for block in fmdl_file.section1_blocks:
+        found.append(Region(f'section 1 block {block.block_id}', header.section1_offset + block.offset, block.length))
+    return found
+
+
+def compare(input_data, output_data):
+    """ Divergences between the regions of two .fmdl files, each region located through its own file """
+    input_regions = regions(Fmdl.FmdlFile(input_data))
+    output_regions = {region.name: region for region in regions(Fmdl.FmdlFile(output_data))}
+    divergences = []
+    for region in input_regions:
+        other = output_regions.get(region.name, Region(region.name, 0, 0))
+        before = np.frombuffer(input_data, dtype=np.uint8, count=region.size, offset=region.offset)
+        after = np.frombuffer(output_data, dtype=np.uint8, count=min(other.size, len(output_data) - other.offset),
+                              offset=other.offset)
+        common = min(len(before), len(after))
+        differing = np.flatnonzero(before[:common] != after[:common])
+        if len(differing) or len(before) != len(after):
+            first = int(differing[0]) if len(differing) else common
+            divergences.append(Divergence(region.name, len(before), len(after),
+                                          len(differing) + abs(len(before) - len(after)), first))
+
+    # the bytes between regions: alignment, the blank section and the filler after the vertex buffer
+    if len(input_data) != len(output_data):
+        divergences.append(Divergence('file', len(input_data), len(output_data),
+                                      abs(len(input_data) - len(output_data)), min(len(input_data), len(output_data))))
+    else:
+        covered = np.zeros(len(input_data), dtype=bool)
+        for region in input_regions:
+            covered[region.offset:region.offset + region.size] = True
+        differing = np.flatnonzero((np.frombuffer(input_data, dtype=np.uint8) !=
+                                    np.frombuffer(output_data, dtype=np.uint8)) & ~covered)
+        if len(differing):
+            divergences.append(Divergence('padding', len(input_data), len(output_data), len(differing),
+                                          int(differing[0])))
+    return divergences
+
+
+def compare_fields(input_model, output_model):
+    """ Divergences of every vertex record field and the faces of every mesh """
+    divergences = []
+    for mesh_index, (before, after) in enumerate(zip(input_model.mesh_buffers, output_model.mesh_buffers)):
+        pairs = [(f'mesh {mesh_index} {name}', records[0][name], records[1][name])
+                 for records in ((before.positions, after.positions), (before.vertex_data, after.vertex_data))
+                 for name in records[0].dtype.names if name in records[1].dtype.names]
+        pairs.append((f'mesh {mesh_index} faces', before.faces, after.faces))
+        for name, input_values, output_values in pairs:
+            input_bytes = np.ascontiguousarray(input_values).view(np.uint8).ravel()
+            output_bytes = np.ascontiguousarray(output_values).view(np.uint8).ravel()
+            common = min(len(input_bytes), len(output_bytes))
+            differing = np.flatnonzero(input_bytes[:common] != output_bytes[:common])
+            if len(differing) or len(input_bytes) != len(output_bytes):
+                divergences.append(Divergence(name, len(input_bytes), len(output_bytes),
+                                              len(differing) + abs(len(input_bytes) - len(output_bytes)),
+                                              int(differing[0]) if len(differing) else common))
+    return divergences
+
+
+def round_trip(name, data):
+    """ Decodes and encodes data, timing each stage; never raises, failures go in the result """
+    result = RoundTripResult(name, len(data))
+    try:
+        start = perf_counter()
+        model, submesh_vertices = decode(data)
+        result.seconds['decode'] = perf_counter() - start
+
+        start = perf_counter()
+        output = bytes(encode(model, submesh_vertices))
+        result.seconds['encode'] = perf_counter() - start
+
+        start = perf_counter()
+        result.divergences = compare(data, output)
+        result.seconds['compare'] = perf_counter() - start
+        if any(divergence.region == f'section 1 block {Fmdl.SECTION1_VERTEX_BUFFER}'
+               for divergence in result.divergences):
+            result.field_divergences = compare_fields(model, Fmdl.loads(output))
+    except Exception as ex:
+        result.error = f"{type(ex).__name__}: {ex}"
+    return result
+
+
+def reference_files(roots):
+    """ (name, data) of every .fmdl below roots, the ones packed in .fpk archives included """
+    for root in roots:
+        paths = [root] if os.path.isfile(root) else \
+            sorted(os.path.join(folder, name) for folder, _, names in os.walk(root) for name in names)
+        for path in paths:
+            extension = os.path.splitext(path)[1].lower()
+            if extension == '.fmdl':
+                with open(path, 'rb') as fmdl_file:
+                    yield path, fmdl_file.read()
+            elif extension in ('.fpk', '.fpkd'):
+                with Fpk.FpkFile.open(path) as fpk:
+                    for entry_name in fpk.names():
+                        if entry_name.lower().endswith('.fmdl'):
+                            yield f'{path}:{entry_name}', bytes(fpk.read(entry_name))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m PesFacemod.FmdlRoundTrip', description=__doc__.split('\n\n')[0])
+    parser.add_argument('paths', nargs='+', help=".fmdl / .fpk files, or folders searched for them")
+    parser.add_argument('--ignore', action='append', default=[], metavar='REGION',
+                        help="region whose divergences don't fail the run, e.g. 0x0E or 'section 1 block 2'")
+    parser.add_argument('--json', default=None, help="also write every result to this file")
+    arguments = parser.parse_args(argv)
+    ignored = {f'0x{int(name, 16):02X}' if name.lower().startswith('0x') else name for name in arguments.ignore}
+
+    results = []
+    total_bytes, total_seconds = 0, {}
+    failed = 0
+    for name, data in reference_files(arguments.paths):
+        result = round_trip(name, data)
+        results.append(result)
+        total_bytes += result.size
+        for stage, seconds in result.seconds.items():
+            total_seconds[stage] = total_seconds.get(stage, 0) + seconds
+        speeds = ", ".join(f"{stage} {result.mb_per_second(stage):.0f} MB/s" for stage in result.seconds)
+        failing = [divergence for divergence in result.divergences if divergence.region not in ignored]
+        if result.error is not None:
+            failed += 1
+            print(f"FAIL  {name}: {result.error}")
+        elif failing:
+            failed += 1
+            print(f"DIFF  {name} ({speeds})")
+        else:
+            print(f"OK    {name} ({speeds})")
+        for divergence in result.divergences:
+            print(f"\t{divergence}{' (ignored)' if divergence.region in ignored else ''}")
+        for divergence in result.field_divergences:
+            print(f"\t\t{divergence}")
+
+    if not results:
+        print("No .fmdl found")
+        return 1
+    print(f"{len(results) - failed} of {len(results)} files round trip, {total_bytes / 1e6:.1f} MB: " +
+          ", ".join(f"{stage} {total_bytes / seconds / 1e6:.0f} MB/s" for stage, seconds in total_seconds.items()))
+    if arguments.json:
+        with open(arguments.json, 'w') as out_file:
+            json.dump([{'name': result.name, 'bytes': result.size, 'seconds': result.seconds, 'error': result.error,
+                        'divergences': [vars(divergence) for divergence in result.divergences],
+                        'field_divergences': [vars(divergence) for divergence in result.field_divergences]}
+                       for result in results], out_file, indent=1)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
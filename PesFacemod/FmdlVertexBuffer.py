@@ -0,0 +1,384 @@
+import numpy as np
+
+from . import HalfFloat
+
+# Block 0x0B usages
+USAGE_POSITION = 0
+USAGE_BONE_WEIGHTS = 1
+USAGE_NORMAL = 2
+USAGE_COLOR = 3
+USAGE_BONE_IDS = 7
+USAGE_UV0 = 8
+USAGE_UV1 = 9
+USAGE_UV2 = 10
+USAGE_UV3 = 11
+USAGE_UNKNOWN_WEIGHTS = 12
+USAGE_UNKNOWN_IDS = 13
+USAGE_TANGENT = 14
+
+FIELD_NAMES = {
+    USAGE_POSITION: 'position',
+    USAGE_BONE_WEIGHTS: 'bone_weights',
+    USAGE_NORMAL: 'normal',
+    USAGE_COLOR: 'color',
+    USAGE_BONE_IDS: 'bone_ids',
+    USAGE_UV0: 'uv0',
+    USAGE_UV1: 'uv1',
+    USAGE_UV2: 'uv2',
+    USAGE_UV3: 'uv3',
+    USAGE_UNKNOWN_WEIGHTS: 'unknown_weights',
+    USAGE_UNKNOWN_IDS: 'unknown_ids',
+    USAGE_TANGENT: 'tangent',
+}
+
+# components per usage, and the type each usage has when the data type byte is not one we know
+FIELD_COMPONENTS = {
+    USAGE_POSITION: 3,
+    USAGE_UV0: 2,
+    USAGE_UV1: 2,
+    USAGE_UV2: 2,
+    USAGE_UV3: 2,
+}
+FIELD_DEFAULT_TYPES = {
+    USAGE_POSITION: '<f4',
+    USAGE_BONE_WEIGHTS: 'u1',
+    USAGE_COLOR: 'u1',
+    USAGE_BONE_IDS: 'u1',
+    USAGE_UNKNOWN_WEIGHTS: 'u1',
+    USAGE_UNKNOWN_IDS: '<u2',
+}
+
+# Block 0x0B data types
+DATA_TYPES = {
+    1: '<f4',
+    4: '<u2',
+    6: '<f2',
+    7: '<f2',
+    8: 'u1',
+    9: 'u1',
+}
+
+# Vertex streams (block 0x0A type)
+STREAM_POSITIONS = 0
+STREAM_VERTEX_DATA = 1
+
+# faces index a mesh's vertices with 16 bits
+MAX_MESH_VERTICES = 1 << 16
+
+# SubmeshVertices arrays
+VERTEX_ATTRIBUTES = ['positions', 'normals', 'tangents', 'colors', 'bone_weights', 'bone_ids', 'uvs', 'uvs_normal']
+
+# bytes of scratch and output per chunk of vertices being decoded or encoded; the records themselves are views
+DEFAULT_MEMORY_BUDGET = 16 * 1024 * 1024
+# float64 temporaries encoding a vertex needs besides its records (normals, tangents, colors, weights, uvs)
+ENCODE_SCRATCH_BYTES = 96
+
+
+def align(offset, alignment=16):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def split_vertex_formats(vert_format_def_list):
+    """ Groups the vertex format definitions (block 0x0B) per submesh - each submesh starts with a position entry """
+    format_list = []
+    format_sublist = []
+    for vertex_format in vert_format_def_list:
+        if vertex_format[0] == USAGE_POSITION and len(format_sublist) != 0:
+            format_list.append(format_sublist)
+            format_sublist = []
+        format_sublist.append(tuple(vertex_format))
+    format_list.append(format_sublist)
+    return format_list
+
+
+def vertex_dtype(format_defs, itemsize=0):
+    """ Structured dtype for one interleaved vertex record, from (usage, data_type, offset) entries """
+    names, formats, offsets = [], [], []
+    end = 0
+    for usage, data_type, offset in format_defs:
+        field_type = np.dtype(DATA_TYPES.get(data_type, FIELD_DEFAULT_TYPES.get(usage, '<f2')))
+        components = FIELD_COMPONENTS.get(usage, 4)
+        names.append(FIELD_NAMES.get(usage, 'usage_%d' % usage))
+        formats.append((field_type, (components,)))
+        offsets.append(offset)
+        end = max(end, offset + field_type.itemsize * components)
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': max(end, itemsize)})
+
+
+def submesh_dtypes(format_defs, mesh_formats):
+    """ Position and vertex data record dtypes of a submesh.
+
+    format_defs are the submesh's block 0x0B entries, mesh_formats its block 0x0A entries (which carry the
+    stride of each stream).
+    """
+    strides = {mfd_type: buffer_length for _, _, buffer_length, mfd_type, _ in mesh_formats}
+    position_dtype = vertex_dtype([f for f in format_defs if f[0] == USAGE_POSITION],
+                                  strides.get(STREAM_POSITIONS, 0))
+    vertex_data_dtype = vertex_dtype([f for f in format_defs if f[0] != USAGE_POSITION],
+                                     strides.get(STREAM_VERTEX_DATA, 0))
+    return position_dtype, vertex_data_dtype
+
+
+def read_records(buffer, offset, count, dtype):
+    """ Reads count interleaved records starting at offset without copying the buffer """
+    return np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+
+
+def fox_to_blender(xyz):
+    """ Fox engine (x, y, z) to Blender (x, -z, y), as float32 """
+    out = np.asarray(xyz, dtype=np.float32)[:, [0, 2, 1]]
+    out[:, 1] *= -1
+    return out
+
+
+def blender_to_fox(xyz):
+    """ Blender (x, y, z) to Fox engine (x, z, -y), as float32 """
+    out = np.asarray(xyz, dtype=np.float32)[:, [0, 2, 1]]
+    out[:, 2] *= -1
+    return out
+
+
+def flip_uv(uv):
+    """ Fox engine v runs top to bottom, Blender's bottom to top """
+    out = np.array(uv, dtype=np.float32)
+    out[:, 1] = 1 - out[:, 1]
+    return out
+
+
+def normalize_vectors(xyz):
+    """ Unit vectors in float64; zero components stay exactly zero """
+    xyz = np.asarray(xyz, dtype=np.float64)
+    length = np.sqrt(xyz[:, 0] * xyz[:, 0] + xyz[:, 1] * xyz[:, 1] + xyz[:, 2] * xyz[:, 2])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(xyz != 0, xyz / length[:, None], 0.0)
+
+
+def negate_nonzero(values):
+    """ -values, except that zeros stay +0.0 """
+    return np.where(values != 0, -values, 0.0)
+
+
+def load_field(records, name):
+    """ float32 values of a float record field; float16 fields are decoded through HalfFloat """
+    values = records[name]
+    if values.dtype.base == np.float16:
+        return HalfFloat.decode(values)
+    return values.astype(np.float32)
+
+
+def store_field(records, name, values):
+    """ Stores float or integer values into a record field, converting to the field's on-disk type """
+    field_type = records.dtype.fields[name][0].base
+    if field_type == np.float16:
+        records[name] = HalfFloat.encode(values).view('<f2')
+    elif field_type.kind == 'f':
+        records[name] = values
+    else:
+        records[name] = np.clip(values, 0, np.iinfo(field_type).max)
+
+
+def to_byte(values):
+    """ [0, 1] floats to bytes, truncating like int(value * 255) """
+    return np.trunc(np.asarray(values, dtype=np.float64) * 255)
+
+
+def _attribute(values, components, dtype):
+    if values is None:
+        return np.zeros((0, components), dtype=dtype)
+    return np.asarray(values, dtype=dtype).reshape(-1, components)
+
+
+class SubmeshVertices:
+    """ Vertex attributes of one submesh, in Blender orientation. Missing attributes are empty arrays. """
+
+    def __init__(self, positions, normals=None, tangents=None, colors=None, bone_weights=None, bone_ids=None,
+                 uvs=None, uvs_normal=None):
+        self.positions = _attribute(positions, 3, np.float32)
+        self.normals = _attribute(normals, 3, np.float32)
+        self.tangents = _attribute(tangents, 3, np.float32)
+        self.colors = _attribute(colors, 4, np.float32)
+        self.bone_weights = _attribute(bone_weights, 4, np.float32)
+        self.bone_ids = _attribute(bone_ids, 4, np.int32)
+        self.uvs = _attribute(uvs, 2, np.float32)
+        self.uvs_normal = _attribute(uvs_normal, 2, np.float32)
+
+    @property
+    def count(self):
+        return len(self.positions)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, attribute).nbytes for attribute in VERTEX_ATTRIBUTES)
+
+    def __getitem__(self, key):
+        """ The vertices in a slice, as views; missing attributes stay empty """
+        return SubmeshVertices(**{attribute: getattr(self, attribute)[key] if len(getattr(self, attribute)) else None
+                                  for attribute in VERTEX_ATTRIBUTES})
+
+    @classmethod
+    def decode(cls, positions, records, memory_budget=DEFAULT_MEMORY_BUDGET):
+        """ from_records, decoding memory_budget worth of vertices at a time into the full size arrays """
+        vertices = None
+        for start, chunk in vertex_chunks(positions, records, memory_budget):
+            if chunk.count == len(positions):
+                return chunk
+            if vertices is None:
+                vertices = cls(**{attribute: np.empty((len(positions),) + getattr(chunk, attribute).shape[1:],
+                                                      getattr(chunk, attribute).dtype)
+                                  if len(getattr(chunk, attribute)) else None for attribute in VERTEX_ATTRIBUTES})
+            for attribute in VERTEX_ATTRIBUTES:
+                if len(getattr(chunk, attribute)):
+                    getattr(vertices, attribute)[start:start + chunk.count] = getattr(chunk, attribute)
+        return vertices if vertices is not None else cls.from_records(positions, records)
+
+    @classmethod
+    def from_records(cls, positions, records):
+        fields = records.dtype.names
+        return cls(fox_to_blender(load_field(positions, 'position')),
+                   normals=fox_to_blender(load_field(records, 'normal')[:, :3]) if 'normal' in fields else None,
+                   colors=records['color'].astype(np.float32) / 255 if 'color' in fields else None,
+                   bone_weights=records['bone_weights'].astype(np.float32) / 255 if 'bone_weights' in fields else None,
+                   bone_ids=records['bone_ids'] if 'bone_ids' in fields else None,
+                   uvs=flip_uv(load_field(records, 'uv0')) if 'uv0' in fields else None,
+                   uvs_normal=flip_uv(load_field(records, 'uv1')) if 'uv1' in fields else None)
+
+    def to_records(self, position_dtype, vertex_data_dtype, memory_budget=DEFAULT_MEMORY_BUDGET):
+        """ Position and vertex data records; fields without data (or that we don't export) are zero-filled.
+
+        Encodes memory_budget worth of vertices at a time, so the float64 scratch doesn't grow with the mesh.
+        """
+        positions = np.zeros(self.count, dtype=position_dtype)
+        records = np.zeros(self.count, dtype=vertex_data_dtype)
+        vertex_bytes = position_dtype.itemsize + vertex_data_dtype.itemsize + ENCODE_SCRATCH_BYTES
+        for start, stop in chunk_ranges(self.count, chunk_vertices(memory_budget, vertex_bytes)):
+            self[start:stop].store_records(positions[start:stop], records[start:stop])
+        return positions, records
+
+    def store_records(self, positions, records):
+        """ Encodes the vertices into position and vertex data records of the same length """
+        count = self.count
+        store_field(positions, 'position', blender_to_fox(self.positions))
+
+        fields = records.dtype.names
+        if 'normal' in fields and len(self.normals):
+            normals = self.normals
+            store_field(records, 'normal', np.stack(
+                (normals[:, 0], normals[:, 2], -normals[:, 1], np.ones(count, dtype=np.float32)), axis=1))
+        if 'tangent' in fields and len(self.tangents):
+            tangents = normalize_vectors(self.tangents)
+            store_field(records, 'tangent', np.stack(
+                (tangents[:, 0], negate_nonzero(tangents[:, 2]), negate_nonzero(tangents[:, 1]), np.ones(count)),
+                axis=1))
+        if 'color' in fields and len(self.colors):
+            colors = to_byte(self.colors)
+            colors[:, 3] = 255
+            store_field(records, 'color', colors)
+        if 'bone_weights' in fields and len(self.bone_weights):
+            store_field(records, 'bone_weights', to_byte(self.bone_weights))
+        if 'bone_ids' in fields and len(self.bone_ids):
+            store_field(records, 'bone_ids', self.bone_ids)
+        for field, uvs in (('uv0', self.uvs), ('uv1', self.uvs_normal)):
+            if field in fields and len(uvs):
+                uvs = np.asarray(uvs, dtype=np.float64)
+                store_field(records, field, np.stack((uvs[:, 0], 1 - uvs[:, 1]), axis=1))
+
+
+def chunk_vertices(memory_budget, vertex_bytes):
+    """ Vertices per chunk so that a chunk of vertex_bytes sized vertices fits memory_budget, at least 1 """
+    return max(1, int(memory_budget) // max(1, vertex_bytes))
+
+
+def chunk_ranges(count, chunk):
+    """ Yields (start, stop) of consecutive chunks covering range(count) """
+    for start in range(0, count, chunk):
+        yield start, min(start + chunk, count)
+
+
+def vertex_chunks(positions, records, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """ Yields (start, SubmeshVertices) for consecutive chunks of a submesh's records, decoding one at a time.
+
+    Consumers that work chunk by chunk (validation, conversion) hold at most memory_budget of decoded vertices,
+    whatever the size of the mesh.
+    """
+    vertex_bytes = SubmeshVertices.from_records(positions[:1], records[:1]).nbytes or 1
+    for start, stop in chunk_ranges(len(positions), chunk_vertices(memory_budget, vertex_bytes)):
+        yield start, SubmeshVertices.from_records(positions[start:stop], records[start:stop])
+
+
+def model_vertex_chunks(model, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """ Yields (mesh index, start, SubmeshVertices) over every mesh buffer of an Fmdl.FmdlModel, a chunk at a time """
+    for mesh_index, mesh_buffer in enumerate(model.mesh_buffers):
+        for start, vertices in vertex_chunks(mesh_buffer.positions, mesh_buffer.vertex_data, memory_budget):
+            yield mesh_index, start, vertices
+
+
+def decode_submesh(buffer, position_offset, vertex_data_offset, count, position_dtype, vertex_data_dtype):
+    """ Decodes both streams of a submesh; returns the attributes and the offsets of the next submesh streams """
+    positions = read_records(buffer, position_offset, count, position_dtype)
+    records = read_records(buffer, vertex_data_offset, count, vertex_data_dtype)
+    next_position_offset = align(position_offset + count * position_dtype.itemsize)
+    next_vertex_data_offset = align(vertex_data_offset + count * vertex_data_dtype.itemsize)
+    return SubmeshVertices.from_records(positions, records), next_position_offset, next_vertex_data_offset
+
+
+def as_bytes(array):
+    """ Flat uint8 view of an array, so records can be written out without tobytes() copies """
+    return np.ascontiguousarray(array).reshape(-1).view(np.uint8)
+
+
+def flip_winding(faces):
+    """ (n, 3) triangles with the opposite winding, the Fox engine's being the reverse of Blender's - a view """
+    return np.asarray(faces).reshape(-1, 3)[:, ::-1]
+
+
+def face_problems(faces, vertex_count):
+    """ Masks of the triangles indexing past vertex_count vertices and of the degenerate ones (a vertex twice) """
+    faces = np.asarray(faces).reshape(-1, 3)
+    out_of_range = (faces >= vertex_count).any(axis=1)
+    degenerate = (faces[:, 0] == faces[:, 1]) | (faces[:, 1] == faces[:, 2]) | (faces[:, 2] == faces[:, 0])
+    return out_of_range, degenerate
+
+
+def index_buffer(faces):
+    """ faces as the (n, 3) '<u2' array the file stores; raises on indices that don't fit in 16 bits """
+    faces = np.asarray(faces).reshape(-1, 3)
+    if faces.size:
+        low, high = faces.min(), faces.max()
+        if low < 0 or high >= MAX_MESH_VERTICES:
+            raise Exception(f"Face index {high if high >= MAX_MESH_VERTICES else low} doesn't fit the 16 bit index "
+                            f"buffer, a mesh holds at most {MAX_MESH_VERTICES} vertices")
+    return faces.astype('<u2', copy=False)
+
+
+def layout_stream(chunks, start_offset):
+    """ Places per-submesh record arrays one after the other, each padded so the next starts 16-byte aligned.
+
+    start_offset is the absolute position of the stream. Returns the (offset, data) pairs and the end of the stream.
+    """
+    placed = []
+    offset = start_offset
+    for chunk in chunks:
+        data = as_bytes(chunk)
+        placed.append((offset, data))
+        offset = align(offset + len(data))
+    return placed, offset
+
+
+def layout_faces(face_lists, start_offset):
+    """ Places the triangle index lists of all submeshes (already in Fox engine winding) back to back.
+
+    The stream is padded to 16 bytes at the end. Returns the (offset, data) pairs and the end of the stream.
+    """
+    placed = []
+    offset = start_offset
+    for faces in face_lists:
+        data = as_bytes(index_buffer(faces))
+        placed.append((offset, data))
+        offset += len(data)
+    return placed, align(offset)
+
+
+def model_vertices(model, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """ SubmeshVertices of every mesh buffer of an Fmdl.FmdlModel """
+    return [SubmeshVertices.decode(mesh_buffer.positions, mesh_buffer.vertex_data, memory_budget)
+            for mesh_buffer in model.mesh_buffers]
@@ -0,0 +1,193 @@
+""" FPK (Fox engine package) archive reader and writer, in place of GzsTool.exe.
+
+Layout, as written by GzsTool:
+* 0x00 - 0x2F: header - "foxfpk", type (0 for .fpk, 'd' for .fpkd), "win", file size, 18 bytes of padding,
+  2, number of entries, number of references, 4 bytes of padding.
+* 0x30 bytes per entry: data offset, data size, file name (offset and length into the string area, each uint32
+  followed by 4 bytes of padding) and the MD5 of the file name.
+* 0x10 bytes per reference: file name of a referenced archive.
+* Null terminated names, padded to 16 bytes, then the data of every entry, each padded to 16 bytes.
+"""
+import hashlib
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+from typing import List
+
+from . import Profile
+from .FmdlVertexBuffer import align
+
+FPK_TYPE_FPK = 0x00
+FPK_TYPE_FPKD = 0x64
+
+HEADER = struct.Struct("<6sB3sI18x3I4x")
+ENTRY = struct.Struct("<I4xI4xI4xI4x16s")
+REFERENCE = struct.Struct("<I4xI4x")
+MAGIC = b'foxfpk'
+PLATFORM = b'win'
+VERSION = 2
+
+
+@dataclass
+class FpkEntry:
+    name: str
+    offset: int
+    size: int
+    md5: bytes
+
+
+def read_name(data, offset, length):
+    return bytes(data[offset:offset + length]).decode("utf-8")
+
+
+def name_hash(name):
+    return hashlib.md5(name.encode("utf-8")).digest()
+
+
+class FpkFile:
+    """ Entries of an .fpk archive. Entry data is returned as memoryview slices of the source, without copying.
+
+    source is a bytes-like object or an mmap; open() memory-maps an archive on disk.
+    """
+
+    def __init__(self, source):
+        self.data = memoryview(source)
+        self.mapping = None
+        magic, self.fpk_type, platform, file_size, version, entry_count, reference_count = \
+            HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or platform != PLATFORM:
+            raise Exception(f"Not an fpk archive: {magic} {platform}")
+
+        self.entries: List[FpkEntry] = []
+        offset = HEADER.size
+        for entry in range(entry_count):
+            data_offset, data_size, name_offset, name_length, md5 = ENTRY.unpack_from(self.data, offset)
+            self.entries.append(FpkEntry(read_name(self.data, name_offset, name_length), data_offset, data_size, md5))
+            offset += ENTRY.size
+        self.references: List[str] = []
+        for reference in range(reference_count):
+            self.references.append(read_name(self.data, *REFERENCE.unpack_from(self.data, offset)))
+            offset += REFERENCE.size
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as fpk_file:
+            mapping = mmap.mmap(fpk_file.fileno(), 0, access=mmap.ACCESS_READ)
+        fpk = cls(mapping)
+        fpk.mapping = mapping
+        Profile.count('bytes read', len(mapping))
+        return fpk
+
+    def close(self):
+        if self.mapping is not None:
+            self.data.release()
+            try:
+                self.mapping.close()
+            except BufferError:
+                # entry views are still alive, the mapping goes away with them
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def names(self):
+        return [entry.name for entry in self.entries]
+
+    def entry(self, name):
+        for entry in self.entries:
+            if entry.name == name:
+                return entry
+        raise KeyError(name)
+
+    def read(self, name):
+        entry = self.entry(name)
+        return self.data[entry.offset:entry.offset + entry.size]
+
+    def extract(self, directory, names=None):
+        """ Writes the entries (all of them by default) below directory; returns the written paths """
+        paths = []
+        for entry in self.entries:
+            if names is not None and entry.name not in names:
+                continue
+            path = entry_path(directory, entry.name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as out_file:
+                out_file.write(self.data[entry.offset:entry.offset + entry.size])
+            Profile.count('bytes written', entry.size)
+            paths.append(path)
+        return paths
+
+
+def entry_path(directory, name):
+    path = os.path.normpath(os.path.join(directory, name.lstrip('/\\')))
+    if os.path.commonpath([os.path.abspath(directory), os.path.abspath(path)]) != os.path.abspath(directory):
+        raise Exception(f"Entry '{name}' points outside of {directory}")
+    return path
+
+
+def layout_archive(files, references=(), fpk_type=FPK_TYPE_FPK):
+    """ Places every part of an archive holding files, a list of (name, data) pairs.
+
+    Returns the archive size and its (offset, data) chunks in order; the gaps between chunks are zero padding.
+    """
+    names = [name.encode("utf-8") for name, data in files] + [name.encode("utf-8") for name in references]
+    offset = HEADER.size + ENTRY.size * len(files) + REFERENCE.size * len(references)
+    name_offsets = []
+    for name in names:
+        name_offsets.append(offset)
+        offset += len(name) + 1
+    string_data = b''.join(name + b'\0' for name in names)
+    string_start = name_offsets[0] if names else offset
+    offset = align(offset)
+
+    data_offsets = []
+    chunks = []
+    for name, data in files:
+        data_offsets.append(offset)
+        chunks.append((offset, data))
+        offset = align(offset + len(data))
+
+    tables = [HEADER.pack(MAGIC, fpk_type, PLATFORM, offset, VERSION, len(files), len(references))]
+    for index, (name, data) in enumerate(files):
+        tables.append(ENTRY.pack(data_offsets[index], len(data), name_offsets[index], len(names[index]),
+                                 name_hash(name)))
+    for index in range(len(files), len(names)):
+        tables.append(REFERENCE.pack(name_offsets[index], len(names[index])))
+    return offset, [(0, b''.join(tables)), (string_start, string_data)] + chunks
+
+
+def dump(files, stream, references=(), fpk_type=FPK_TYPE_FPK):
+    """ Writes an archive in a single forward pass """
+    size, chunks = layout_archive(files, references, fpk_type)
+    position = 0
+    for offset, chunk in chunks:
+        if offset > position:
+            stream.write(bytes(offset - position))
+        stream.write(chunk)
+        position = offset + len(chunk)
+    stream.write(bytes(size - position))
+
+
+def unpack(fpk_path, directory=None):
+    """ Extracts an archive, by default into <name>_fpk next to it like GzsTool does; returns the written paths """
+    if directory is None:
+        directory = os.path.splitext(fpk_path)[0] + '_' + os.path.splitext(fpk_path)[1].lstrip('.')
+    with FpkFile.open(fpk_path) as fpk:
+        return fpk.extract(directory)
+
+
+def pack(fpk_path, directory, names, references=()):
+    """ Builds fpk_path from the files called names in directory """
+    files = []
+    for name in names:
+        with open(entry_path(directory, name), 'rb') as in_file:
+            files.append((name, in_file.read()))
+        Profile.count('bytes read', len(files[-1][1]))
+    fpk_type = FPK_TYPE_FPKD if fpk_path.lower().endswith('.fpkd') else FPK_TYPE_FPK
+    with open(fpk_path, 'wb') as fpk_file:
+        dump(files, fpk_file, references, fpk_type)
+        Profile.count('bytes written', fpk_file.tell())
@@ -0,0 +1,368 @@
+""" Fox engine texture (.ftex) reader and writer, and conversion to and from DirectDraw Surface (.dds) and PNG.
+
+Replaces FtexDdsTools.exe / DdsFtexTools.exe for textures that keep their mip maps inside the .ftex
+(DdsFtexTools -f 0), which is how the face.fpk textures are stored. ftex_to_png / png_to_ftex go straight between
+.ftex and PNG through the Dxt and Png modules, in place of texconv.exe and nvcompress.exe.
+
+Layout:
+* 0x00 - 0x3F: header - "FTEX", version (2.03), pixel format, width, height, depth, mip map count, nrt flag,
+  unknown flags, 1, 0, texture type, .ftexs file count, additional .ftexs file count, 14 bytes of padding, hash.
+* 0x10 bytes per mip map: offset, decompressed size, size in the file, index, .ftexs file number, chunk count.
+* Mip maps, smallest first. Each one is an index of 8 byte chunk entries (size in the file, decompressed size,
+  data offset relative to the mip map) followed by the chunk data - zlib streams of up to 0x4000 bytes - then
+  padding to 16 bytes and 8 more zero bytes. A mip map held in a single chunk that zlib can't shrink is stored
+  as is, with the raw flag set in its offset.
+"""
+import math
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import List
+
+import numpy as np
+
+from . import Dxt, Png, Profile
+from .Files import replace_file
+from .ImportCache import texture_key
+from .TextureCache import cache_key
+
+PIXEL_FORMAT_A8R8G8B8 = 0
+PIXEL_FORMAT_L8 = 1
+PIXEL_FORMAT_DXT1 = 2
+PIXEL_FORMAT_DXT5 = 4
+
+TEXTURE_TYPE_MATERIAL = 0x01000001
+TEXTURE_TYPE_DIFFUSE = 0x01000003
+TEXTURE_TYPE_CUBE = 0x01000007
+TEXTURE_TYPE_NORMAL = 0x01000009
+
+FLAGS_CLP = 0x0000
+FLAGS_UNKNOWN = 0x0011
+FLAGS_DEFAULT = 0x0111
+
+HEADER = struct.Struct("<4sf4hBBh3IBB14x16s")
+MIP_MAP = struct.Struct("<3IBBh")
+CHUNK = struct.Struct("<2HI")
+MAGIC = b'FTEX'
+VERSION = 2.03
+CHUNK_SIZE = 0x4000
+RAW_CHUNK = 0x80000000
+
+# block size of the compressed formats, bytes per pixel of the others
+BLOCK_BYTES = {PIXEL_FORMAT_DXT1: 8, PIXEL_FORMAT_DXT5: 16}
+PIXEL_BYTES = {PIXEL_FORMAT_A8R8G8B8: 4, PIXEL_FORMAT_L8: 1}
+
+DDS_HEADER = struct.Struct("<4s7I44x2I4s5I4I4x")
+DDS_HEADER_DX10 = struct.Struct("<5I")
+DDS_MAGIC = b'DDS '
+DDSD_DEFAULT = 0x1007
+DDSD_MIPMAPCOUNT = 0x20000
+DDSD_DEPTH = 0x800000
+DDSCAPS_TEXTURE = 0x1000
+DDSCAPS_MIPMAP = 0x400008
+DDPF_FOURCC = 0x4
+DDPF_RGBA = 0x41
+DDPF_LUMINANCE = 0x20000
+
+# (flags, fourcc, bit count, r, g, b, a masks) of the DDS pixel formats the tools write
+DDS_PIXEL_FORMATS = {
+    PIXEL_FORMAT_A8R8G8B8: (DDPF_RGBA, bytes(4), 32, 0xff0000, 0xff00, 0xff, 0xff000000),
+    PIXEL_FORMAT_L8: (DDPF_LUMINANCE, bytes(4), 8, 0xff, 0, 0, 0),
+    PIXEL_FORMAT_DXT1: (DDPF_FOURCC, b'DXT1', 0, 0, 0, 0, 0),
+    PIXEL_FORMAT_DXT5: (DDPF_FOURCC, b'DXT5', 0, 0, 0, 0, 0),
+}
+DXGI_FORMATS = {71: PIXEL_FORMAT_DXT1, 72: PIXEL_FORMAT_DXT1, 77: PIXEL_FORMAT_DXT5, 78: PIXEL_FORMAT_DXT5,
+                87: PIXEL_FORMAT_A8R8G8B8, 61: PIXEL_FORMAT_L8}
+
+
+@dataclass
+class FtexTexture:
+    """ A texture with its mip maps decompressed, largest first. The remaining fields only matter for .ftex. """
+    pixel_format: int
+    width: int
+    height: int
+    mip_maps: List[bytes] = field(default_factory=list)
+    depth: int = 1
+    nrt_flag: int = 2
+    unknown_flags: int = FLAGS_DEFAULT
+    texture_type: int = TEXTURE_TYPE_DIFFUSE
+    hash: bytes = bytes(16)
+
+
+@dataclass
+class ConversionResult:
+    """ Outcome of converting one texture: the written path, or the error that stopped it """
+    source: str
+    path: str = None
+    error: Exception = None
+    seconds: float = 0
+
+
+def mip_map_size(pixel_format, width, height, level):
+    width, height = max(1, width >> level), max(1, height >> level)
+    if pixel_format in BLOCK_BYTES:
+        return max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * BLOCK_BYTES[pixel_format]
+    if pixel_format in PIXEL_BYTES:
+        return width * height * PIXEL_BYTES[pixel_format]
+    raise Exception(f"Unsupported pixel format {pixel_format}")
+
+
+def read_mip_map(data, offset, decompressed_size, chunk_count):
+    if chunk_count == 0:
+        return bytes(data[offset:offset + decompressed_size])
+    chunks = []
+    for chunk in range(chunk_count):
+        size, chunk_size, data_offset = CHUNK.unpack_from(data, offset + chunk * CHUNK.size)
+        start = offset + (data_offset & ~RAW_CHUNK)
+        if size == chunk_size:
+            chunks.append(bytes(data[start:start + size]))
+        else:
+            chunks.append(zlib.decompress(data[start:start + size]))
+    return b''.join(chunks)
+
+
+def loads(data, with_mip_maps=True):
+    """ Decodes an .ftex. Mip maps stored in .ftexs files are not supported. """
+    data = memoryview(data)
+    (magic, version, pixel_format, width, height, depth, mip_map_count, nrt_flag, unknown_flags, _, _,
+     texture_type, ftexs_count, additional_ftexs_count, texture_hash) = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise Exception(f"Not an ftex file: {magic}")
+    mip_maps = [None] * mip_map_count if with_mip_maps else []
+    for mip_map in range(len(mip_maps)):
+        offset, decompressed_size, size, index, ftexs_number, chunk_count = \
+            MIP_MAP.unpack_from(data, HEADER.size + mip_map * MIP_MAP.size)
+        if ftexs_number != 0:
+            raise Exception(f"Mip map {index} is stored in .ftexs file {ftexs_number}")
+        mip_maps[index] = read_mip_map(data, offset, decompressed_size, chunk_count)
+    return FtexTexture(pixel_format, width, height, mip_maps, depth, nrt_flag, unknown_flags, texture_type,
+                       texture_hash)
+
+
+def write_mip_map(mip_map, offset):
+    """ Encodes one mip map placed at offset; returns its bytes (padding included) and its size in the file """
+    chunks = [mip_map[start:start + CHUNK_SIZE] for start in range(0, len(mip_map), CHUNK_SIZE)]
+    compressed = [zlib.compress(chunk) for chunk in chunks]
+    index = []
+    if len(chunks) == 1 and len(compressed[0]) >= len(chunks[0]):
+        index.append(CHUNK.pack(len(chunks[0]), len(chunks[0]), RAW_CHUNK | CHUNK.size))
+        compressed = chunks
+    else:
+        data_offset = CHUNK.size * len(chunks)
+        for chunk, compressed_chunk in zip(chunks, compressed):
+            index.append(CHUNK.pack(len(compressed_chunk), len(chunk), data_offset))
+            data_offset += len(compressed_chunk)
+    size = CHUNK.size * len(chunks) + sum(len(chunk) for chunk in compressed)
+    alignment = -(offset + size) % 16
+    return b''.join(index + compressed) + bytes(alignment + 8), size + alignment
+
+
+def dumps(texture):
+    """ Encodes an .ftex with every mip map inside it, laid out like DdsFtexTools -f 0 does """
+    mip_map_count = len(texture.mip_maps)
+    offset = HEADER.size + MIP_MAP.size * mip_map_count
+    infos = [None] * mip_map_count
+    blocks = []
+    for index in reversed(range(mip_map_count)):
+        mip_map = texture.mip_maps[index]
+        block, size = write_mip_map(mip_map, offset)
+        infos[index] = MIP_MAP.pack(offset, len(mip_map), size, index, 0, math.ceil(len(mip_map) / CHUNK_SIZE))
+        blocks.append(block)
+        offset += len(block)
+    header = HEADER.pack(MAGIC, VERSION, texture.pixel_format, texture.width, texture.height, texture.depth,
+                         mip_map_count, texture.nrt_flag, texture.unknown_flags, 1, 0, texture.texture_type, 0, 0,
+                         texture.hash)
+    return b''.join([header] + infos + blocks)
+
+
+def dds_pixel_format(flags, fourcc, bit_count, masks, dxgi_format=None):
+    if fourcc == b'DX10':
+        if dxgi_format not in DXGI_FORMATS:
+            raise Exception(f"Unsupported DXGI format {dxgi_format}")
+        return DXGI_FORMATS[dxgi_format]
+    for pixel_format, (format_flags, format_fourcc, format_bit_count, *format_masks) in DDS_PIXEL_FORMATS.items():
+        if flags & DDPF_FOURCC:
+            if format_flags == DDPF_FOURCC and fourcc == format_fourcc:
+                return pixel_format
+        elif (flags, bit_count, list(masks)) == (format_flags, format_bit_count, format_masks):
+            return pixel_format
+    raise Exception(f"Unsupported DDS pixel format: flags {flags:#x}, fourcc {fourcc}, {bit_count} bits")
+
+
+def loads_dds(data, template=None):
+    """ Decodes a .dds; the .ftex-only fields come from template (an FtexTexture) when given """
+    data = memoryview(data)
+    (magic, _, flags, height, width, _, depth, mip_map_count, _, format_flags, fourcc, bit_count, *masks,
+     caps, _, _, _) = DDS_HEADER.unpack_from(data, 0)
+    if magic != DDS_MAGIC:
+        raise Exception(f"Not a dds file: {magic}")
+    offset = DDS_HEADER.size
+    dxgi_format = None
+    if fourcc == b'DX10':
+        dxgi_format = DDS_HEADER_DX10.unpack_from(data, offset)[0]
+        offset += DDS_HEADER_DX10.size
+    pixel_format = dds_pixel_format(format_flags, fourcc, bit_count, masks, dxgi_format)
+    if not flags & DDSD_MIPMAPCOUNT or mip_map_count == 0:
+        mip_map_count = 1
+    mip_maps = []
+    for level in range(mip_map_count):
+        size = mip_map_size(pixel_format, width, height, level)
+        mip_maps.append(bytes(data[offset:offset + size]))
+        offset += size
+    texture = template if template is not None else FtexTexture(pixel_format, width, height)
+    return replace(texture, pixel_format=pixel_format, width=width, height=height, mip_maps=mip_maps,
+                   depth=max(depth, 1))
+
+
+def dumps_dds(texture):
+    """ Encodes a .dds with the header FtexDdsTools writes """
+    mip_map_count = len(texture.mip_maps)
+    flags, caps = DDSD_DEFAULT, DDSCAPS_TEXTURE
+    if texture.depth > 1:
+        flags |= DDSD_DEPTH
+    if mip_map_count > 1:
+        flags |= DDSD_MIPMAPCOUNT
+        caps |= DDSCAPS_MIPMAP
+    format_flags, fourcc, bit_count, *masks = DDS_PIXEL_FORMATS[texture.pixel_format]
+    header = DDS_HEADER.pack(DDS_MAGIC, 124, flags, texture.height, texture.width, 0,
+                             texture.depth if texture.depth > 1 else 0, mip_map_count if mip_map_count > 1 else 0,
+                             32, format_flags, fourcc, bit_count, *masks, caps, 0, 0, 0)
+    return b''.join([header] + list(texture.mip_maps))
+
+
+def read(path, with_mip_maps=True):
+    with open(path, 'rb') as ftex_file:
+        data = ftex_file.read()
+    Profile.count('bytes read', len(data))
+    return loads(data, with_mip_maps)
+
+
+def write(texture, path):
+    """ Writes through a temporary file, so a hard linked .ftex is replaced rather than changed for every link """
+    data = dumps(texture)
+    replace_file(path, data)
+    Profile.count('bytes written', len(data))
+
+
+def ftex_to_dds(ftex_path, dds_path=None):
+    """ Converts ftex_path to a .dds next to it (or dds_path); returns the .dds path """
+    if dds_path is None:
+        dds_path = os.path.splitext(ftex_path)[0] + '.dds'
+    with open(dds_path, 'wb') as dds_file:
+        dds_file.write(dumps_dds(read(ftex_path)))
+    return dds_path
+
+
+def dds_to_ftex(dds_path, ftex_path=None):
+    """ Converts dds_path to an .ftex next to it (or ftex_path); returns the .ftex path.
+
+    When the .ftex already exists its texture type, flags and hash are kept.
+    """
+    if ftex_path is None:
+        ftex_path = os.path.splitext(dds_path)[0] + '.ftex'
+    template = read(ftex_path, with_mip_maps=False) if os.path.exists(ftex_path) else None
+    with open(dds_path, 'rb') as dds_file:
+        texture = loads_dds(dds_file.read(), template)
+    write(texture, ftex_path)
+    return ftex_path
+
+
+def to_rgba(texture, level=0):
+    """ Decodes one mip map of texture into a (height, width, 4) uint8 RGBA array """
+    width, height = max(1, texture.width >> level), max(1, texture.height >> level)
+    data = texture.mip_maps[level]
+    if texture.pixel_format == PIXEL_FORMAT_DXT5:
+        return Dxt.decode_dxt5(data, width, height)
+    if texture.pixel_format == PIXEL_FORMAT_DXT1:
+        return Dxt.decode_dxt1(data, width, height)
+    if texture.pixel_format == PIXEL_FORMAT_A8R8G8B8:
+        return np.frombuffer(data, dtype=np.uint8).reshape(height, width, 4)[..., [2, 1, 0, 3]]
+    if texture.pixel_format == PIXEL_FORMAT_L8:
+        gray = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 1)
+        return np.concatenate((gray, gray, gray, np.full_like(gray, 255)), axis=-1)
+    raise Exception(f"Unsupported pixel format {texture.pixel_format}")
+
+
+def from_rgba(rgba, quality=Dxt.QUALITY_NORMAL, template=None):
+    """ A DXT5 texture with the full mip map chain of a (height, width, 4) uint8 RGBA array.
+
+    The .ftex-only fields come from template (an FtexTexture) when given.
+    """
+    mip_maps = [Dxt.encode_dxt5(image, quality) for image in Dxt.mip_maps(rgba)]
+    height, width = rgba.shape[:2]
+    texture = template if template is not None else FtexTexture(PIXEL_FORMAT_DXT5, width, height)
+    return replace(texture, pixel_format=PIXEL_FORMAT_DXT5, width=width, height=height, mip_maps=mip_maps, depth=1)
+
+
+def ftex_to_png(ftex_path, png_path=None, cache=None):
+    """ Converts the largest mip map of ftex_path to a .PNG next to it (or png_path); returns the .PNG path.
+
+    With an ImportCache, a texture decoded before is taken from the cache instead.
+    """
+    if png_path is None:
+        png_path = os.path.splitext(ftex_path)[0] + '.PNG'
+    with open(ftex_path, 'rb') as ftex_file:
+        ftex_data = ftex_file.read()
+    Profile.count('bytes read', len(ftex_data))
+    key = None
+    if cache is not None:
+        key = texture_key(ftex_data)
+    if key is not None and cache.textures.get(key, png_path):
+        return png_path
+    Png.write(to_rgba(loads(ftex_data)), png_path)
+    if key is not None:
+        cache.textures.put(key, png_path)
+    return png_path
+
+
+def png_to_ftex(png_path, ftex_path=None, quality=Dxt.QUALITY_NORMAL, cache=None):
+    """ Compresses png_path to a DXT5 .ftex next to it (or ftex_path); returns the .ftex path.
+
+    When the .ftex already exists its texture type, flags and hash are kept. With a TextureCache, a texture
+    encoded before with the same PNG and settings is taken from the cache instead.
+    """
+    if ftex_path is None:
+        ftex_path = os.path.splitext(png_path)[0] + '.ftex'
+    template = read(ftex_path, with_mip_maps=False) if os.path.exists(ftex_path) else None
+    with open(png_path, 'rb') as png_file:
+        png_data = png_file.read()
+    Profile.count('bytes read', len(png_data))
+    key = None
+    if cache is not None:
+        key = cache_key(png_data, quality, template or FtexTexture(PIXEL_FORMAT_DXT5, 0, 0))
+    if key is not None and cache.get(key, ftex_path):
+        return ftex_path
+    write(from_rgba(Png.loads(png_data), quality, template), ftex_path)
+    if key is not None:
+        cache.put(key, ftex_path)
+    return ftex_path
+
+
+def convert_texture(convert, source, **kwargs):
+    start = time.perf_counter()
+    try:
+        with Profile.stage(convert.__name__, texture=os.path.basename(source)):
+            path = convert(source, **kwargs)
+        return ConversionResult(source, path=path, seconds=time.perf_counter() - start)
+    except Exception as ex:
+        return ConversionResult(source, error=ex, seconds=time.perf_counter() - start)
+
+
+def convert_textures(convert, sources, workers=None, **kwargs):
+    """ Runs convert(source, **kwargs) - e.g. ftex_to_png - for every source on a bounded pool of threads.
+
+    Returns a ConversionResult per source, in the order of sources; a failing texture doesn't stop the others.
+    workers defaults to one per CPU. Threads rather than processes: NumPy and zlib release the GIL for the heavy
+    work, and Blender can't start worker interpreters of itself.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(sources)))
+    if workers == 1:
+        return [convert_texture(convert, source, **kwargs) for source in sources]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(convert_texture, convert, source, **kwargs) for source in sources]
+        return [future.result() for future in futures]
@@ -0,0 +1,46 @@
+""" IEEE 754 half precision (float16) conversion, for the normals, tangents and UVs of the vertex data stream.
+
+Decoding looks the bit pattern up in a table of all 65536 float16 values, so every value - subnormals, infinities
+and NaNs included - decodes exactly, the same way for single values and whole buffers. Encoding rounds to the
+nearest float16, ties to even; values past the float16 range become infinities.
+"""
+import struct
+
+import numpy as np
+
+HALF = struct.Struct('<e')
+HALF_BITS = struct.Struct('<H')
+
+# float32 value of every float16 bit pattern
+DECODE_TABLE = np.arange(1 << 16, dtype=np.uint16).view('<f2').astype(np.float32)
+DECODE_TABLE.flags.writeable = False
+
+
+def decode(values):
+    """ float32 array of float16 bit patterns (uint16), or of a float16 array such as a record field """
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        values = values.view(values.dtype.str.replace('f', 'u'))
+    return DECODE_TABLE.take(values.astype(np.intp, copy=False))
+
+
+def encode(values):
+    """ Little-endian float16 bit patterns ('<u2') of an array of numbers, correctly rounded """
+    values = np.asarray(values)
+    if values.dtype.kind != 'f':
+        values = values.astype(np.float64)
+    with np.errstate(over='ignore'):
+        return values.astype('<f2').view('<u2')
+
+
+def to_float(bits):
+    """ The value of one float16 bit pattern """
+    return float(DECODE_TABLE[bits])
+
+
+def from_float(value):
+    """ The float16 bit pattern of one number, correctly rounded """
+    try:
+        return HALF_BITS.unpack(HALF.pack(value))[0]
+    except OverflowError:
+        return 0xFC00 if value < 0 else 0x7C00
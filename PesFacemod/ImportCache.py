@@ -0,0 +1,120 @@
+""" Persistent cache of what importing a face.fpk decodes, so importing the same files again only has to build the
+Blender objects.
+
+Models are keyed by the .fmdl content and stored as <key>.npz: the vertex arrays of every submesh (see
+FmdlVertexBuffer.SubmeshVertices), the part of importing that takes time. The Fmdl.FmdlModel itself is decoded
+from the .fmdl again, which only takes views of its bytes, so entries hold plain arrays and nothing in them is
+unpickled or run. Textures are keyed by the .ftex content and stored as the <key>.PNG that Ftex.ftex_to_png
+writes. Each kind lives in a FileCache of its own, with half of max_bytes.
+
+To see what is cached, or empty the cache, from the folder holding the PesFacemod package:
+
+    python -m PesFacemod.ImportCache [--clear] [cache folder]
+"""
+import argparse
+import hashlib
+import io
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from . import Fmdl, Profile
+from .FmdlVertexBuffer import DEFAULT_MEMORY_BUDGET, VERTEX_ATTRIBUTES, SubmeshVertices, model_vertices
+from .TextureCache import FileCache
+
+# bump when the Fmdl / SubmeshVertices decoding or the Png output changes, so older entries are no longer hit
+CACHE_VERSION = 4
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'PesFacemod', 'import')
+
+
+def model_key(fmdl_data):
+    return hashlib.sha1(b'fmdl:%d:' % CACHE_VERSION + fmdl_data).hexdigest()
+
+
+def texture_key(ftex_data):
+    return hashlib.sha1(b'ftex:%d:' % CACHE_VERSION + ftex_data).hexdigest()
+
+
+def dumps_vertices(submesh_vertices):
+    arrays = {'submesh_count': np.array(len(submesh_vertices))}
+    for index, vertices in enumerate(submesh_vertices):
+        for attribute in VERTEX_ATTRIBUTES:
+            arrays[f'{attribute}_{index}'] = getattr(vertices, attribute)
+    out_file = io.BytesIO()
+    np.savez(out_file, **arrays)
+    return out_file.getvalue()
+
+
+def load_vertices(path, model):
+    """ The submesh vertices of model stored by dumps_vertices; raises when they don't fit the model """
+    with np.load(path, allow_pickle=False) as arrays:
+        if int(arrays['submesh_count']) != len(model.meshes):
+            raise Exception(f"{int(arrays['submesh_count'])} submeshes cached, the model has {len(model.meshes)}")
+        submesh_vertices = [SubmeshVertices(**{attribute: arrays[f'{attribute}_{index}']
+                                               for attribute in VERTEX_ATTRIBUTES})
+                            for index in range(len(model.meshes))]
+    for mesh, vertices in zip(model.meshes, submesh_vertices):
+        for attribute in VERTEX_ATTRIBUTES:
+            if len(getattr(vertices, attribute)) not in (0, mesh.vertex_count):
+                raise Exception(f"{len(getattr(vertices, attribute))} {attribute} cached for {mesh.vertex_count} "
+                                f"vertices")
+    return submesh_vertices
+
+
+class ImportCache:
+    def __init__(self, directory=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.models = FileCache(os.path.join(directory, 'models'), max_bytes // 2, '.npz')
+        self.textures = FileCache(os.path.join(directory, 'textures'), max_bytes - max_bytes // 2, '.PNG')
+
+    def read_model(self, fmdl_path, memory_budget=DEFAULT_MEMORY_BUDGET):
+        """ The Fmdl.FmdlModel in fmdl_path and its SubmeshVertices, decoded only if the cache doesn't have them """
+        with open(fmdl_path, 'rb') as fmdl_file:
+            data = fmdl_file.read()
+        Profile.count('bytes read', len(data))
+        key = model_key(data)
+        model = Fmdl.loads(data)
+        path = self.models.lookup(key)
+        if path is not None:
+            try:
+                return model, load_vertices(path, model)
+            except Exception as ex:
+                print("Decoding again, unreadable cache entry", path, ":", ex)
+        submesh_vertices = model_vertices(model, memory_budget)
+        self.models.put_data(key, dumps_vertices(submesh_vertices))
+        return model, submesh_vertices
+
+    def caches(self):
+        return [('models', self.models), ('textures', self.textures)]
+
+    def size(self):
+        return sum(cache.size() for _, cache in self.caches())
+
+    def clear(self):
+        for _, cache in self.caches():
+            cache.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m PesFacemod.ImportCache',
+                                     description="Lists or clears the import cache")
+    parser.add_argument('directory', nargs='?', default=DEFAULT_PATH)
+    parser.add_argument('--clear', action='store_true', help="remove every entry")
+    arguments = parser.parse_args(argv)
+
+    cache = ImportCache(arguments.directory)
+    if arguments.clear:
+        cache.clear()
+    for name, file_cache in cache.caches():
+        entries = file_cache.entries()
+        print(f"{name}: {len(entries)} entries, {sum(size for _, size, _ in entries) / 2 ** 20:.1f} MiB "
+              f"in {file_cache.directory}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,9 +2,13 @@ import bpy, os, os.path, struct
 from bpy.props import StringProperty, BoolProperty, FloatProperty, IntProperty
 from struct import *
 import tempfile
+import time
 from mathutils import Vector
 from .PesFacemodGlobalData import PesFacemodGlobalData
-from .FmdlManager import FmdlManagerBase, exec_tool, apply_textures
+from .FmdlManager import FmdlManagerBase, apply_textures, collect_objects, load_models
+from . import Dxt, Fpk, Ftex, Profile, Renumber
+from .ImportCache import ImportCache
+from .TextureCache import TextureCache
 import bmesh
 
 
@@ -122,6 +126,10 @@ class PANEL_PT_file_properties(bpy.types.Panel):
         box.prop(scn, "player_id", text = "")
         row.operator("primary.operator", text = "Renumber player", icon = "FILE_REFRESH").face_opname = "renumber"
 
+        row = box.row()
+        row.label(text = "Decoded / encoded files cache")
+        row.operator("primary.operator", text = "Clear cache", icon = "TRASH").face_opname = "clear_cache"
+
 
 def get_diameter(obj, dim):
     max_d = max([v.co[dim] for v in obj.data.vertices])
@@ -227,6 +235,16 @@ def pes_diff_bin_imp(pes_diff_filename):
     return True
 
 
+def diff_bin_fingerprint(oralpath):
+    """ Everything pes_diff_bin_exp writes: the eye and mouth placement """
+    fingerprint = [os.path.isfile(oralpath)]
+    for name in ('eyeR', 'eyeL', 'mouth'):
+        if name in bpy.data.objects.keys():
+            obj = bpy.data.objects[name]
+            fingerprint.append((name, tuple(obj.location), get_pes_diameters(obj) if name != 'mouth' else None))
+    return fingerprint
+
+
 pes_face = []
 pes_hair = []
 pes_oral = []
@@ -235,96 +253,73 @@ temp_path = tempfile.gettempdir()
 face_type = None
 hair_type = None
 oral_type = None
+# diff_bin_fingerprint() as last imported / exported
+diff_bin_state = None
 
 packfpk = None
 
 
+def convert_textures(convert, extension, **kwargs):
+    """ Converts every texture found with extension in parallel, reporting each one """
+    sources = []
+    for texture in PesFacemodGlobalData.textures():
+        if os.path.exists(texture + extension):
+            sources.append(texture + extension)
+        else:
+            print("\tFile not found:", texture + extension)
+    with Profile.stage('textures', convert=convert.__name__):
+        results = Ftex.convert_textures(convert, sources, PesFacemodGlobalData.texture_workers, **kwargs)
+    for result in results:
+        if result.error is not None:
+            print("\tError converting texture", result.source, ":", result.error)
+        else:
+            print("\tConverted %s to %s (%.2fs)" % (result.source, result.path, result.seconds))
+
+
+def import_cache():
+    return ImportCache(PesFacemodGlobalData.import_cache_path, PesFacemodGlobalData.import_cache_size)
+
+
+def texture_cache():
+    return TextureCache(PesFacemodGlobalData.texture_cache_path, PesFacemodGlobalData.texture_cache_size)
+
+
+def clear_caches():
+    """ Empties the import and texture caches; returns the bytes freed """
+    caches = [import_cache(), texture_cache()]
+    size = sum(cache.size() for cache in caches)
+    for cache in caches:
+        cache.clear()
+    return size
+
+
 def unpack_files():
     if PesFacemodGlobalData.face_fpk != '':
         # unpack face_high.fmdl, etc.
-        if not exec_tool(os.path.join('Tools', 'Gzs', 'GzsTool.exe'), PesFacemodGlobalData.face_fpk):
+        try:
+            with Profile.stage('unpack fpk'):
+                Fpk.unpack(PesFacemodGlobalData.face_fpk, PesFacemodGlobalData.fpk_path('face_fpk'))
+        except Exception as ex:
+            print("Error unpacking", PesFacemodGlobalData.face_fpk, ":", ex)
             return False
 
         # unpack textures
-        textures = [
-            PesFacemodGlobalData.face_bsm_alp,
-            PesFacemodGlobalData.eye_occlusion_alp,
-            PesFacemodGlobalData.face_nrm,
-            PesFacemodGlobalData.face_srm,
-            PesFacemodGlobalData.face_trm,
-            PesFacemodGlobalData.hair_parts_bsm_alp,
-            PesFacemodGlobalData.hair_parts_nrm,
-            PesFacemodGlobalData.hair_parts_srm,
-            PesFacemodGlobalData.hair_parts_trm
-        ]
         print("Unpacking textures...")
-        for texture in textures:
-            print("\tTrying to unpack ", texture + '.ftex', "...")
-            if os.path.exists(texture + '.ftex'):
-                if exec_tool(os.path.join('Tools', 'FtexDdsTools.exe'), texture + '.ftex'):
-                    # extract PNG from DDS
-                    (path, fname) = os.path.split(texture + '.dds')
-                    if not exec_tool(os.path.join('Tools', 'texconv.exe'), '-y', '-ft', 'png', texture + '.dds', '-o',
-                                     path):
-                        print("Error converting texture")
-                else:
-                    print("Error unpacking")
-            else:
-                print("\tFile not found.")
+        convert_textures(Ftex.ftex_to_png, '.ftex', cache=import_cache())
     return True
 
 
-def create_xml_fpk(filename, files):
-    # create xml file
-    from xml.dom import minidom
-    root = minidom.Document()
-    archiveFile = root.createElement('ArchiveFile')
-    archiveFile.setAttributeNS('xmlns', 'xmlns:xsi', 'http://www.w3.org/2001/XMLSchema-instance')
-    archiveFile.setAttributeNS('xmlns', 'xmlns:xsd', 'http://www.w3.org/2001/XMLSchema')
-    archiveFile.setAttributeNS('xsi', 'xsi:type', 'FpkFile')
-    archiveFile.setAttribute('Name', 'face.fpk')
-    archiveFile.setAttribute('FpkType', 'Fpk')
-
-    root.appendChild(archiveFile)
-    entries = root.createElement('Entries')
-    archiveFile.appendChild(entries)
-    for file in files:
-        e = root.createElement('Entry')
-        e.setAttribute('FilePath', file)
-        entries.appendChild(e)
-    archiveFile.appendChild(root.createElement('References'))
-    xml_str = root.toprettyxml(indent = "\t")
-    with open(filename, "w") as f:
-        f.write(xml_str)
-
-
-def pack_files(oral_file_present):
-    # pack textures
-    textures = [
-        PesFacemodGlobalData.face_bsm_alp,
-        PesFacemodGlobalData.eye_occlusion_alp,
-        PesFacemodGlobalData.face_nrm,
-        PesFacemodGlobalData.face_srm,
-        PesFacemodGlobalData.face_trm,
-        PesFacemodGlobalData.hair_parts_bsm_alp,
-        PesFacemodGlobalData.hair_parts_nrm,
-        PesFacemodGlobalData.hair_parts_srm,
-        PesFacemodGlobalData.hair_parts_trm
-    ]
-    for texture in textures:
-        if os.path.exists(texture + '.PNG'):  # texconv adds extension in uppercase
-            # convert from PNG to DDS
-            if exec_tool(os.path.join('Tools', 'nvidia-texture-tools-2.1.1-win64', 'bin64', 'nvcompress.exe'),
-                         '-bc3',
-                         texture + '.PNG', texture + '.dds'):
-                # convert to Ftex
-                exec_tool(os.path.join('Tools', 'DdsFtexTools.exe'), '-f', '0', texture + '.dds')
+def pack_files(oral_file_present, texture_quality=Dxt.QUALITY_NORMAL, repack=True):
+    # pack textures, compressed to DXT5 unless the cache has them already
+    convert_textures(Ftex.png_to_ftex, '.PNG', quality=texture_quality, cache=texture_cache())
+    if not repack and os.path.exists(PesFacemodGlobalData.face_fpk):
+        print("face.fpk contents unchanged, not repacking")
+        return
     files = ['face_diff.bin', 'face_high.fmdl', 'hair_high.fmdl']
     if oral_file_present:
         files.append('oral.fmdl')
-    xml_file = PesFacemodGlobalData.face_fpk + '.xml'
-    create_xml_fpk(xml_file, files)
-    exec_tool(os.path.join('Tools', 'Gzs', 'GzsTool.exe'), xml_file)
+    with Profile.stage('pack fpk'):
+        Fpk.pack(PesFacemodGlobalData.face_fpk, PesFacemodGlobalData.fpk_path('face_fpk'), files)
 
 
 class OBJECT_OT_face_hair_modifier(bpy.types.Operator):
@@ -343,11 +338,26 @@ class OBJECT_OT_face_hair_modifier(bpy.types.Operator):
                 os.remove(os.path.join(temp_path, file))
 
     def execute(self, context):
+        if not PesFacemodGlobalData.profile_path:
+            return self.run(context)
+        Profile.start()
+        try:
+            with Profile.stage(self.face_opname):
+                return self.run(context)
+        finally:
+            report_path = os.path.join(PesFacemodGlobalData.profile_path,
+                                       time.strftime(self.face_opname + '-%Y%m%d-%H%M%S'))
+            print("Profile written to", *Profile.stop().write(report_path))
+
+    def run(self, context):
         scn = context.scene
+        if self.face_opname == "clear_cache":
+            self.report({"INFO"}, "Cache cleared (%.1f MiB)" % (clear_caches() / 2 ** 20))
+            return {'FINISHED'}
         if not PesFacemodGlobalData.good_path(scn.face_path):
             return {'FINISHED'}
 
-        global pes_face, pes_hair, pes_oral, face_type, hair_type, oral_type
+        global pes_face, pes_hair, pes_oral, face_type, hair_type, oral_type, diff_bin_state
         if self.face_opname == "import_files":
             if len(pes_face) != 0:
                 return {'FINISHED'}
@@ -359,22 +369,34 @@ class OBJECT_OT_face_hair_modifier(bpy.types.Operator):
                 return {'CANCELLED'}
             self.report({"INFO"}, "Files unpacked")
 
+            face_model_file = str(os.path.abspath(PesFacemodGlobalData.face_fmdl))
+            hair_model_file = str(os.path.abspath(PesFacemodGlobalData.hair_fmdl))
+            oral_model_file = str(os.path.abspath(PesFacemodGlobalData.oral_fmdl))
+            self.remove_temp_files("hair_normals_data.bin", "hair_tangents_data.bin")
             face_type = FaceFmdlManager(PesFacemodGlobalData.facepath, temp_path)
-            print("Trying to open file ", str(os.path.abspath(PesFacemodGlobalData.face_fmdl)))
-            pes_face = face_type.importmodel(str(os.path.abspath(PesFacemodGlobalData.face_fmdl)))
+            hair_type = HairFmdlManager(PesFacemodGlobalData.facepath, temp_path)
+            models = [(face_type, face_model_file), (hair_type, hair_model_file)]
+            if os.path.exists(oral_model_file):
+                oral_type = OralFmdlManager(PesFacemodGlobalData.facepath, temp_path)
+                models.append((oral_type, oral_model_file))
+
+            # decode every model at once, then build the Blender objects one model at a time
+            load_models(models, import_cache())
+
+            print("Trying to open file ", face_model_file)
+            with Profile.stage('import model', model=face_type.model_type):
+                pes_face = face_type.importmodel(face_model_file)
             self.report({"INFO"}, "Face Imported Succesfully (%s items)" % (len(pes_face)))
 
-            print("Trying to open file ", str(os.path.abspath(PesFacemodGlobalData.hair_fmdl)))
-            self.remove_temp_files("hair_normals_data.bin", "hair_tangents_data.bin")
-            hair_type = HairFmdlManager(PesFacemodGlobalData.facepath, temp_path)
-            pes_hair = hair_type.importmodel(str(os.path.abspath(PesFacemodGlobalData.hair_fmdl)))
+            print("Trying to open file ", hair_model_file)
+            with Profile.stage('import model', model=hair_type.model_type):
+                pes_hair = hair_type.importmodel(hair_model_file)
             self.report({"INFO"}, "hair.fmdl file imported")
 
-            oral_model_file = str(os.path.abspath(PesFacemodGlobalData.oral_fmdl))
             print("Trying to open file ", oral_model_file)
             if os.path.exists(oral_model_file):
-                oral_type = OralFmdlManager(PesFacemodGlobalData.facepath, temp_path)
-                pes_oral = oral_type.importmodel(str(os.path.abspath(PesFacemodGlobalData.oral_fmdl)))
+                with Profile.stage('import model', model=oral_type.model_type):
+                    pes_oral = oral_type.importmodel(oral_model_file)
                 self.report({"INFO"}, "Oral.fmdl file imported")
 
             # Load base scene (mouth and eyes in default positions)
@@ -394,7 +416,9 @@ class OBJECT_OT_face_hair_modifier(bpy.types.Operator):
                 if obj is not None:
                     bpy.context.collection.objects.link(obj)
 
-            pes_diff_bin_imp(PesFacemodGlobalData.diff_bin)
+            with Profile.stage('diff bin'):
+                pes_diff_bin_imp(PesFacemodGlobalData.diff_bin)
+            diff_bin_state = diff_bin_fingerprint(PesFacemodGlobalData.oral_fmdl)
             self.report({"INFO"}, "PES_DIFF.BIN Imported Succesfully!")
             print("Files imported")
 
@@ -410,6 +434,7 @@ class OBJECT_OT_face_hair_modifier(bpy.types.Operator):
             pes_face.clear()
             pes_hair.clear()
             pes_oral.clear()
+            diff_bin_state = None
             PesFacemodGlobalData.vertexgroup_disable = True
             bpy.ops.wm.read_homefile()
             PesFacemodGlobalData.clear()
@@ -420,29 +445,38 @@ class OBJECT_OT_face_hair_modifier(bpy.types.Operator):
             return {'FINISHED'}
 
     def export_files(self):
+        global diff_bin_state
         if len(pes_face) == 0:
             return {'FINISHED'}
-        face_type.exportmodel(str(os.path.abspath(PesFacemodGlobalData.face_fmdl)))
+        # files whose inputs didn't change since the import (or the last export) keep their unpacked bytes
+        with Profile.stage('export model', model=face_type.model_type):
+            changed = face_type.exportmodel(str(os.path.abspath(PesFacemodGlobalData.face_fmdl)))
         self.report({"INFO"}, "Face Exported Succesfully")
 
-        hair_type.exportmodel(str(os.path.abspath(PesFacemodGlobalData.hair_fmdl)))
+        with Profile.stage('export model', model=hair_type.model_type):
+            changed |= hair_type.exportmodel(str(os.path.abspath(PesFacemodGlobalData.hair_fmdl)))
         self.report({"INFO"}, "Hair Exported Succesfully")
 
         oral_model_present = len(pes_oral) != 0 and oral_type is not None and bpy.data.objects['Oral_0'] is not None
 
         if oral_model_present:
-            oral_type.exportmodel(str(os.path.abspath(PesFacemodGlobalData.oral_fmdl)))
+            with Profile.stage('export model', model=oral_type.model_type):
+                changed |= oral_type.exportmodel(str(os.path.abspath(PesFacemodGlobalData.oral_fmdl)))
         self.report({"INFO"}, "Oral Exported Successfully")
 
-        pes_diff_bin_exp(PesFacemodGlobalData.diff_bin, PesFacemodGlobalData.oral_fmdl)
+        fingerprint = diff_bin_fingerprint(PesFacemodGlobalData.oral_fmdl)
+        if fingerprint != diff_bin_state:
+            with Profile.stage('diff bin'):
+                pes_diff_bin_exp(PesFacemodGlobalData.diff_bin, PesFacemodGlobalData.oral_fmdl)
+            diff_bin_state = fingerprint
+            changed = True
         self.report({"INFO"}, "Exporting PES_DIFF.BIN Successfully!")
 
-        pack_files(oral_model_present)
+        pack_files(oral_model_present, repack=changed)
         self.report({"INFO"}, "Files packed")
 
     def renumber_player(self, player_id):
         import re
-        p = re.compile(r'/Assets/pes16/model/character/face/real/(?P<id>\d+)/sourceimages/', re.IGNORECASE)
 
         existing_player_path = PesFacemodGlobalData.player_path()
         new_path = re.sub(r'\\face\\real\\[0-9]+\\', f'\\\\face\\\\real\\\\{player_id}\\\\',
@@ -455,15 +489,24 @@ class OBJECT_OT_face_hair_modifier(bpy.types.Operator):
                         "Cannot renumber to an existing folder - make sure it's out of the way")
             PesFacemodGlobalData.load(bpy.data.scenes[0].face_path)
         else:
-            import shutil
             PesFacemodGlobalData.load(new_path)
-            shutil.copytree(existing_player_path, PesFacemodGlobalData.player_path())
             print("Renumbering player id to ", player_id, PesFacemodGlobalData.face_fpk)
+            # copies the folder with the fmdl string tables patched - no geometry export or texture encoding
+            Renumber.renumber_player(existing_player_path, player_id)
             bpy.data.scenes[0].face_path = PesFacemodGlobalData.face_fpk
+
+            # models without edits since the last import / export now match the renumbered files
+            managers = [manager for manager in (face_type, hair_type, oral_type) if manager is not None]
+            unchanged = [manager.fingerprint == manager.meshes_fingerprint(collect_objects(manager.model_type))
+                         for manager in managers]
             for obj in bpy.data.objects:
                 for item in obj.fmdl_strings:
-                    item.name = p.sub(f"/Assets/pes16/model/character/face/real/{player_id}/sourceimages/", item.name)
+                    item.name = Renumber.renumber_string(item.name, player_id)
+            for manager, manager_unchanged in zip(managers, unchanged):
+                if manager_unchanged:
+                    manager.fingerprint = manager.meshes_fingerprint(collect_objects(manager.model_type))
 
+            # only exports what was edited before renumbering, if anything
             self.export_files()
 
 
@@ -1,5 +1,10 @@
 import os
 import re
+import tempfile
+
+# textures that go with a face.fpk, in sourceimages/#windx11
+texture_names = ['face_bsm_alp', 'eye_occlusion_alp', 'face_nrm', 'face_srm', 'face_trm', 'hair_parts_bsm_alp',
+                 'hair_parts_nrm', 'hair_parts_srm', 'hair_parts_trm']
 
 
 class PesFacemodGlobalData:
@@ -25,6 +30,19 @@ class PesFacemodGlobalData:
     hair_parts_trm = ''
     diff_bin = ''
 
+    # threads converting textures on import / export, None for one per CPU
+    texture_workers = None
+    # encoded textures reused by later exports, and the size the cache is trimmed to
+    texture_cache_path = os.path.join(tempfile.gettempdir(), 'PesFacemod', 'textures')
+    texture_cache_size = 512 * 1024 * 1024
+    # decoded models and textures reused by later imports of the same files
+    import_cache_path = os.path.join(tempfile.gettempdir(), 'PesFacemod', 'import')
+    import_cache_size = 512 * 1024 * 1024
+    # bytes of vertices decoded, encoded or weighted at a time (see FmdlVertexBuffer.vertex_chunks)
+    vertex_memory_budget = 16 * 1024 * 1024
+    # folder for a timing report of every operator run (see Profile), '' to leave profiling off
+    profile_path = os.environ.get('PESFACEMOD_PROFILE', '')
+
     @classmethod
     def fpk_path(cls, *file):
         return os.path.join(cls.base_path, str(cls.player_id), '#Win', *file)
@@ -33,6 +51,11 @@ class PesFacemodGlobalData:
     def tex_path(cls, *file):
         return os.path.join(cls.base_path, str(cls.player_id), 'sourceimages', '#windx11', *file)
 
+    @classmethod
+    def textures(cls):
+        """ Paths of the face.fpk textures, without extension """
+        return [getattr(cls, name) for name in texture_names]
+
     @classmethod
     def player_path(cls):
         return os.path.join(cls.base_path, str(cls.player_id))
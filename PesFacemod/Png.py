@@ -0,0 +1,194 @@
+""" PNG reader and writer with NumPy and zlib, for the texture pipeline.
+
+Reads non interlaced images of 8 or 16 bits per channel in every color type (gray, RGB, palette, gray + alpha,
+RGBA), transparency (tRNS) included; writes 8 bit RGBA. Images are (height, width, 4) uint8 RGBA arrays; 16 bit
+channels are reduced to their high byte.
+"""
+import struct
+import zlib
+
+import numpy as np
+
+from . import Profile
+from .Files import replace_file
+
+SIGNATURE = b'\x89PNG\r\n\x1a\n'
+CHUNK_HEADER = struct.Struct(">I4s")
+IHDR = struct.Struct(">2I5B")
+
+COLOR_GRAY = 0
+COLOR_RGB = 2
+COLOR_PALETTE = 3
+COLOR_GRAY_ALPHA = 4
+COLOR_RGBA = 6
+CHANNELS = {COLOR_GRAY: 1, COLOR_RGB: 3, COLOR_PALETTE: 1, COLOR_GRAY_ALPHA: 2, COLOR_RGBA: 4}
+
+FILTER_NONE = 0
+FILTER_SUB = 1
+FILTER_UP = 2
+FILTER_AVERAGE = 3
+FILTER_PAETH = 4
+
+# zlib level of written files; higher levels take several times longer on decoded DXT images for ~7% smaller files
+COMPRESSION_LEVEL = 3
+
+
+def chunks(data):
+    """ (type, data) of every chunk up to IEND """
+    if bytes(data[:len(SIGNATURE)]) != SIGNATURE:
+        raise Exception("Not a png file")
+    offset = len(SIGNATURE)
+    while offset < len(data):
+        length, chunk_type = CHUNK_HEADER.unpack_from(data, offset)
+        offset += CHUNK_HEADER.size
+        yield chunk_type, data[offset:offset + length]
+        offset += length + 4  # crc
+        if chunk_type == b'IEND':
+            break
+
+
+def unfilter_rows(filtered, filters):
+    """ Undoes None, Sub and Up filters one row at a time """
+    rows = np.empty_like(filtered)
+    previous = np.zeros_like(filtered[0])
+    for row, filter_type in enumerate(filters):
+        if filter_type == FILTER_SUB:
+            rows[row] = np.cumsum(filtered[row], axis=0, dtype=np.uint8)
+        elif filter_type == FILTER_UP:
+            rows[row] = filtered[row] + previous
+        else:
+            rows[row] = filtered[row]
+        previous = rows[row]
+    return rows
+
+
+def unfilter_wavefront(filtered, filters):
+    """ Undoes any mix of filters, one anti-diagonal of pixels at a time.
+
+    A pixel only depends on its left, upper and upper left neighbours, which all lie on earlier anti-diagonals,
+    so every pixel of a diagonal is decoded at once whatever the filters of their rows. The image is skewed so
+    each diagonal is a contiguous row: pixel (row, column) lives at [row + column + 2, row + 1], with zeros above
+    and left of the image.
+    """
+    height, width, pixel_bytes = filtered.shape
+    row, column = np.mgrid[0:height, 0:width]
+    diagonals = np.zeros((height + width + 1, height + 1, pixel_bytes), dtype=np.int16)
+    skewed = np.zeros_like(diagonals)
+    skewed[row + column + 2, row + 1] = filtered
+    filters = np.asarray(filters)[:, None]
+    sub, up_only = (filters == FILTER_SUB).astype(np.int16), (filters == FILTER_UP).astype(np.int16)
+    average, paeth_only = (filters == FILTER_AVERAGE).astype(np.int16), (filters == FILTER_PAETH).astype(np.int16)
+    for diagonal in range(2, height + width + 1):
+        first, last = max(0, diagonal - width - 1), min(height, diagonal - 1)
+        left = diagonals[diagonal - 1, first + 1:last + 1]
+        up = diagonals[diagonal - 1, first:last]
+        up_left = diagonals[diagonal - 2, first:last]
+        estimate = left + up - up_left
+        distance_left, distance_up = np.abs(estimate - left), np.abs(estimate - up)
+        distance_up_left = np.abs(estimate - up_left)
+        paeth = np.where((distance_left <= distance_up) & (distance_left <= distance_up_left), left,
+                         np.where(distance_up <= distance_up_left, up, up_left))
+        prediction = (sub[first:last] * left + up_only[first:last] * up + average[first:last] * ((left + up) >> 1) +
+                      paeth_only[first:last] * paeth)
+        diagonals[diagonal, first + 1:last + 1] = (skewed[diagonal, first + 1:last + 1] + prediction) & 255
+    return diagonals[row + column + 2, row + 1].astype(np.uint8)
+
+
+def to_rgba(samples, color_type, bit_depth, palette, transparency):
+    """ (height, width, channels) samples to 8 bit RGBA """
+    if color_type == COLOR_PALETTE:
+        colors = np.full((256, 4), 255, dtype=np.uint8)
+        colors[:len(palette) // 3, :3] = np.frombuffer(palette, dtype=np.uint8).reshape(-1, 3)
+        alphas = np.frombuffer(transparency or b'', dtype=np.uint8)
+        colors[:len(alphas), 3] = alphas
+        return colors[samples[..., 0]]
+
+    height, width, channels = samples.shape
+    rgba = np.empty((height, width, 4), dtype=np.uint8)
+    high = (samples >> (bit_depth - 8)).astype(np.uint8)
+    if color_type in (COLOR_GRAY, COLOR_GRAY_ALPHA):
+        rgba[..., :3] = high[..., :1]
+    else:
+        rgba[..., :3] = high[..., :3]
+    if color_type in (COLOR_GRAY_ALPHA, COLOR_RGBA):
+        rgba[..., 3] = high[..., -1]
+    elif transparency:
+        key = np.frombuffer(transparency, dtype='>u2')[:channels]
+        rgba[..., 3] = np.where((samples == key).all(axis=-1), 0, 255)
+    else:
+        rgba[..., 3] = 255
+    return rgba
+
+
+def loads(data):
+    """ Decodes a png into a (height, width, 4) uint8 RGBA array """
+    data = memoryview(data)
+    header, palette, transparency, compressed = None, None, None, []
+    for chunk_type, chunk in chunks(data):
+        if chunk_type == b'IHDR':
+            header = IHDR.unpack_from(chunk, 0)
+        elif chunk_type == b'PLTE':
+            palette = bytes(chunk)
+        elif chunk_type == b'tRNS':
+            transparency = bytes(chunk)
+        elif chunk_type == b'IDAT':
+            compressed.append(chunk)
+    if header is None:
+        raise Exception("png without header")
+    width, height, bit_depth, color_type, _, _, interlace = header
+    if interlace:
+        raise Exception("Interlaced png files are not supported")
+    if bit_depth not in (8, 16) or color_type not in CHANNELS:
+        raise Exception(f"Unsupported png: color type {color_type}, {bit_depth} bits")
+
+    channels = CHANNELS[color_type]
+    pixel_bytes = channels * bit_depth // 8
+    raw = np.frombuffer(zlib.decompress(b''.join(compressed)), dtype=np.uint8)
+    raw = raw[:height * (width * pixel_bytes + 1)].reshape(height, width * pixel_bytes + 1)
+    filters = raw[:, 0]
+    filtered = raw[:, 1:].reshape(height, width, pixel_bytes)
+    if filters.max(initial=0) > FILTER_PAETH:
+        raise Exception(f"Unknown png filter {filters.max()}")
+    if (filters >= FILTER_AVERAGE).any():
+        rows = unfilter_wavefront(filtered, filters)
+    else:
+        rows = unfilter_rows(filtered, filters)
+
+    if bit_depth == 16:
+        samples = rows.reshape(height, width, channels * 2).view('>u2').astype(np.uint16)
+    else:
+        samples = rows.reshape(height, width, channels)
+    return to_rgba(samples, color_type, bit_depth, palette, transparency)
+
+
+def chunk(chunk_type, data):
+    return CHUNK_HEADER.pack(len(data), chunk_type) + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def dumps(rgba):
+    """ Encodes a (height, width, 4) uint8 array as an 8 bit RGBA png, every row with the Up filter """
+    rgba = np.asarray(rgba, dtype=np.uint8)
+    height, width = rgba.shape[:2]
+    rows = rgba.reshape(height, width * 4)
+    filtered = np.empty((height, width * 4 + 1), dtype=np.uint8)
+    filtered[:, 0] = FILTER_UP
+    filtered[0, 1:] = rows[0]
+    np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+    return b''.join([SIGNATURE,
+                     chunk(b'IHDR', IHDR.pack(width, height, 8, COLOR_RGBA, 0, 0, 0)),
+                     chunk(b'IDAT', zlib.compress(filtered.tobytes(), COMPRESSION_LEVEL)),
+                     chunk(b'IEND', b'')])
+
+
+def read(path):
+    with open(path, 'rb') as png_file:
+        data = png_file.read()
+    Profile.count('bytes read', len(data))
+    return loads(data)
+
+
+def write(rgba, path):
+    """ Writes through a temporary file, so a hard linked file is replaced rather than changed for every link """
+    data = dumps(rgba)
+    replace_file(path, data)
+    Profile.count('bytes written', len(data))
@@ -0,0 +1,131 @@
+""" Stage timings and counters for imports and exports.
+
+Off by default. While it is off stage() hands back one shared do-nothing context and count() returns at once, so
+instrumented code pays a function call per stage. Switched on around a run, every stage is recorded with its
+thread and the counters add up bytes read and written, vertices and faces:
+
+    Profile.start()
+    ...
+    Profile.stop().write('C:/profiles/import')
+
+writes import.json, totals per stage and the counters, and import.trace.json in the Chrome trace event format
+(chrome://tracing or https://ui.perfetto.dev). PesFacemodGlobalData.profile_path turns it on for the operators.
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+class Stage:
+    def __init__(self, profiler, name, details):
+        self.profiler = profiler
+        self.name = name
+        self.details = details
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        # list.append is atomic, so stages on worker threads need no lock
+        self.profiler.stages.append((self.name, self.start, end, threading.get_ident(), self.details))
+        return False
+
+
+class Profiler:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.end = None
+        self.stages = []
+        self.counters = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def stage(self, name, **details):
+        return Stage(self, name, details)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    @property
+    def seconds(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def report(self):
+        """ Calls, total and longest seconds of every stage, and the counters """
+        stages = {}
+        for name, start, end, thread, details in self.stages:
+            stage = stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            stage['calls'] += 1
+            stage['seconds'] += end - start
+            stage['max_seconds'] = max(stage['max_seconds'], end - start)
+        return {'seconds': self.seconds, 'stages': stages, 'counters': dict(self.counters)}
+
+    def chrome_trace(self):
+        """ The stages as complete events and the counters as counter events, times in microseconds """
+        threads = {}
+        events = []
+        for name, start, end, thread, details in self.stages:
+            tid = threads.setdefault(thread, len(threads))
+            events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+                           'ts': (start - self.start) * 1e6, 'dur': (end - start) * 1e6,
+                           'args': {key: str(value) for key, value in details.items()}})
+        for name, value in self.counters.items():
+            events.append({'name': name, 'ph': 'C', 'pid': os.getpid(), 'tid': 0, 'ts': self.seconds * 1e6,
+                           'args': {name: value}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path):
+        """ Writes <path>.json and <path>.trace.json; returns their paths """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        paths = [path + '.json', path + '.trace.json']
+        for out_path, content in zip(paths, (self.report(), self.chrome_trace())):
+            with open(out_path, 'w') as out_file:
+                json.dump(content, out_file, indent=1)
+        return paths
+
+
+current = None
+
+
+def start():
+    global current
+    current = Profiler()
+    return current
+
+
+def stop():
+    """ Ends profiling; returns the Profiler that was recording, None if profiling was off """
+    global current
+    profiler, current = current, None
+    if profiler is not None:
+        profiler.end = time.perf_counter()
+    return profiler
+
+
+def stage(name, **details):
+    """ Context timing the stage name; details (a file name, a submesh) are kept with it for the trace """
+    profiler = current
+    if profiler is None:
+        return NULL_STAGE
+    return Stage(profiler, name, details)
+
+
+def count(name, amount=1):
+    profiler = current
+    if profiler is not None:
+        profiler.count(name, amount)
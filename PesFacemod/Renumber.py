@@ -0,0 +1,84 @@
+""" Renumbering a player: copies <base>/<player_id> to a new id and points the fmdl texture paths at it.
+
+Only the string tables of the fmdl files change, so geometry and textures are never decoded: the strings of the
+fmdl files are patched straight from face.fpk (see Fmdl.replace_strings), every other byte of them is kept, and
+everything else is linked or copied as is.
+"""
+import os
+import re
+import shutil
+
+from . import Fmdl, Fpk
+
+SOURCEIMAGES_PATH = re.compile(r'/Assets/pes16/model/character/face/real/(?P<id>\d+)/sourceimages/', re.IGNORECASE)
+
+# files that tools edit in place, so they are copied rather than sharing the original's data
+COPIED_EXTENSIONS = {'.png', '.tga'}
+
+
+def renumber_string(string, player_id):
+    return SOURCEIMAGES_PATH.sub(f"/Assets/pes16/model/character/face/real/{player_id}/sourceimages/", string)
+
+
+def renumber_fmdl(data, player_id):
+    """ The .fmdl in data with its texture paths moved to player_id; data itself when no string changes """
+    strings = Fmdl.FmdlFile(data).strings
+    renumbered = [renumber_string(string, player_id) for string in strings]
+    if renumbered == strings:
+        return data
+    return Fmdl.replace_strings(data, renumbered)
+
+
+def link_or_copy(source, destination):
+    """ Hard links destination to source where the file system allows it. Our own writers replace files instead of
+    truncating them, so a linked texture is never changed through the new player. """
+    if os.path.splitext(source)[1].lower() not in COPIED_EXTENSIONS:
+        try:
+            os.link(source, destination)
+            return
+        except OSError:
+            pass
+    shutil.copy2(source, destination)
+
+
+def renumber_player(player_path, player_id):
+    """ Copies the player folder to a sibling folder named player_id; returns the new face.fpk path.
+
+    The fmdl files in face.fpk (and in the unpacked face_fpk folder, when there is one) get their sourceimages
+    paths renumbered; the rest of #Win is copied and every other file linked.
+    """
+    destination = os.path.join(os.path.dirname(os.path.normpath(player_path)), str(player_id))
+    if os.path.exists(destination):
+        raise Exception(f"Cannot renumber to an existing folder: {destination}")
+    win_path = os.path.join(player_path, '#Win')
+    face_fpk = os.path.join(win_path, 'face.fpk')
+
+    for folder, folders, files in os.walk(player_path):
+        relative = os.path.relpath(folder, player_path)
+        os.makedirs(os.path.join(destination, relative), exist_ok=True)
+        in_win = os.path.commonpath([os.path.abspath(folder), os.path.abspath(win_path)]) == os.path.abspath(win_path)
+        for name in files:
+            source = os.path.join(folder, name)
+            if os.path.abspath(source) == os.path.abspath(face_fpk):
+                continue
+            target = os.path.join(destination, relative, name)
+            if in_win:
+                shutil.copy2(source, target)
+            else:
+                link_or_copy(source, target)
+
+    new_face_fpk = os.path.join(destination, '#Win', 'face.fpk')
+    unpacked_path = os.path.join(destination, '#Win', 'face_fpk')
+    with Fpk.FpkFile.open(face_fpk) as fpk:
+        files = []
+        for entry in fpk.entries:
+            data = fpk.read(entry.name)
+            if entry.name.lower().endswith('.fmdl'):
+                data = renumber_fmdl(data, player_id)
+                if os.path.isdir(unpacked_path):
+                    with open(Fpk.entry_path(unpacked_path, entry.name), 'wb') as fmdl_file:
+                        fmdl_file.write(data)
+            files.append((entry.name, data))
+        with open(new_face_fpk, 'wb') as fpk_file:
+            Fpk.dump(files, fpk_file, fpk.references, fpk.fpk_type)
+    return new_face_fpk
@@ -0,0 +1,116 @@
+""" Persistent cache of encoded .ftex files, so re-exports skip compressing textures that didn't change.
+
+Entries are keyed by the PNG content together with everything else that goes into the .ftex: the encoder quality
+and the fields kept from the existing .ftex (see Ftex.png_to_ftex). Each entry is a <key>.ftex file in the cache
+directory; its modification time records the last use, and the least recently used entries are removed once the
+directory grows past max_bytes. FileCache does the bookkeeping and is shared with the ImportCache.
+"""
+import hashlib
+import os
+import threading
+
+from .Files import replace_file
+
+# bump when the encoder output changes, so older entries are no longer hit
+CACHE_VERSION = 1
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def cache_key(png_data, quality, texture):
+    """ Key of png_data encoded at quality into an .ftex with the header fields of texture """
+    key = hashlib.sha1(b'%d:%d:' % (CACHE_VERSION, quality))
+    key.update(repr((texture.nrt_flag, texture.unknown_flags, texture.texture_type)).encode())
+    key.update(texture.hash)
+    key.update(png_data)
+    return key.hexdigest()
+
+
+def read_file(path):
+    with open(path, 'rb') as in_file:
+        return in_file.read()
+
+
+def same_file(path, other_path):
+    if not os.path.exists(path) or os.path.getsize(path) != os.path.getsize(other_path):
+        return False
+    with open(path, 'rb') as in_file, open(other_path, 'rb') as other_file:
+        return in_file.read() == other_file.read()
+
+
+class FileCache:
+    """ A directory of files named <key><extension>, trimmed to max_bytes by removing the least recently used """
+
+    def __init__(self, directory, max_bytes, extension):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key + self.extension)
+
+    def lookup(self, key):
+        """ Path of the entry for key, marked as just used; None on a miss """
+        path = self.entry_path(key)
+        with self.lock:
+            if not os.path.exists(path):
+                return None
+            os.utime(path)
+        return path
+
+    def get(self, key, destination):
+        """ Puts the cached file for key at destination; returns False on a miss.
+
+        destination is left alone when it already holds the cached file, so unchanged files cost one hash.
+        """
+        path = self.lookup(key)
+        if path is None:
+            return False
+        if not same_file(destination, path):
+            # replaced, not overwritten: destination may be a hard link to another player's file
+            replace_file(destination, read_file(path))
+        return True
+
+    def put(self, key, source):
+        self.put_data(key, read_file(source))
+
+    def put_data(self, key, data):
+        replace_file(self.entry_path(key), data)
+        with self.lock:
+            self.evict()
+
+    def entries(self):
+        """ (last use, size, file name) of every entry, least recently used first """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.extension):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache fits in max_bytes """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def clear(self):
+        with self.lock:
+            for _, _, name in self.entries():
+                os.remove(os.path.join(self.directory, name))
+
+
+class TextureCache(FileCache):
+    """ Encoded .ftex files, see png_to_ftex """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(directory, max_bytes, '.ftex')
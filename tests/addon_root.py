@@ -0,0 +1,9 @@
+""" pytest plugin: collects the repository root as a plain folder. It holds the Blender addon __init__, which needs
+bpy, so it can't be imported as the package of the tests. """
+import pytest
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_collect_directory(path, parent):
+    if path == parent.config.rootpath:
+        return pytest.Dir.from_parent(parent, path=path)
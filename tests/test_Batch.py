@@ -0,0 +1,137 @@
+import io
+import os
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from PesFacemod import Batch, Fmdl, Fpk, Ftex, Png
+from PesFacemod.FmdlBenchmark import synthetic_model
+
+FMDL_NAME = '/Assets/pes16/model/character/face/real/{}/face_high.fmdl'
+TEXTURE_PATH = '/Assets/pes16/model/character/face/real/{}/sourceimages/face_bsm_alp.ftex'
+
+
+@pytest.fixture(scope='module')
+def model():
+    return synthetic_model(500, 'face', seed=1)
+
+
+def face_model(model, player_id):
+    return replace(model, strings=model.strings + [TEXTURE_PATH.format(player_id)])
+
+
+def write_face_fpk(base, player_id, model):
+    """ <base>/<player_id>/#Win/face.fpk holding a face_high.fmdl """
+    face_fpk = os.path.join(str(base), player_id, '#Win', 'face.fpk')
+    os.makedirs(os.path.dirname(face_fpk))
+    stream = io.BytesIO()
+    Fpk.dump([(FMDL_NAME.format(player_id), bytes(Fmdl.dumps(face_model(model, player_id))))], stream)
+    with open(face_fpk, 'wb') as fpk_file:
+        fpk_file.write(stream.getvalue())
+    return face_fpk
+
+
+def packed_model(face_fpk, player_id):
+    with Fpk.FpkFile.open(face_fpk) as fpk:
+        return Fmdl.loads(fpk.read(FMDL_NAME.format(player_id)))
+
+
+def test_find_face_fpks(tmp_path, model):
+    second = write_face_fpk(tmp_path / 'real', '12346', model)
+    first = write_face_fpk(tmp_path / 'real', '12345', model)
+    os.makedirs(tmp_path / 'other' / '#Win')
+    (tmp_path / 'other' / '#Win' / 'face.fpk').write_bytes(b'')
+    (tmp_path / 'real' / '12345' / '#Win' / 'hair.fpk').write_bytes(b'')
+    assert Batch.find_face_fpks([str(tmp_path)]) == [first, second]
+    assert Batch.find_face_fpks([second]) == [second]
+
+
+def test_validate_model(model):
+    assert Batch.validate_model(model, 'face_high.fmdl') == []
+    mesh_buffer = model.mesh_buffers[0]
+    broken = Fmdl.MeshBuffer(mesh_buffer.positions[:10], mesh_buffer.vertex_data, mesh_buffer.faces)
+    problems = Batch.validate_model(replace(model, mesh_buffers=[broken]), 'face_high.fmdl')
+    assert len(problems) == 2
+    assert problems[0].startswith('face_high.fmdl mesh 0: 10 positions')
+    assert 'past 10 vertices' in problems[1]
+
+
+def test_scale_model(model):
+    scaled = Batch.scale_model(model, 2.0)
+    assert np.allclose(scaled.mesh_buffers[0].positions['position'], model.mesh_buffers[0].positions['position'] * 2)
+    assert scaled.bounding_boxes[0].max_x == model.bounding_boxes[0].max_x * 2
+    assert scaled.bounding_boxes[0].max_w == model.bounding_boxes[0].max_w
+    assert scaled.bones[1].world_y == model.bones[1].world_y * 2
+    # the input model is left as it is
+    assert model.bounding_boxes[0].max_x == 0.5
+
+
+def test_process_face_fpk(tmp_path, model):
+    face_fpk = write_face_fpk(tmp_path, '12345', model)
+    textures = tmp_path / '12345' / 'sourceimages' / '#windx11'
+    os.makedirs(textures)
+    Png.write(np.full((8, 8, 4), 200, dtype=np.uint8), str(textures / 'face_bsm_alp.PNG'))
+
+    result = Batch.process_face_fpk(face_fpk, Batch.BatchOptions(scale=1.5, reencode_textures=True))
+    assert result.error is None and result.output == face_fpk
+    assert {'unpack', 'read', 'scale', 'write', 'textures', 'pack'} <= result.timings.keys()
+    scaled = packed_model(face_fpk, '12345')
+    assert np.allclose(scaled.mesh_buffers[0].positions['position'],
+                       model.mesh_buffers[0].positions['position'] * 1.5)
+    assert Ftex.read(str(textures / 'face_bsm_alp.ftex')).width == 8
+
+
+def test_renumbered_copy(tmp_path, model):
+    face_fpk = write_face_fpk(tmp_path, '12345', model)
+    result = Batch.process_face_fpk(face_fpk, Batch.BatchOptions(renumber={'12345': '23456'}))
+    assert result.error is None
+    assert result.output == str(tmp_path / '23456' / '#Win' / 'face.fpk')
+    renumbered = packed_model(result.output, '12345')
+    assert renumbered.strings[-1] == TEXTURE_PATH.format('23456')
+    # the original is untouched
+    assert packed_model(face_fpk, '12345').strings[-1] == TEXTURE_PATH.format('12345')
+
+
+def test_failures_go_in_the_result(tmp_path, model):
+    mesh_buffer = model.mesh_buffers[0]
+    broken = replace(model, mesh_buffers=[Fmdl.MeshBuffer(mesh_buffer.positions[:10], mesh_buffer.vertex_data[:10],
+                                                          mesh_buffer.faces)])
+    face_fpk = write_face_fpk(tmp_path, '12345', broken)
+    before = os.path.getmtime(face_fpk)
+    result = Batch.process_face_fpk(face_fpk, Batch.BatchOptions(scale=2.0))
+    assert result.output is None and 'past 10 vertices' in result.error
+    assert os.path.getmtime(face_fpk) == before
+
+    missing = Batch.process_face_fpk(str(tmp_path / '1' / '#Win' / 'face.fpk'), Batch.BatchOptions())
+    assert missing.error.startswith('FileNotFoundError')
+
+
+def test_validate_only_leaves_the_file(tmp_path, model):
+    face_fpk = write_face_fpk(tmp_path, '12345', model)
+    with open(face_fpk, 'rb') as fpk_file:
+        before = fpk_file.read()
+    result = Batch.process_face_fpk(face_fpk, Batch.BatchOptions(scale=2.0, validate_only=True))
+    assert result.error is None and result.output is None
+    with open(face_fpk, 'rb') as fpk_file:
+        assert fpk_file.read() == before
+
+
+def test_parse_renumber():
+    assert Batch.parse_renumber(['1:2', '3:4']) == {'1': '2', '3': '4'}
+    with pytest.raises(Exception, match='OLD:NEW'):
+        Batch.parse_renumber(['1-2'])
+
+
+def test_main(tmp_path, model, capsys):
+    write_face_fpk(tmp_path / 'real', '12345', model)
+    write_face_fpk(tmp_path / 'real', '12346', model)
+    assert Batch.main([str(tmp_path), '--workers', '2', '--scale', '1.1']) == 0
+    assert '2 of 2 face.fpk files processed' in capsys.readouterr().out
+    assert Batch.main([str(tmp_path / 'missing')]) == 1
+
+
+def test_run_prints_the_renumbered_copy(tmp_path, model, capsys):
+    face_fpk = write_face_fpk(tmp_path, '12345', model)
+    Batch.run([face_fpk], Batch.BatchOptions(renumber={'12345': '23456'}), workers=1)
+    assert capsys.readouterr().out.startswith(f"OK    {tmp_path / '23456' / '#Win' / 'face.fpk'} (")
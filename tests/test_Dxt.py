@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from PesFacemod import Dxt
+
+QUALITIES = [Dxt.QUALITY_FAST, Dxt.QUALITY_NORMAL, Dxt.QUALITY_HIGH]
+
+
+def sample_images():
+    rng = np.random.default_rng(7)
+    y, x = np.mgrid[:64, :64]
+    gradient = np.stack((x * 4, y * 4, (x + y) * 2, np.full_like(x, 255)), axis=-1).astype(np.uint8)
+    noisy = np.clip(gradient + rng.integers(-24, 24, gradient.shape), 0, 255).astype(np.uint8)
+    return {'gradient': gradient, 'noisy': noisy}
+
+
+def color_error(rgba, quality):
+    height, width = rgba.shape[:2]
+    decoded = Dxt.decode_dxt5(Dxt.encode_dxt5(rgba, quality), width, height)
+    difference = decoded[..., :3].astype(np.float64) - rgba[..., :3]
+    return (difference * difference).mean()
+
+
+@pytest.mark.parametrize('name', ['gradient', 'noisy'])
+def test_error_does_not_grow_with_quality(name):
+    rgba = sample_images()[name]
+    errors = [color_error(rgba, quality) for quality in QUALITIES]
+    for earlier, later in zip(errors, errors[1:]):
+        assert later <= earlier
+
+
+def test_gray_ramp_keeps_its_steps():
+    rgba = np.zeros((4, 4, 4), dtype=np.uint8)
+    rgba[..., 1] = np.array([0, 4, 8, 12])
+    rgba[..., 3] = 255
+    for quality in QUALITIES:
+        decoded = Dxt.decode_dxt5(Dxt.encode_dxt5(rgba, quality), 4, 4)
+        assert decoded[0, :, 1].tolist() == [0, 4, 8, 12]
+
+
+def test_principal_axis_is_unit_length():
+    rgb = np.ascontiguousarray(sample_images()['noisy'][:4, :16, :3].reshape(4, 4, 4, 3).transpose(3, 1, 0, 2)
+                               .reshape(3, 16, 4), dtype=np.float32)
+    x, y, z = Dxt.principal_axis(*rgb)
+    assert np.allclose(x * x + y * y + z * z, 1)
+
+
+@pytest.mark.parametrize('width, height', [(4, 4), (8, 4), (5, 7), (1, 1)])
+def test_flat_colors_round_trip_exactly(width, height):
+    # 5:6:5 representable color, any alpha
+    rgba = np.empty((height, width, 4), dtype=np.uint8)
+    rgba[...] = [0x84, 0x41, 0xC6, 0x7F]
+    data = Dxt.encode_dxt5(rgba)
+    assert len(data) == 16 * ((width + 3) // 4) * ((height + 3) // 4)
+    assert np.array_equal(Dxt.decode_dxt5(data, width, height), rgba)
+
+
+def test_alpha_round_trip():
+    rgba = np.zeros((4, 4, 4), dtype=np.uint8)
+    rgba[..., 3] = np.linspace(0, 255, 16).reshape(4, 4)
+    decoded = Dxt.decode_dxt5(Dxt.encode_dxt5(rgba), 4, 4)
+    assert np.abs(decoded[..., 3].astype(int) - rgba[..., 3]).max() <= 255 / 14 + 1
+
+
+def test_decode_dxt1_transparent_block():
+    # color0 <= color1 selects three colors plus transparent black, index 3 everywhere
+    block = np.array([0, 0, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF], dtype=np.uint8)
+    decoded = Dxt.decode_dxt1(block.tobytes(), 4, 4)
+    assert not decoded.any()
+
+
+def test_mip_maps_reach_one_pixel():
+    levels = Dxt.mip_maps(np.zeros((8, 2, 4), dtype=np.uint8))
+    assert [level.shape[:2] for level in levels] == [(8, 2), (4, 1), (2, 1), (1, 1)]
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from PesFacemod.Files import replace_file
+
+
+def test_replace_file(tmp_path):
+    path = str(tmp_path / 'face.ftex')
+    replace_file(path, b'first')
+    replace_file(path, b'second')
+    with open(path, 'rb') as in_file:
+        assert in_file.read() == b'second'
+    assert os.listdir(tmp_path) == ['face.ftex']
+
+
+def test_hard_links_are_replaced(tmp_path):
+    path, link = str(tmp_path / 'face.ftex'), str(tmp_path / 'other.ftex')
+    replace_file(path, b'shared')
+    os.link(path, link)
+    replace_file(path, b'changed')
+    with open(link, 'rb') as in_file:
+        assert in_file.read() == b'shared'
+
+
+def test_failed_writes_leave_the_file(tmp_path):
+    path = str(tmp_path / 'face.ftex')
+    replace_file(path, b'kept')
+    with pytest.raises(TypeError):
+        replace_file(path, 'not bytes')
+    with open(path, 'rb') as in_file:
+        assert in_file.read() == b'kept'
+    assert os.listdir(tmp_path) == ['face.ftex']
@@ -0,0 +1,149 @@
+from dataclasses import astuple, fields, replace
+
+import numpy as np
+import pytest
+
+from PesFacemod import Fmdl
+from PesFacemod.FmdlBenchmark import synthetic_model
+
+
+@pytest.fixture(scope='module')
+def model():
+    return synthetic_model(500, 'face', seed=1)
+
+
+@pytest.mark.parametrize('block_id', sorted(Fmdl.ENTRY_LAYOUTS))
+def test_entry_tables_match_the_struct_layout(block_id):
+    entry_struct, entry_class = Fmdl.ENTRY_LAYOUTS[block_id]
+    assert Fmdl.ENTRY_DTYPES[block_id].itemsize == entry_struct.size
+    values = [tuple(range(index + 1, index + 1 + len(fields(entry_class)))) for index in (0, 50)]
+    entries = [entry_class(*entry) for entry in values]
+    packed = b''.join(entry_struct.pack(*entry) for entry in values)
+    assert bytes(Fmdl.encode_entries(entries, block_id)) == packed
+    decoded = Fmdl.decode_entries(packed, block_id)
+    assert decoded.tolist() == values
+    assert [astuple(entry_class(*record.tolist())) for record in decoded] == values
+
+
+def test_records_read_as_python_numbers():
+    bones = Fmdl.entry_table(Fmdl.BLOCK_BONES, [Fmdl.Bone(1, 0xFFFF, 0, 0, 0, 0, *[0.5] * 8)])
+    assert type(bones[0].parent) is int and type(bones[0].local_x) is float
+    # uint16 on disk, no wrap around in arithmetic
+    assert bones[0].parent + 1 == 0x10000
+
+
+def test_decoded_tables_are_views_and_copies_keep_padding():
+    entry_struct = Fmdl.ENTRY_LAYOUTS[Fmdl.BLOCK_MESHES][0]
+    # non zero padding bytes survive a copy, the fields are writable afterwards
+    packed = bytearray(entry_struct.pack(1, 2, 3, 4, 5, 6, 7, 8))
+    packed[12:16] = b'\xAA' * 4
+    decoded = Fmdl.decode_entries(bytes(packed), Fmdl.BLOCK_MESHES)
+    assert not decoded.flags.writeable
+    copied = decoded.copy()
+    assert bytes(Fmdl.encode_entries(copied, Fmdl.BLOCK_MESHES)) == bytes(packed)
+    copied.vertex_count = 100
+    assert copied[0].vertex_count == 100 and decoded[0].vertex_count == 5
+
+
+def test_model_round_trip(model):
+    data = bytes(Fmdl.dumps(model))
+    assert bytes(Fmdl.dumps(Fmdl.loads(data))) == data
+    decoded = Fmdl.loads(data)
+    assert decoded.strings == model.strings
+    assert decoded.bone_groups == model.bone_groups
+    assert decoded.block_0x14 == model.block_0x14
+    assert decoded.material_parameter_data == model.material_parameter_data
+    for before, after in zip(model.mesh_buffers, decoded.mesh_buffers):
+        assert np.array_equal(before.positions, after.positions)
+        assert np.array_equal(before.vertex_data, after.vertex_data)
+        assert np.array_equal(before.faces, after.faces)
+
+
+def test_dump_writes_what_dumps_returns(model, tmp_path):
+    path = str(tmp_path / 'face_high.fmdl')
+    Fmdl.write(model, path)
+    with open(path, 'rb') as fmdl_file:
+        assert fmdl_file.read() == bytes(Fmdl.dumps(model))
+    assert Fmdl.read(path).strings == model.strings
+
+
+def test_counts_follow_the_mesh_buffers(model):
+    mesh_buffer = model.mesh_buffers[0]
+    smaller = Fmdl.MeshBuffer(mesh_buffer.positions[:20], mesh_buffer.vertex_data[:20],
+                              mesh_buffer.faces[(mesh_buffer.faces < 20).all(axis=1)])
+    decoded = Fmdl.loads(Fmdl.dumps(replace(model, mesh_buffers=[smaller])))
+    assert decoded.meshes[0].vertex_count == 20
+    assert decoded.meshes[0].face_vertex_count == len(smaller.faces) * 3
+    assert np.array_equal(decoded.mesh_buffers[0].faces, smaller.faces)
+
+
+def test_lazy_file_reads_single_blocks(model):
+    fmdl_file = Fmdl.FmdlFile(bytes(Fmdl.dumps(model)))
+    assert fmdl_file.strings == model.strings
+    assert fmdl_file.cache.keys() == {'strings'}
+    assert np.array_equal(fmdl_file.mesh_buffer(0).faces, model.mesh_buffers[0].faces)
+
+
+def test_file_objects_are_read_on_demand(model, tmp_path):
+    path = str(tmp_path / 'face_high.fmdl')
+    Fmdl.write(model, path)
+    with Fmdl.FmdlFile.open(path) as fmdl_file:
+        assert fmdl_file.bone_groups == model.bone_groups
+        assert Fmdl.dumps(fmdl_file.to_model()) == Fmdl.dumps(model)
+
+
+def test_mapped_read_gives_views_of_the_file(model, tmp_path):
+    path = str(tmp_path / 'face_high.fmdl')
+    Fmdl.write(model, path)
+    mapped = Fmdl.read(path, mapped=True)
+    assert mapped.strings == model.strings
+    assert not mapped.mesh_buffers[0].positions.flags.writeable
+    assert Fmdl.dumps(mapped) == Fmdl.dumps(model)
+
+
+def test_dump_never_seeks(model):
+    class Sink:
+        def __init__(self):
+            self.parts = []
+
+        def write(self, data):
+            self.parts.append(bytes(data))
+
+    sink = Sink()
+    Fmdl.dump(model, sink)
+    assert b''.join(sink.parts) == bytes(Fmdl.dumps(model))
+
+
+def test_unknown_blocks_are_written_back(model):
+    unknown = bytes(range(32))
+    with_unknown = replace(model, section0_blocks=model.section0_blocks + [Fmdl.Section0Block(0x15, 2, 0)],
+                           unknown_blocks={0x15: unknown})
+    data = bytes(Fmdl.dumps(with_unknown))
+    decoded = Fmdl.loads(data)
+    assert decoded.unknown_blocks == {0x15: unknown}
+    assert decoded.section0_block(0x15).entry_count == 2
+    assert bytes(Fmdl.dumps(decoded)) == data
+
+
+def test_section0_length_covers_the_written_blocks(model):
+    data = bytes(Fmdl.dumps(replace(model, header=replace(model.header, section0_length=1234))))
+    header = Fmdl.FmdlFile(data).header
+    last = max(Fmdl.FmdlFile(data).section0_blocks, key=lambda block: block.offset)
+    assert header.section0_length == Fmdl.align(last.offset + Fmdl.RAW_ENTRY_SIZES[last.block_id] * last.entry_count)
+
+
+def test_lod_face_ranges_and_trailer_are_kept(model):
+    face_indices = Fmdl.entry_table(Fmdl.BLOCK_FACE_INDICES, model.face_indices).copy()
+    face_indices.face_vertex_count = np.arange(len(face_indices)) * 3
+    trailer = bytes(range(1, 33))
+    data = bytes(Fmdl.dumps(replace(model, face_indices=face_indices, vertex_buffer_trailer=trailer)))
+    decoded = Fmdl.loads(data)
+    assert decoded.face_indices.tolist() == face_indices.tolist()
+    assert decoded.vertex_buffer_trailer == trailer
+    assert bytes(Fmdl.dumps(decoded)) == data
+
+    # a mesh whose face count changed has every LOD use its whole face list
+    mesh_buffer = decoded.mesh_buffers[0]
+    fewer_faces = Fmdl.MeshBuffer(mesh_buffer.positions, mesh_buffer.vertex_data, mesh_buffer.faces[:-1])
+    changed = Fmdl.loads(Fmdl.dumps(replace(decoded, mesh_buffers=[fewer_faces])))
+    assert changed.face_indices.tolist() == [(0, len(fewer_faces.faces) * 3)] * Fmdl.LODS_PER_MESH
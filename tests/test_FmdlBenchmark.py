@@ -0,0 +1,21 @@
+from PesFacemod import Fmdl, FmdlBenchmark
+
+
+def test_synthetic_models_split_in_submeshes():
+    model = FmdlBenchmark.synthetic_model(FmdlBenchmark.SUBMESH_VERTICES + 10, 'oral')
+    assert [mesh.vertex_count for mesh in model.meshes] == [FmdlBenchmark.SUBMESH_VERTICES // 2 + 5] * 2
+    assert len(model.bone_groups) == 1 and len(model.bones) == FmdlBenchmark.MODEL_TYPES['oral'][0]
+    assert all(len(mesh_buffer.faces) for mesh_buffer in model.mesh_buffers)
+
+
+def test_same_seed_same_model():
+    first = Fmdl.dumps(FmdlBenchmark.synthetic_model(200, 'hair', seed=3))
+    assert Fmdl.dumps(FmdlBenchmark.synthetic_model(200, 'hair', seed=3)) == first
+    assert Fmdl.dumps(FmdlBenchmark.synthetic_model(200, 'hair', seed=4)) != first
+
+
+def test_benchmark_codec(tmp_path):
+    results = FmdlBenchmark.benchmark_codec([100, 400], 'face', repeat=1)
+    assert [row['vertices'] for row in results] == [100, 400]
+    assert all(row['identical'] and row['round_trip_seconds'] > 0 for row in results)
+    assert FmdlBenchmark.main(['--vertices', '100', '--repeat', '1', '--json', str(tmp_path / 'codec.json')]) == 0
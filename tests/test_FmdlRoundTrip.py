@@ -0,0 +1,64 @@
+import io
+from dataclasses import replace
+
+import pytest
+
+from PesFacemod import Fmdl, FmdlRoundTrip, Fpk
+from PesFacemod.FmdlBenchmark import synthetic_model
+
+
+@pytest.fixture(scope='module')
+def data():
+    return bytes(Fmdl.dumps(synthetic_model(300, 'face', seed=5)))
+
+
+def test_identical_files_have_no_divergences(data):
+    assert FmdlRoundTrip.compare(data, data) == []
+
+
+def test_divergences_are_located_by_region(data):
+    fmdl_file = Fmdl.FmdlFile(data)
+    strings = fmdl_file.section1_block(Fmdl.SECTION1_STRINGS)
+    changed = bytearray(data)
+    changed[fmdl_file.header.section1_offset + strings.offset + 3] ^= 0xFF
+    divergences = FmdlRoundTrip.compare(data, bytes(changed))
+    assert [(divergence.region, divergence.differing_bytes, divergence.first_difference)
+            for divergence in divergences] == [('section 1 block 3', 1, 3)]
+
+    shorter = FmdlRoundTrip.compare(data, data[:-16])
+    assert shorter[-1].region == 'file' and shorter[-1].differing_bytes == 16
+
+
+def test_field_divergences_name_the_field(data):
+    model = Fmdl.loads(data)
+    vertex_data = model.mesh_buffers[0].vertex_data.copy()
+    vertex_data['uv0'][7] = 0
+    changed = Fmdl.MeshBuffer(model.mesh_buffers[0].positions, vertex_data, model.mesh_buffers[0].faces)
+    other = replace(model, mesh_buffers=[changed] + model.mesh_buffers[1:])
+    assert [divergence.region for divergence in FmdlRoundTrip.compare_fields(model, other)] == ['mesh 0 uv0']
+
+
+def test_reference_files_look_inside_archives(data, tmp_path):
+    (tmp_path / 'loose').mkdir()
+    (tmp_path / 'loose' / 'oral.fmdl').write_bytes(data)
+    stream = io.BytesIO()
+    Fpk.dump([('/Assets/face_high.fmdl', data), ('/Assets/face.ftex', b'FTEX')], stream)
+    (tmp_path / 'face.fpk').write_bytes(stream.getvalue())
+    found = list(FmdlRoundTrip.reference_files([str(tmp_path)]))
+    assert [name for name, _ in found] == [str(tmp_path / 'face.fpk') + ':/Assets/face_high.fmdl',
+                                           str(tmp_path / 'loose' / 'oral.fmdl')]
+    assert all(file_data == data for _, file_data in found)
+
+
+def test_failures_go_in_the_result():
+    result = FmdlRoundTrip.round_trip('broken.fmdl', b'FMDL' + bytes(12))
+    assert result.error is not None and result.divergences == []
+
+
+def test_unchanged_models_round_trip(tmp_path):
+    for model_type in ('face', 'hair', 'oral'):
+        data = bytes(Fmdl.dumps(synthetic_model(700, model_type, seed=3)))
+        result = FmdlRoundTrip.round_trip(model_type, data)
+        assert result.error is None and result.divergences == []
+        (tmp_path / f'{model_type}.fmdl').write_bytes(data)
+    assert FmdlRoundTrip.main([str(tmp_path)]) == 0
@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+
+from PesFacemod import Fmdl, FmdlVertexBuffer
+from PesFacemod.FmdlBenchmark import decode, encode, synthetic_model
+from PesFacemod.FmdlVertexBuffer import VERTEX_ATTRIBUTES
+
+# small enough to split every submesh in several chunks
+SMALL_BUDGET = 4096
+
+# (usage, data type, offset): position in its own stream, then normal, tangent, color, bone weights, bone ids, uv0
+# and uv1 interleaved in the vertex data stream
+FORMAT_DEFS = [(0, 1, 0), (2, 6, 0), (14, 6, 8), (3, 8, 16), (1, 8, 20), (7, 9, 24), (8, 7, 28), (9, 7, 32)]
+# block 0x0A entries, the third field is the stride of the stream
+MESH_FORMATS = [(0, 1, 12, FmdlVertexBuffer.STREAM_POSITIONS, 0), (0, 7, 36, FmdlVertexBuffer.STREAM_VERTEX_DATA, 12)]
+
+
+def sample_records(count=5):
+    position_dtype, vertex_data_dtype = FmdlVertexBuffer.submesh_dtypes(FORMAT_DEFS, MESH_FORMATS)
+    positions = np.zeros(count, dtype=position_dtype)
+    positions['position'] = np.arange(count * 3).reshape(count, 3)
+    records = np.zeros(count, dtype=vertex_data_dtype)
+    records['normal'] = [0, 0, 1, 0]
+    records['uv0'] = np.linspace(0, 1, count * 2).reshape(count, 2)
+    records['color'] = [255, 0, 51, 255]
+    records['bone_weights'] = [255, 0, 0, 0]
+    records['bone_ids'] = np.arange(count)[:, None] + [0, 1, 2, 3]
+    return positions, records
+
+
+def test_split_vertex_formats():
+    assert FmdlVertexBuffer.split_vertex_formats(FORMAT_DEFS + FORMAT_DEFS[:3]) == [FORMAT_DEFS, FORMAT_DEFS[:3]]
+
+
+def test_record_layout():
+    position_dtype, vertex_data_dtype = FmdlVertexBuffer.submesh_dtypes(FORMAT_DEFS, MESH_FORMATS)
+    assert position_dtype.itemsize == 12 and vertex_data_dtype.itemsize == 36
+    assert vertex_data_dtype.fields['uv1'][1] == 32
+
+
+def test_decode_submesh():
+    positions, records = sample_records()
+    # the streams of the next submesh start 16 byte aligned
+    buffer = positions.tobytes() + bytes(4) + records.tobytes()
+    vertices, next_position, next_vertex_data = FmdlVertexBuffer.decode_submesh(
+        buffer, 0, 64, len(positions), positions.dtype, records.dtype)
+    assert (next_position, next_vertex_data) == (64, 64 + FmdlVertexBuffer.align(len(records) * 36))
+    assert vertices.count == 5
+    assert vertices.positions[1].tolist() == [3, -5, 4]
+    assert vertices.normals.tolist() == [[0, -1, 0]] * 5
+    assert np.allclose(vertices.uvs[:, 1], 1 - records['uv0'][:, 1].astype(np.float32))
+    assert np.allclose(vertices.colors, [1, 0, 0.2, 1])
+    assert vertices.bone_weights[:, 0].tolist() == [1] * 5
+    assert vertices.bone_ids[4].tolist() == [4, 5, 6, 7]
+    assert vertices.uvs_normal.shape == (5, 2)
+
+
+def test_missing_attributes_are_empty():
+    positions, records = sample_records()
+    position_dtype, vertex_data_dtype = FmdlVertexBuffer.submesh_dtypes(FORMAT_DEFS[:2], MESH_FORMATS[:1])
+    buffer = positions.tobytes() + bytes(4) + np.zeros(len(positions), dtype=vertex_data_dtype).tobytes()
+    vertices = FmdlVertexBuffer.decode_submesh(buffer, 0, 64, len(positions), position_dtype, vertex_data_dtype)[0]
+    assert vertices.colors.shape == (0, 4) and vertices.bone_ids.shape == (0, 4) and vertices.uvs.shape == (0, 2)
+
+
+def test_encoding_decoded_records_gives_them_back():
+    positions, records = sample_records()
+    records['normal'][:, 3] = 1
+    vertices = FmdlVertexBuffer.SubmeshVertices.from_records(positions, records)
+    encoded_positions, encoded_records = vertices.to_records(positions.dtype, records.dtype)
+    assert encoded_positions.tobytes() == positions.tobytes()
+    for field in ('normal', 'color', 'bone_weights', 'bone_ids', 'uv0'):
+        assert np.array_equal(encoded_records[field], records[field]), field
+
+
+def test_tangents_are_normalized():
+    positions, records = sample_records(2)
+    vertices = FmdlVertexBuffer.SubmeshVertices(np.zeros((2, 3)), tangents=[[2, 0, 0], [0, 0, -3]])
+    tangents = vertices.to_records(positions.dtype, records.dtype)[1]['tangent']
+    assert tangents.tolist() == [[1, 0, 0, 1], [0, 1, 0, 1]]
+
+
+def test_streams_are_laid_out_16_byte_aligned():
+    chunks = [np.zeros(3, dtype='<f4'), np.ones(5, dtype='<f4')]
+    # placed at 8, the first chunk ends at 20 and the second starts at 32
+    placed, end = FmdlVertexBuffer.layout_stream(chunks, 8)
+    assert [offset for offset, _ in placed] == [8, 32] and end == 64
+    assert bytes(placed[1][1][:4]) == np.float32(1).tobytes()
+    placed, end = FmdlVertexBuffer.layout_faces([[[0, 1, 2]], [[3, 4, 5]]], 0)
+    assert [offset for offset, _ in placed] == [0, 6] and end == 16
+    assert np.frombuffer(placed[1][1], dtype='<u2').tolist() == [3, 4, 5]
+
+
+@pytest.fixture(scope='module')
+def data():
+    return bytes(Fmdl.dumps(synthetic_model(3000, 'hair', seed=2)))
+
+
+def test_encoding_decoded_vertices_is_stable(data):
+    once = bytes(encode(*decode(data)))
+    assert bytes(encode(*decode(once))) == once
+
+
+def test_chunked_decode_and_encode_match_whole(data):
+    model, whole = decode(data, memory_budget=1 << 30)
+    _, chunked = decode(data, memory_budget=SMALL_BUDGET)
+    for whole_vertices, chunked_vertices in zip(whole, chunked):
+        for attribute in VERTEX_ATTRIBUTES:
+            assert np.array_equal(getattr(whole_vertices, attribute), getattr(chunked_vertices, attribute))
+    assert bytes(encode(model, chunked, SMALL_BUDGET)) == bytes(encode(model, whole))
+
+
+def test_chunks_cover_every_vertex():
+    chunk = FmdlVertexBuffer.chunk_vertices(SMALL_BUDGET, 100)
+    ranges = list(FmdlVertexBuffer.chunk_ranges(1000, chunk))
+    assert ranges[0][0] == 0 and ranges[-1][1] == 1000
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+
+
+def test_faces():
+    faces = np.array([[0, 1, 2], [2, 2, 3], [0, 1, 9]], dtype='<u2')
+    assert FmdlVertexBuffer.flip_winding(faces).tolist() == [[2, 1, 0], [3, 2, 2], [9, 1, 0]]
+    out_of_range, degenerate = FmdlVertexBuffer.face_problems(faces, 4)
+    assert out_of_range.tolist() == [False, False, True]
+    assert degenerate.tolist() == [False, True, False]
+    assert FmdlVertexBuffer.index_buffer(faces.astype(np.int32)).dtype == np.dtype('<u2')
+    with pytest.raises(Exception, match='16 bit'):
+        FmdlVertexBuffer.index_buffer([[0, 1, FmdlVertexBuffer.MAX_MESH_VERTICES]])
@@ -0,0 +1,70 @@
+import io
+import os
+
+import pytest
+
+from PesFacemod import Fpk
+
+FILES = [('/Assets/pes16/model/character/face/real/1/face_high.fmdl', bytes(range(256)) * 3),
+         ('/Assets/pes16/model/character/face/real/1/sourceimages/face_bsm_alp.ftex', b'FTEX' + bytes(13)),
+         ('/empty.bin', b'')]
+
+
+def archive(files=FILES, references=(), fpk_type=Fpk.FPK_TYPE_FPK):
+    stream = io.BytesIO()
+    Fpk.dump(files, stream, references, fpk_type)
+    return stream.getvalue()
+
+
+def test_archive_round_trip():
+    data = archive(references=['/Assets/pes16/model/character/common/common.fpk'])
+    fpk = Fpk.FpkFile(data)
+    assert fpk.names() == [name for name, _ in FILES]
+    assert fpk.references == ['/Assets/pes16/model/character/common/common.fpk']
+    for name, content in FILES:
+        assert bytes(fpk.read(name)) == content
+        assert fpk.entry(name).md5 == Fpk.name_hash(name)
+        assert fpk.entry(name).offset % 16 == 0
+    assert len(data) % 16 == 0
+    assert Fpk.HEADER.unpack_from(data)[3] == len(data)
+
+
+def test_layout_is_stable():
+    assert archive() == archive()
+    size, chunks = Fpk.layout_archive(FILES)
+    assert size == len(archive())
+
+
+def test_fpkd_type_and_bad_magic():
+    assert Fpk.FpkFile(archive(fpk_type=Fpk.FPK_TYPE_FPKD)).fpk_type == Fpk.FPK_TYPE_FPKD
+    with pytest.raises(Exception, match='Not an fpk'):
+        Fpk.FpkFile(b'foxfpx' + archive()[6:])
+
+
+def test_missing_entry():
+    with pytest.raises(KeyError):
+        Fpk.FpkFile(archive()).read('/missing')
+
+
+def test_pack_and_unpack(tmp_path):
+    source = tmp_path / 'face_fpk'
+    for name, content in FILES:
+        path = Fpk.entry_path(str(source), name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as out_file:
+            out_file.write(content)
+    fpk_path = str(tmp_path / 'face.fpkd')
+    Fpk.pack(fpk_path, str(source), [name for name, _ in FILES])
+    with Fpk.FpkFile.open(fpk_path) as fpk:
+        assert fpk.fpk_type == Fpk.FPK_TYPE_FPKD
+
+    paths = Fpk.unpack(fpk_path)
+    assert os.path.dirname(paths[0]).startswith(str(tmp_path / 'face_fpkd'))
+    for path, (name, content) in zip(paths, FILES):
+        with open(path, 'rb') as in_file:
+            assert in_file.read() == content
+
+
+def test_entries_stay_inside_the_folder(tmp_path):
+    with pytest.raises(Exception, match='outside'):
+        Fpk.entry_path(str(tmp_path), '/../escape.bin')
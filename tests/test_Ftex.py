@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+import pytest
+
+from PesFacemod import Dxt, Ftex, Png
+
+
+def sample_rgba(size=32):
+    y, x = np.mgrid[:size, :size]
+    return np.stack((x * 8, y * 8, (x + y) * 4, 255 - x * 4), axis=-1).astype(np.uint8)
+
+
+def sample_texture():
+    # a compressible mip map two chunks long, and a one chunk mip map zlib can't shrink
+    large = bytes(Ftex.mip_map_size(Ftex.PIXEL_FORMAT_DXT5, 256, 128, 0))
+    small = np.random.RandomState(0).randint(0, 256, Ftex.mip_map_size(Ftex.PIXEL_FORMAT_DXT5, 256, 128, 1))
+    return Ftex.FtexTexture(Ftex.PIXEL_FORMAT_DXT5, 256, 128, [large, small.astype(np.uint8).tobytes()],
+                            texture_type=Ftex.TEXTURE_TYPE_NORMAL, hash=bytes(range(16)))
+
+
+def test_ftex_round_trip():
+    texture = sample_texture()
+    data = Ftex.dumps(texture)
+    assert Ftex.loads(data) == texture
+    assert Ftex.dumps(Ftex.loads(data)) == data
+    header_only = Ftex.loads(data, with_mip_maps=False)
+    assert header_only.mip_maps == [] and header_only.hash == texture.hash
+
+
+def test_dds_round_trip():
+    texture = sample_texture()
+    dds = Ftex.dumps_dds(texture)
+    decoded = Ftex.loads_dds(dds, template=texture)
+    assert decoded == texture
+    assert Ftex.dumps_dds(decoded) == dds
+
+
+@pytest.mark.parametrize('pixel_format', [Ftex.PIXEL_FORMAT_DXT1, Ftex.PIXEL_FORMAT_A8R8G8B8, Ftex.PIXEL_FORMAT_L8])
+def test_dds_pixel_formats(pixel_format):
+    mip_maps = [bytes(Ftex.mip_map_size(pixel_format, 8, 4, level)) for level in range(4)]
+    texture = Ftex.FtexTexture(pixel_format, 8, 4, mip_maps)
+    assert Ftex.loads_dds(Ftex.dumps_dds(texture)) == texture
+
+
+def test_unsupported_dds_format():
+    with pytest.raises(Exception, match='Unsupported'):
+        Ftex.dds_pixel_format(Ftex.DDPF_FOURCC, b'DXT3', 0, [0, 0, 0, 0])
+
+
+def test_file_conversions(tmp_path):
+    texture = sample_texture()
+    ftex_path = str(tmp_path / 'face_nrm.ftex')
+    Ftex.write(texture, ftex_path)
+    dds_path = Ftex.ftex_to_dds(ftex_path)
+    assert dds_path == str(tmp_path / 'face_nrm.dds')
+    with open(dds_path, 'rb') as dds_file:
+        assert dds_file.read() == Ftex.dumps_dds(texture)
+
+    # the texture type and hash of the .ftex being replaced are kept
+    Ftex.dds_to_ftex(dds_path)
+    assert Ftex.read(ftex_path) == texture
+
+
+def test_rgba_round_trip():
+    rgba = sample_rgba()
+    texture = Ftex.from_rgba(rgba, Dxt.QUALITY_HIGH)
+    assert len(texture.mip_maps) == 6
+    assert [len(mip_map) for mip_map in texture.mip_maps] == \
+        [Ftex.mip_map_size(Ftex.PIXEL_FORMAT_DXT5, 32, 32, level) for level in range(6)]
+    decoded = Ftex.to_rgba(Ftex.loads(Ftex.dumps(texture)))
+    assert np.abs(decoded.astype(int) - rgba).mean() < 4
+
+
+def test_png_conversions(tmp_path):
+    rgba = sample_rgba()
+    png_path = str(tmp_path / 'face_bsm_alp.png')
+    Png.write(rgba, png_path)
+    ftex_path = Ftex.png_to_ftex(png_path)
+    assert ftex_path == os.path.splitext(png_path)[0] + '.ftex'
+
+    # the texture type of an existing .ftex is kept
+    Ftex.write(Ftex.FtexTexture(Ftex.PIXEL_FORMAT_DXT5, 4, 4, [bytes(16)], texture_type=Ftex.TEXTURE_TYPE_NORMAL),
+               ftex_path)
+    Ftex.png_to_ftex(png_path)
+    assert Ftex.read(ftex_path, with_mip_maps=False).texture_type == Ftex.TEXTURE_TYPE_NORMAL
+
+    decoded = Png.read(Ftex.ftex_to_png(ftex_path, str(tmp_path / 'decoded.png')))
+    assert decoded.shape == rgba.shape
+    assert np.abs(decoded.astype(int) - rgba).mean() < 4
+
+
+def test_convert_textures_reports_failures(tmp_path):
+    results = Ftex.convert_textures(Ftex.ftex_to_png, [str(tmp_path / 'missing.ftex')] * 2, workers=2)
+    assert [type(result.error) for result in results] == [FileNotFoundError] * 2
+
+
+def test_convert_textures_keeps_the_source_order(tmp_path):
+    sources = []
+    for index in range(4):
+        sources.append(str(tmp_path / f'texture_{index}.png'))
+        Png.write(sample_rgba(8), sources[-1])
+    results = Ftex.convert_textures(Ftex.png_to_ftex, sources, workers=3, quality=Dxt.QUALITY_FAST)
+    assert [result.source for result in results] == sources
+    assert [result.path for result in results] == [os.path.splitext(source)[0] + '.ftex' for source in sources]
+    assert all(result.error is None and os.path.exists(result.path) for result in results)
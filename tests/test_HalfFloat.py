@@ -0,0 +1,30 @@
+import numpy as np
+
+from PesFacemod import HalfFloat
+
+ALL_BITS = np.arange(1 << 16, dtype=np.uint16)
+
+
+def test_decode_matches_numpy_for_every_bit_pattern():
+    expected = ALL_BITS.view('<f2').astype(np.float32)
+    decoded = HalfFloat.decode(ALL_BITS)
+    assert np.array_equal(decoded, expected, equal_nan=True)
+    assert np.array_equal(HalfFloat.decode(ALL_BITS.view('<f2')), expected, equal_nan=True)
+
+
+def test_every_value_round_trips():
+    finite = ALL_BITS[np.isfinite(ALL_BITS.view('<f2'))]
+    assert np.array_equal(HalfFloat.encode(HalfFloat.decode(finite)), finite)
+
+
+def test_encode_rounds_to_nearest_even():
+    # 1 + 2^-11 lies halfway between 1 and the next float16, 1 + 2^-10
+    assert HalfFloat.encode([1 + 2 ** -11, 1 + 3 * 2 ** -11]).tolist() == [0x3C00, 0x3C02]
+    assert HalfFloat.encode([1e6, -1e6]).tolist() == [0x7C00, 0xFC00]
+
+
+def test_single_values():
+    assert HalfFloat.to_float(0x3C00) == 1.0
+    assert HalfFloat.from_float(-2.0) == 0xC000
+    assert HalfFloat.from_float(1e6) == 0x7C00
+    assert all(HalfFloat.from_float(HalfFloat.to_float(bits)) == bits for bits in range(0, 0x7C00, 97))
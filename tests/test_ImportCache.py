@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from PesFacemod import Fmdl, ImportCache
+from PesFacemod.FmdlBenchmark import synthetic_model
+from PesFacemod.FmdlVertexBuffer import VERTEX_ATTRIBUTES
+
+
+@pytest.fixture
+def fmdl_path(tmp_path):
+    path = str(tmp_path / 'face_high.fmdl')
+    Fmdl.write(synthetic_model(300, 'face', seed=5), path)
+    return path
+
+
+def assert_same_vertices(submesh_vertices, other_vertices):
+    assert len(submesh_vertices) == len(other_vertices)
+    for vertices, other in zip(submesh_vertices, other_vertices):
+        for attribute in VERTEX_ATTRIBUTES:
+            assert np.array_equal(getattr(vertices, attribute), getattr(other, attribute))
+
+
+def test_second_read_is_a_hit(tmp_path, fmdl_path):
+    cache = ImportCache.ImportCache(str(tmp_path / 'cache'))
+    model, decoded = cache.read_model(fmdl_path)
+    assert len(cache.models.entries()) == 1
+    cached_model, cached = cache.read_model(fmdl_path)
+    assert cached_model.strings == model.strings
+    assert_same_vertices(cached, decoded)
+    with open(fmdl_path, 'rb') as fmdl_file:
+        entry_path = cache.models.lookup(ImportCache.model_key(fmdl_file.read()))
+    with np.load(entry_path, allow_pickle=False) as arrays:
+        assert all(arrays[name].dtype != object for name in arrays.files)
+
+
+@pytest.mark.parametrize('planted', [
+    # a pickled object array is refused by np.load
+    {'submesh_count': np.array(1), 'positions_0': np.array([object()], dtype=object)},
+    # arrays that don't fit the model
+    {'submesh_count': np.array(1), **{f'{attribute}_0': np.zeros((3, 2), np.float32)
+                                      for attribute in VERTEX_ATTRIBUTES}},
+    {'submesh_count': np.array(7)},
+])
+def test_bad_entries_are_decoded_again(tmp_path, fmdl_path, planted):
+    cache = ImportCache.ImportCache(str(tmp_path / 'cache'))
+    _, decoded = cache.read_model(fmdl_path)
+    with open(fmdl_path, 'rb') as fmdl_file:
+        entry_path = cache.models.entry_path(ImportCache.model_key(fmdl_file.read()))
+    with open(entry_path, 'wb') as entry_file:
+        np.savez(entry_file, **planted)
+    _, read_again = cache.read_model(fmdl_path)
+    assert_same_vertices(read_again, decoded)
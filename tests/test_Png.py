@@ -0,0 +1,101 @@
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+from PesFacemod import Png
+
+
+def sample_rgba(height=9, width=13):
+    rng = np.random.RandomState(3)
+    return rng.randint(0, 256, (height, width, 4)).astype(np.uint8)
+
+
+def paeth(left, up, up_left):
+    estimate = left + up - up_left
+    distances = abs(estimate - left), abs(estimate - up), abs(estimate - up_left)
+    if distances[0] <= distances[1] and distances[0] <= distances[2]:
+        return left
+    return up if distances[1] <= distances[2] else up_left
+
+
+def filter_row(row, previous, filter_type, pixel_bytes):
+    """ Reference PNG filter of one row of bytes, as lists of ints """
+    filtered = []
+    for index, value in enumerate(row):
+        left = row[index - pixel_bytes] if index >= pixel_bytes else 0
+        up = previous[index]
+        up_left = previous[index - pixel_bytes] if index >= pixel_bytes else 0
+        prediction = [0, left, up, (left + up) // 2, paeth(left, up, up_left)][filter_type]
+        filtered.append((value - prediction) % 256)
+    return filtered
+
+
+def encode_png(samples, color_type, filters, bit_depth=8, extra_chunks=()):
+    height, width = samples.shape[:2]
+    raw = samples.astype('>u2' if bit_depth == 16 else np.uint8).reshape(height, -1).view(np.uint8)
+    pixel_bytes = raw.shape[1] // width
+    rows, previous = [], [0] * raw.shape[1]
+    for row, filter_type in zip(raw.tolist(), filters):
+        rows.append(bytes([filter_type] + filter_row(row, previous, filter_type, pixel_bytes)))
+        previous = row
+    return b''.join([Png.SIGNATURE, Png.chunk(b'IHDR', Png.IHDR.pack(width, height, bit_depth, color_type, 0, 0, 0))] +
+                    [Png.chunk(chunk_type, data) for chunk_type, data in extra_chunks] +
+                    [Png.chunk(b'IDAT', zlib.compress(b''.join(rows))), Png.chunk(b'IEND', b'')])
+
+
+def test_written_png_reads_back():
+    rgba = sample_rgba()
+    assert np.array_equal(Png.loads(Png.dumps(rgba)), rgba)
+
+
+def test_write_and_read_a_file(tmp_path):
+    rgba = sample_rgba(4, 4)
+    path = str(tmp_path / 'texture.png')
+    Png.write(rgba, path)
+    assert np.array_equal(Png.read(path), rgba)
+
+
+@pytest.mark.parametrize('filters', [[Png.FILTER_NONE] * 9, [Png.FILTER_SUB, Png.FILTER_UP] * 4 + [0],
+                                     [Png.FILTER_AVERAGE] * 9, [Png.FILTER_PAETH] * 9, [0, 1, 2, 3, 4, 4, 3, 2, 1]])
+def test_every_filter(filters):
+    rgba = sample_rgba()
+    assert np.array_equal(Png.loads(encode_png(rgba, Png.COLOR_RGBA, filters)), rgba)
+
+
+def test_color_types():
+    rgba = sample_rgba()
+    filters = [Png.FILTER_PAETH] * len(rgba)
+    gray = Png.loads(encode_png(rgba[..., :1], Png.COLOR_GRAY, filters))
+    assert np.array_equal(gray[..., 2], rgba[..., 0]) and (gray[..., 3] == 255).all()
+    gray_alpha = Png.loads(encode_png(rgba[..., [0, 3]], Png.COLOR_GRAY_ALPHA, filters))
+    assert np.array_equal(gray_alpha[..., 3], rgba[..., 3])
+    rgb = Png.loads(encode_png(rgba[..., :3], Png.COLOR_RGB, filters))
+    assert np.array_equal(rgb[..., :3], rgba[..., :3]) and (rgb[..., 3] == 255).all()
+
+
+def test_sixteen_bit_channels_keep_their_high_byte():
+    samples = sample_rgba().astype(np.uint16) * 257 + 1
+    decoded = Png.loads(encode_png(samples, Png.COLOR_RGBA, [Png.FILTER_SUB] * len(samples), bit_depth=16))
+    assert np.array_equal(decoded, (samples >> 8).astype(np.uint8))
+
+
+def test_palette_with_transparency():
+    indices = np.array([[0, 1], [2, 1]], dtype=np.uint8)[..., None]
+    palette = bytes([255, 0, 0, 0, 255, 0, 0, 0, 255])
+    decoded = Png.loads(encode_png(indices, Png.COLOR_PALETTE, [0, 0],
+                                   extra_chunks=[(b'PLTE', palette), (b'tRNS', bytes([128]))]))
+    assert decoded.tolist() == [[[255, 0, 0, 128], [0, 255, 0, 255]], [[0, 0, 255, 255], [0, 255, 0, 255]]]
+
+
+def test_rgb_transparency_key():
+    rgb = np.array([[[1, 2, 3], [4, 5, 6]]], dtype=np.uint8)
+    decoded = Png.loads(encode_png(rgb, Png.COLOR_RGB, [0], extra_chunks=[(b'tRNS', struct.pack('>3H', 4, 5, 6))]))
+    assert decoded[..., 3].tolist() == [[255, 0]]
+
+
+def test_interlaced_is_refused():
+    data = Png.SIGNATURE + Png.chunk(b'IHDR', Png.IHDR.pack(1, 1, 8, Png.COLOR_RGBA, 0, 0, 1))
+    with pytest.raises(Exception, match='Interlaced'):
+        Png.loads(data)
@@ -0,0 +1,52 @@
+import json
+import threading
+
+import numpy as np
+
+from PesFacemod import Png, Profile
+
+
+def test_disabled_profiling_records_nothing():
+    assert Profile.current is None
+    assert Profile.stage('decode', file='face_high.fmdl') is Profile.NULL_STAGE
+    with Profile.stage('decode'):
+        Profile.count('vertices', 10)
+    assert Profile.stop() is None
+
+
+def decode_texture():
+    with Profile.stage('texture'):
+        pass
+
+
+def test_profile_run_writes_the_report_and_trace(tmp_path):
+    Profile.start()
+    try:
+        for mesh in range(3):
+            with Profile.stage('decode mesh', submesh=mesh):
+                Profile.count('vertices', 100)
+        worker = threading.Thread(target=decode_texture)
+        worker.start()
+        worker.join()
+        Png.write(np.zeros((4, 4, 4), dtype=np.uint8), str(tmp_path / 'texture.png'))
+    finally:
+        profiler = Profile.stop()
+    assert Profile.current is None
+
+    report_path, trace_path = profiler.write(str(tmp_path / 'profiles' / 'import'))
+    with open(report_path) as report_file:
+        report = json.load(report_file)
+    assert report['stages']['decode mesh']['calls'] == 3
+    assert report['stages']['texture']['calls'] == 1
+    assert report['stages']['decode mesh']['max_seconds'] <= report['stages']['decode mesh']['seconds']
+    assert report['counters']['vertices'] == 300
+    assert report['counters']['bytes written'] > 0
+
+    with open(trace_path) as trace_file:
+        events = json.load(trace_file)['traceEvents']
+    stages = [event for event in events if event['ph'] == 'X']
+    assert [event['args'] for event in stages if event['name'] == 'decode mesh'] == \
+        [{'submesh': '0'}, {'submesh': '1'}, {'submesh': '2'}]
+    assert len({event['tid'] for event in stages}) == 2
+    counters = {event['name']: event['args'] for event in events if event['ph'] == 'C'}
+    assert counters['vertices'] == {'vertices': 300}
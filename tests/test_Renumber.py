@@ -0,0 +1,86 @@
+import os
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from PesFacemod import Fmdl, Fpk, Renumber
+from PesFacemod.FmdlBenchmark import synthetic_model
+
+
+def game_model(strings_first=False):
+    """ A face model with LOD face ranges and trailer bytes the writer doesn't produce by itself """
+    model = synthetic_model(400, 'face', seed=4)
+    face_indices = Fmdl.entry_table(Fmdl.BLOCK_FACE_INDICES, model.face_indices).copy()
+    face_indices.first_face_vertex = np.arange(len(face_indices)) * 6
+    face_indices.face_vertex_count = 300 - np.arange(len(face_indices)) * 30
+    section1_blocks = model.section1_blocks
+    if strings_first:
+        section1_blocks = sorted(section1_blocks, key=lambda block: block.block_id != Fmdl.SECTION1_STRINGS)
+    return replace(model, face_indices=face_indices, vertex_buffer_trailer=bytes(range(7, 39)),
+                   section1_blocks=section1_blocks)
+
+
+def unchanged_regions(fmdl_file):
+    """ (offset, size) of every region renumbering doesn't touch """
+    header = fmdl_file.header
+    directory_end = header.blocks_offset + Fmdl.SECTION0_BLOCK.size * len(fmdl_file.section0_blocks)
+    strings = fmdl_file.section0_block(Fmdl.BLOCK_STRINGS)
+    strings_start = header.section0_offset + strings.offset
+    return [(0, Fmdl.HEADER.size - 12), (Fmdl.HEADER.size, directory_end - Fmdl.HEADER.size),
+            (header.section0_offset, strings.offset),
+            (strings_start + Fmdl.STRING_DEF.size * strings.entry_count,
+             header.section1_offset - strings_start - Fmdl.STRING_DEF.size * strings.entry_count)] + \
+        [(header.section1_offset + block.offset, block.length) for block in fmdl_file.section1_blocks
+         if block.block_id != Fmdl.SECTION1_STRINGS]
+
+
+@pytest.mark.parametrize('strings_first', [False, True])
+def test_only_strings_change(strings_first):
+    data = bytes(Fmdl.dumps(game_model(strings_first)))
+    renumbered = bytes(Renumber.renumber_fmdl(data, 123456))
+    before, after = Fmdl.FmdlFile(data), Fmdl.FmdlFile(renumbered)
+
+    assert after.strings == [Renumber.renumber_string(string, 123456) for string in before.strings]
+    assert after.strings != before.strings
+    assert [(block.block_id, block.entry_count, block.offset) for block in after.section0_blocks] == \
+        [(block.block_id, block.entry_count, block.offset) for block in before.section0_blocks]
+    for (offset, size), (new_offset, new_size) in zip(unchanged_regions(before), unchanged_regions(after)):
+        assert size == new_size and new_offset % 16 == offset % 16
+        assert renumbered[new_offset:new_offset + size] == data[offset:offset + size]
+    assert after.face_indices.tolist() == before.face_indices.tolist()
+    assert after.vertex_buffer_trailer == before.vertex_buffer_trailer
+    for mesh_buffer, new_mesh_buffer in zip(before.mesh_buffers, after.mesh_buffers):
+        assert np.array_equal(mesh_buffer.vertex_data, new_mesh_buffer.vertex_data)
+        assert np.array_equal(mesh_buffer.faces, new_mesh_buffer.faces)
+
+
+def test_nothing_to_renumber():
+    data = bytes(Fmdl.dumps(game_model()))
+    assert Renumber.renumber_fmdl(data, 0) is data
+
+
+def test_string_count_must_match():
+    with pytest.raises(Exception, match='string definitions'):
+        Fmdl.replace_strings(bytes(Fmdl.dumps(game_model())), ['only one'])
+
+
+def test_renumber_player(tmp_path):
+    player = tmp_path / '102030'
+    (player / '#Win').mkdir(parents=True)
+    (player / 'sourceimages').mkdir()
+    (player / 'sourceimages' / 'face_bsm_alp.png').write_bytes(b'png data')
+    data = bytes(Fmdl.dumps(game_model()))
+    other = ('/Assets/pes16/model/character/face/real/102030/sourceimages/face_bsm_alp.ftex', b'FTEX')
+    with open(str(player / '#Win' / 'face.fpk'), 'wb') as fpk_file:
+        Fpk.dump([('/Assets/pes16/model/character/face/real/102030/face_high.fmdl', data), other], fpk_file)
+
+    new_fpk = Renumber.renumber_player(str(player), 405060)
+    assert new_fpk == os.path.join(str(tmp_path / '405060'), '#Win', 'face.fpk')
+    assert (tmp_path / '405060' / 'sourceimages' / 'face_bsm_alp.png').read_bytes() == b'png data'
+    with Fpk.FpkFile.open(new_fpk) as fpk:
+        assert bytes(fpk.read(other[0])) == other[1]
+        strings = Fmdl.FmdlFile(fpk.read(fpk.names()[0])).strings
+    assert '/Assets/pes16/model/character/face/real/405060/sourceimages/face_bsm_alp.ftex' in strings
+    with pytest.raises(Exception, match='existing folder'):
+        Renumber.renumber_player(str(player), 405060)
@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+import pytest
+
+from PesFacemod import Dxt, Ftex, Png
+from PesFacemod.TextureCache import FileCache, TextureCache, cache_key
+
+
+def write_file(path, data, mtime=None):
+    with open(path, 'wb') as out_file:
+        out_file.write(data)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def read_file(path):
+    with open(path, 'rb') as in_file:
+        return in_file.read()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TextureCache(str(tmp_path / 'cache'), max_bytes=1000)
+
+
+def test_miss_then_hit(cache, tmp_path):
+    assert not cache.get('key', str(tmp_path / 'out.ftex'))
+    cache.put('key', write_file(tmp_path / 'encoded.ftex', b'ftex data'))
+    assert cache.get('key', str(tmp_path / 'out.ftex'))
+    assert read_file(tmp_path / 'out.ftex') == b'ftex data'
+
+
+def test_identical_file_is_left_alone(cache, tmp_path):
+    cache.put('key', write_file(tmp_path / 'encoded.ftex', b'ftex data'))
+    path = write_file(tmp_path / 'out.ftex', b'ftex data', mtime=1000000)
+    assert cache.get('key', path)
+    assert os.stat(path).st_mtime == 1000000
+
+    write_file(path, b'ftex dat!', mtime=1000000)
+    assert cache.get('key', path)
+    assert read_file(path) == b'ftex data'
+
+
+def test_least_recently_used_entries_go_first(cache, tmp_path):
+    source = write_file(tmp_path / 'encoded.ftex', bytes(300))
+    for age, key in enumerate(('new', 'old', 'used')):
+        cache.put(key, source)
+        os.utime(cache.entry_path(key), (1000000 - age * 1000, 1000000 - age * 1000))
+    # a hit counts as a use, 'old' is now the least recently used entry
+    cache.get('used', str(tmp_path / 'out.ftex'))
+    cache.put('newest', source)
+    assert sorted(os.listdir(cache.directory)) == ['new.ftex', 'newest.ftex', 'used.ftex']
+
+
+def test_entries_bigger_than_the_cap_are_not_kept(cache, tmp_path):
+    cache.put('key', write_file(tmp_path / 'encoded.ftex', bytes(2000)))
+    assert os.listdir(cache.directory) == []
+
+
+def test_png_to_ftex_takes_unchanged_textures_from_the_cache(cache, tmp_path, monkeypatch):
+    y, x = np.mgrid[:16, :16]
+    png_path = str(tmp_path / 'face_bsm_alp.png')
+    Png.write(np.stack((x * 16, y * 16, x + y, x * 0 + 255), axis=-1).astype(np.uint8), png_path)
+    ftex_path = Ftex.png_to_ftex(png_path, quality=Dxt.QUALITY_FAST, cache=cache)
+    encoded = read_file(ftex_path)
+    assert len(os.listdir(cache.directory)) == 1
+
+    def no_encoding(*args, **kwargs):
+        raise AssertionError('encoded again')
+
+    monkeypatch.setattr(Ftex, 'from_rgba', no_encoding)
+    os.remove(ftex_path)
+    Ftex.png_to_ftex(png_path, quality=Dxt.QUALITY_FAST, cache=cache)
+    assert read_file(ftex_path) == encoded
+
+    # another quality is another entry
+    monkeypatch.undo()
+    Ftex.png_to_ftex(png_path, quality=Dxt.QUALITY_HIGH, cache=cache)
+    assert len(os.listdir(cache.directory)) == 2
+
+
+def test_keys_cover_the_kept_ftex_fields():
+    texture = Ftex.FtexTexture(Ftex.PIXEL_FORMAT_DXT5, 0, 0)
+    key = cache_key(b'png', Dxt.QUALITY_NORMAL, texture)
+    assert cache_key(b'png', Dxt.QUALITY_NORMAL, texture) == key
+    assert cache_key(b'png!', Dxt.QUALITY_NORMAL, texture) != key
+    assert cache_key(b'png', Dxt.QUALITY_HIGH, texture) != key
+    normal_map = Ftex.FtexTexture(Ftex.PIXEL_FORMAT_DXT5, 0, 0, texture_type=Ftex.TEXTURE_TYPE_NORMAL)
+    assert cache_key(b'png', Dxt.QUALITY_NORMAL, normal_map) != key
+
+
+def test_hard_linked_destinations_are_replaced(cache, tmp_path):
+    cache.put_data('key', b'new ftex!')
+    path = write_file(tmp_path / 'out.ftex', b'old ftex!')
+    os.link(path, str(tmp_path / 'other_player.ftex'))
+    assert cache.get('key', path)
+    assert read_file(path) == b'new ftex!'
+    assert read_file(tmp_path / 'other_player.ftex') == b'old ftex!'
+
+
+def test_size_and_clear(tmp_path):
+    cache = FileCache(str(tmp_path / 'cache'), 1000, '.bin')
+    cache.put_data('first', bytes(100))
+    cache.put_data('second', bytes(50))
+    write_file(tmp_path / 'cache' / 'unrelated.txt', bytes(10))
+    assert cache.size() == 150
+    cache.clear()
+    assert os.listdir(cache.directory) == ['unrelated.txt']